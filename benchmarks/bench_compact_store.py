@@ -0,0 +1,174 @@
+"""Compare the Chroma vector path with the compact quantized store.
+
+Builds each store from the same clustered synthetic vectors in one
+subprocess, then opens it in a fresh subprocess to query, so disk use,
+serving memory, latency and recall@k (against exact float32 search) are
+measured independently per mode:
+
+    python -m benchmarks.bench_compact_store --documents 10 --chunks-per-doc 500 --dim 1536
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import configure_environment
+
+MODES = ["chroma", "float16", "int8", "int8+rerank"]
+
+def make_vectors(documents: int, chunks_per_doc: int, dim: int, seed: int):
+    """Clustered unit vectors per document, like chunks about a handful of topics."""
+    import numpy as np
+    
+    rng = np.random.default_rng(seed)
+    vectors = {}
+    for d in range(documents):
+        centers = rng.standard_normal((20, dim)).astype(np.float32)
+        assignments = rng.integers(0, len(centers), chunks_per_doc)
+        doc_vectors = centers[assignments] + 0.6 * rng.standard_normal((chunks_per_doc, dim)).astype(np.float32)
+        vectors[f"doc-{d:04d}"] = doc_vectors / np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+    return vectors
+
+def make_queries(vectors, queries: int, seed: int):
+    import numpy as np
+    
+    rng = np.random.default_rng(seed + 1)
+    document_ids = sorted(vectors)
+    result = []
+    for _ in range(queries):
+        document_id = document_ids[rng.integers(len(document_ids))]
+        doc_vectors = vectors[document_id]
+        query = doc_vectors[rng.integers(len(doc_vectors))] + 0.3 * rng.standard_normal(doc_vectors.shape[1])
+        result.append((document_id, (query / np.linalg.norm(query)).astype(np.float32)))
+    return result
+
+def open_store(mode: str, path: str):
+    if mode == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=path)
+        return client.get_or_create_collection(name="documents", metadata={"hnsw:space": "cosine"})
+    from src.compact_store import CompactVectorStore
+    quantization = mode.split("+")[0]
+    return CompactVectorStore(root=path, quantization=quantization, rerank=mode.endswith("+rerank"))
+
+def build(mode: str, path: str, args):
+    """Child mode: write every document's vectors into the store."""
+    configure_environment()
+    vectors = make_vectors(args.documents, args.chunks_per_doc, args.dim, args.seed)
+    store = open_store(mode, path)
+    
+    start = time.perf_counter()
+    for document_id, doc_vectors in vectors.items():
+        texts = [f"{document_id} chunk {i}" for i in range(len(doc_vectors))]
+        for offset in range(0, len(doc_vectors), 500):
+            batch = doc_vectors[offset:offset + 500]
+            if mode == "chroma":
+                store.add(
+                    ids=[f"{document_id}_{offset + i}" for i in range(len(batch))],
+                    embeddings=batch.tolist(),
+                    documents=texts[offset:offset + len(batch)],
+                    metadatas=[{"user_id": "bench", "document_id": document_id}] * len(batch)
+                )
+            else:
+                store.add(document_id, offset, batch, texts[offset:offset + len(batch)])
+    print(json.dumps({"build_seconds": time.perf_counter() - start}))
+
+def query(mode: str, path: str, args):
+    """Child mode: open an existing store and time top-k queries."""
+    import numpy as np
+    
+    configure_environment()
+    vectors = make_vectors(args.documents, args.chunks_per_doc, args.dim, args.seed)
+    queries = make_queries(vectors, args.queries, args.seed)
+    truth = [
+        set(np.argsort(-(vectors[document_id] @ q))[:args.k].tolist())
+        for document_id, q in queries
+    ]
+    del vectors
+    rss_before = current_rss_kb()
+    
+    store = open_store(mode, path)
+    latencies = []
+    recalls = []
+    for (document_id, q), expected in zip(queries, truth):
+        start = time.perf_counter()
+        if mode == "chroma":
+            results = store.query(
+                query_embeddings=[q.tolist()],
+                n_results=args.k,
+                where={"document_id": {"$eq": document_id}}
+            )
+            found = {int(chunk_id.rsplit("_", 1)[1]) for chunk_id in results["ids"][0]}
+        else:
+            found = {position for position, _, _ in store.query(document_id, q, args.k)}
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(found & expected) / args.k)
+    
+    rss_after = current_rss_kb()
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "query_ms_p50": round(statistics.median(latencies), 2),
+        "query_ms_p95": round(sorted(latencies)[int(0.95 * (len(latencies) - 1))], 2),
+        f"recall_at_{args.k}": round(statistics.mean(recalls), 4),
+        "peak_rss_mb": round(peak_rss / 1024, 1),
+        "serving_rss_mb": round((rss_after - rss_before) / 1024, 1)
+    }))
+
+def current_rss_kb() -> int:
+    # Resident pages right now (Linux), unlike ru_maxrss which only ever grows
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+def disk_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--chunks-per-doc", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run", choices=["build", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.run:
+        (build if args.run == "build" else query)(args.mode, args.path, args)
+        return
+    
+    passthrough = [
+        "--documents", str(args.documents), "--chunks-per-doc", str(args.chunks_per_doc),
+        "--dim", str(args.dim), "--queries", str(args.queries), "--k", str(args.k), "--seed", str(args.seed)
+    ]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes:
+            path = os.path.join(tmp, mode.replace("+", "-"))
+            row = {"mode": mode, "vectors": args.documents * args.chunks_per_doc}
+            for step in ("build", "query"):
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_compact_store", "--run", step, "--mode", mode, "--path", path, *passthrough],
+                    check=True, capture_output=True, text=True
+                ).stdout.strip().splitlines()[-1]
+                row.update(json.loads(output))
+            row["build_seconds"] = round(row["build_seconds"], 2)
+            row["disk_mb"] = round(disk_bytes(path) / 1024 ** 2, 1)
+            results.append(row)
+    
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare a filtered Chroma query with brute-force search over a cached document matrix.
+
+Fills one shared collection with several documents of each size, as the
+global partitioning does, then times top-k queries for one document both ways:
+
+    python -m benchmarks.bench_document_matrix --chunks 200 500 2000 --dim 1536
+"""
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import configure_environment
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[200, 500, 2000])
+    parser.add_argument("--documents", type=int, default=10, help="Documents of each size in the collection")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    
+    configure_environment()
+    import chromadb
+    from src.matrix_cache import DocumentMatrix
+    
+    rng = random.Random(0)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        client = chromadb.PersistentClient(path=tmp)
+        collection = client.get_or_create_collection(name="documents", metadata={"hnsw:space": "cosine"})
+        for size in args.chunks:
+            for d in range(args.documents):
+                document_id = f"doc-{size}-{d}"
+                for offset in range(0, size, 500):
+                    count = min(500, size - offset)
+                    collection.add(
+                        ids=[f"{document_id}_{offset + i}" for i in range(count)],
+                        embeddings=[[rng.gauss(0, 1) for _ in range(args.dim)] for _ in range(count)],
+                        documents=[f"chunk {offset + i}" for i in range(count)],
+                        metadatas=[{"user_id": "bench", "document_id": document_id}] * count
+                    )
+        
+        for size in args.chunks:
+            document_id = f"doc-{size}-0"
+            where = {"document_id": {"$eq": document_id}}
+            
+            start = time.perf_counter()
+            stored = collection.get(where=where, include=["embeddings", "documents"])
+            matrix = DocumentMatrix(
+                [int(chunk_id.rsplit("_", 1)[1]) for chunk_id in stored["ids"]],
+                stored["embeddings"],
+                stored["documents"]
+            )
+            load_ms = (time.perf_counter() - start) * 1000
+            
+            chroma_ms = []
+            matrix_ms = []
+            for _ in range(args.queries):
+                embedding = [rng.gauss(0, 1) for _ in range(args.dim)]
+                start = time.perf_counter()
+                collection.query(query_embeddings=[embedding], n_results=12, where=where)
+                chroma_ms.append((time.perf_counter() - start) * 1000)
+                start = time.perf_counter()
+                matrix.search(embedding, 12)
+                matrix_ms.append((time.perf_counter() - start) * 1000)
+            
+            results.append({
+                "chunks": size,
+                "load_ms": round(load_ms, 1),
+                "chroma_ms_p50": round(statistics.median(chroma_ms), 3),
+                "matrix_ms_p50": round(statistics.median(matrix_ms), 3),
+                "speedup": round(statistics.median(chroma_ms) / statistics.median(matrix_ms), 1)
+            })
+    
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
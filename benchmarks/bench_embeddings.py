@@ -0,0 +1,79 @@
+"""Compare serial per-chunk embedding with the batched pipeline.
+
+Runs against a local fake embeddings server, so no network access or API key
+is needed. --local-model also times a local CPU backend on the same chunks
+(its model must be downloaded or already cached):
+
+    python -m benchmarks.bench_embeddings --chunks 300 --latency 0.05
+    python -m benchmarks.bench_embeddings --local-model onnx/all-MiniLM-L6-v2
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import configure_environment, synthetic_text
+from benchmarks.fake_openai import FakeOpenAIServer
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--words-per-chunk", type=int, default=350)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake server latency per request (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--local-model", help="Also time a local embedding model, e.g. onnx/all-MiniLM-L6-v2")
+    args = parser.parse_args()
+    
+    server = FakeOpenAIServer(latency=args.latency, error_rate=args.error_rate).start()
+    configure_environment(server.base_url)
+    
+    import openai
+    from config.config import Config
+    from src.embedding_backends import make_embedding_backend
+    from src.embedding_pipeline import EmbeddingPipeline
+    
+    chunks = [synthetic_text(args.words_per_chunk, seed=i) for i in range(args.chunks)]
+    pipeline = EmbeddingPipeline(base_backoff=0.05)
+    
+    try:
+        start = time.perf_counter()
+        serial = [
+            openai.embeddings.create(model=Config.EMBEDDING_MODEL, input=chunk).data[0].embedding
+            for chunk in chunks
+        ]
+        serial_time = time.perf_counter() - start
+        serial_requests = server.request_count()
+        
+        server.reset()
+        start = time.perf_counter()
+        batched = pipeline.embed(chunks)
+        batched_time = time.perf_counter() - start
+        batched_requests = server.request_count()
+    finally:
+        server.stop()
+    
+    assert batched == serial, "batched embeddings must match per-chunk embeddings in order"
+    
+    results = {
+        "chunks": args.chunks,
+        "serial": {"seconds": round(serial_time, 3), "requests": serial_requests},
+        "batched": {"seconds": round(batched_time, 3), "requests": batched_requests},
+        "speedup": round(serial_time / batched_time, 2) if batched_time else None
+    }
+    
+    if args.local_model:
+        local = EmbeddingPipeline(backend=make_embedding_backend(args.local_model))
+        local.embed(chunks[:1])  # load the model outside the timing
+        start = time.perf_counter()
+        vectors = local.embed(chunks)
+        local_time = time.perf_counter() - start
+        results["local"] = {
+            "model": args.local_model,
+            "seconds": round(local_time, 3),
+            "dimensions": len(vectors[0]),
+            "chunks_per_second": round(args.chunks / local_time, 1) if local_time else None
+        }
+    
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
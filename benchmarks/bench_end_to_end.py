@@ -0,0 +1,223 @@
+"""End-to-end benchmark of the bot's hot paths against fake OpenAI and Telegram.
+
+Drives TelegramBot.handle_document, handle_document_selection and
+handle_query with in-process fake updates, while embeddings and chat
+completions come from a local fake OpenAI server with configurable latency.
+Measures ingestion pages/sec, chunking tokens/sec, embedding requests per
+document and query latency percentiles under concurrent users, and writes
+the results as JSON for comparison between runs:
+
+    python -m benchmarks.bench_end_to_end --documents 4 --pages 40 --users 20 --queries 5 --output e2e.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from benchmarks.bench_pdf_extraction import make_pdf
+from benchmarks.common import WORDS, configure_environment
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBot, FakeChat, FakeContext, FakeDocument, FakeUpdate, FakeUser
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "p50": round(pick(0.50) * 1000, 1),
+        "p95": round(pick(0.95) * 1000, 1),
+        "p99": round(pick(0.99) * 1000, 1),
+        "max": round(ordered[-1] * 1000, 1)
+    }
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+async def wait_for_text(chat: FakeChat, prefixes, timeout: float = 600) -> str:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for _, _, text in reversed(chat.events):
+            if text.startswith(prefixes):
+                return text
+        await asyncio.sleep(0.01)
+    raise TimeoutError(f"No message starting with {prefixes}")
+
+async def upload(bot, context, fake_bot: FakeBot, user: FakeUser, path: str) -> FakeChat:
+    """Send a document as user and wait until the bot reports it processed."""
+    file_id = f"file-{user.id}"
+    with open(path, "rb") as f:
+        fake_bot.files[file_id] = f.read()
+    chat = FakeChat()
+    update = FakeUpdate(user, chat, document=FakeDocument(file_id, os.path.basename(path)))
+    await bot.handle_document(update, context)
+    text = await wait_for_text(chat, ("✅", "❌", "⏳"))
+    if not text.startswith("✅"):
+        raise RuntimeError(f"Upload failed: {text}")
+    return chat
+
+async def ask(bot, context, user: FakeUser, chat: FakeChat, question: str) -> Dict[str, float]:
+    """Ask one question; returns total seconds and seconds to the first streamed text."""
+    update = FakeUpdate(user, chat, text=question)
+    seen = len(chat.events)
+    start = time.perf_counter()
+    await bot.handle_query(update, context)
+    total = time.perf_counter() - start
+    # The first event is the "thinking" message; the next one is the first visible answer text
+    later = chat.events[seen + 1:]
+    first = later[0][0] - start if later else total
+    return {"total": total, "first_text": first}
+
+async def run(args, server: FakeOpenAIServer, tmp: str) -> dict:
+    from src.bot import TelegramBot
+    
+    bot = TelegramBot()
+    await bot.post_init(None)
+    fake_bot = FakeBot()
+    context = FakeContext(fake_bot)
+    try:
+        paths = []
+        for d in range(args.documents):
+            path = os.path.join(tmp, f"document-{d}.pdf")
+            make_pdf(path, args.pages, seed=d + 1)
+            paths.append(path)
+        
+        # Ingestion: distinct documents, one at a time
+        document_seconds = []
+        embedding_requests = []
+        for d, path in enumerate(paths):
+            server.reset()
+            start = time.perf_counter()
+            await upload(bot, context, fake_bot, FakeUser(d + 1), path)
+            document_seconds.append(time.perf_counter() - start)
+            embedding_requests.append(server.request_count("/v1/embeddings"))
+        
+        # Chunking alone, on already extracted text
+        processor = bot.document_processor
+        pieces = list(processor.iter_document_text(paths[0]))
+        tokens = sum(len(processor.tokenizer.encode(piece)) for piece in pieces)
+        start = time.perf_counter()
+        chunks = list(processor.iter_chunks(pieces))
+        chunking_seconds = time.perf_counter() - start
+        
+        # Every user holds one of the documents (identical uploads reuse vectors) and selects it
+        users = [FakeUser(u + 1) for u in range(args.users)]
+        chats = {}
+        for user in users:
+            if user.id > args.documents:
+                chats[user.id] = await upload(bot, context, fake_bot, user, paths[(user.id - 1) % len(paths)])
+            else:
+                chats[user.id] = FakeChat()
+            document = bot.vector_store.get_user_documents(str(user.id))[0]
+            await bot.handle_document_selection(
+                FakeUpdate(user, chats[user.id], callback_data=f"select_doc_{document.doc_id}"), context
+            )
+        
+        # Queries: users ask concurrently, each waiting for one answer before the next question
+        server.reset()
+        rng = random.Random(0)
+        questions = {
+            user.id: [
+                f"What does the document say about {rng.choice(WORDS)} and {rng.choice(WORDS)}?"
+                for _ in range(args.queries)
+            ]
+            for user in users
+        }
+        
+        async def session(user: FakeUser) -> List[Dict[str, float]]:
+            return [await ask(bot, context, user, chats[user.id], question) for question in questions[user.id]]
+        
+        start = time.perf_counter()
+        timings = [t for user_timings in await asyncio.gather(*(session(user) for user in users)) for t in user_timings]
+        query_seconds = time.perf_counter() - start
+    finally:
+        await bot.post_shutdown(None)
+    
+    return {
+        "ingestion": {
+            "documents": args.documents,
+            "pages_per_document": args.pages,
+            "pages_per_second": round(args.documents * args.pages / sum(document_seconds), 1),
+            "seconds_per_document": round(sum(document_seconds) / len(document_seconds), 2),
+            "embedding_requests_per_document": round(sum(embedding_requests) / len(embedding_requests), 1)
+        },
+        "chunking": {
+            "tokens": tokens,
+            "chunks": len(chunks),
+            "tokens_per_second": round(tokens / chunking_seconds) if chunking_seconds else None
+        },
+        "queries": {
+            "users": args.users,
+            "queries": len(timings),
+            "queries_per_second": round(len(timings) / query_seconds, 2),
+            "latency_ms": percentiles([t["total"] for t in timings]),
+            "first_text_ms": percentiles([t["first_text"] for t in timings]),
+            "embedding_requests": server.request_count("/v1/embeddings"),
+            "completion_requests": server.request_count("/v1/chat/completions"),
+            "answer_cache": bot.vector_store.answer_cache.stats()
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=5, help="Questions per user")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embeddings request")
+    parser.add_argument("--completion-latency", type=float, default=0.3, help="Seconds to the first completion token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between completion tokens")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    
+    server = FakeOpenAIServer(
+        latency=args.embedding_latency,
+        completion_latency=args.completion_latency,
+        token_delay=args.token_delay
+    ).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep every store of this run out of the working tree
+        for name, value in {
+            "CHROMA_DIR": "chroma_db",
+            "EMBEDDING_CACHE_PATH": "embedding_cache.sqlite3",
+            "METADATA_DB_PATH": "documents.sqlite3",
+            "INGESTION_JOBS_PATH": "ingestion_jobs.sqlite3",
+            "LEXICAL_INDEX_PATH": "lexical_index.sqlite3",
+            "SESSION_DB_PATH": "sessions.sqlite3",
+            "COMPACT_STORE_DIR": "compact_vectors",
+            "RAILWAY_VOLUME_MOUNT_PATH": "uploads"
+        }.items():
+            os.environ[name] = os.path.join(tmp, value)
+        os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+        configure_environment(server.base_url)
+        try:
+            results = asyncio.run(run(args, server, tmp))
+        finally:
+            server.stop()
+    
+    results = {
+        "benchmark": "end_to_end",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "settings": vars(args),
+        **results
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark questions over several documents against questions over one.
+
+One user uploads --documents documents. Retrieval is then timed over the
+first 1, 2, 4, ... of them with VectorStore.asearch_documents, once with
+the configured SEARCH_FANOUT and once searching one document at a time,
+and whole answers are timed after choosing "All documents" in the bot,
+against answers about a single document:
+
+    python -m benchmarks.bench_library --documents 16 --pages 10 --queries 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_end_to_end import ask, percentiles, upload
+from benchmarks.bench_pdf_extraction import make_pdf
+from benchmarks.common import WORDS, configure_environment
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBot, FakeChat, FakeContext, FakeUpdate, FakeUser
+
+async def run(args, server: FakeOpenAIServer, tmp: str) -> dict:
+    from config.config import Config
+    from src.bot import TelegramBot
+    
+    bot = TelegramBot()
+    await bot.post_init(None)
+    fake_bot = FakeBot()
+    context = FakeContext(fake_bot)
+    store = bot.vector_store
+    user = FakeUser(1)
+    user_id = str(user.id)
+    rng = random.Random(0)
+    question = lambda: f"What do the documents say about {rng.choice(WORDS)} and {rng.choice(WORDS)}?"
+    try:
+        for d in range(args.documents):
+            path = os.path.join(tmp, f"document-{d}.pdf")
+            make_pdf(path, args.pages, seed=d + 1)
+            await upload(bot, context, fake_bot, user, path)
+        document_ids = [document.doc_id for document in sorted(store.get_user_documents(user_id), key=lambda d: d.name)]
+        
+        # Retrieval alone, over growing sets of documents
+        fanout = Config.SEARCH_FANOUT
+        retrieval = {}
+        sizes = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= len(document_ids)]
+        for n in sizes:
+            retrieval[n] = {}
+            for label, limit in (("parallel", fanout), ("sequential", 1)):
+                Config.SEARCH_FANOUT = limit
+                latencies = []
+                for _ in range(args.queries):
+                    start = time.perf_counter()
+                    await store.asearch_documents(
+                        question(), user_id, document_ids[:n], n_results=Config.LIBRARY_RETRIEVAL_CANDIDATES
+                    )
+                    latencies.append(time.perf_counter() - start)
+                retrieval[n][label] = percentiles(latencies)
+        Config.SEARCH_FANOUT = fanout
+        
+        # Whole answers: one document, then all of them
+        answers = {}
+        for label, callback_data in (("single", f"select_doc_{document_ids[0]}"), ("all", "select_all")):
+            chat = FakeChat()
+            update = FakeUpdate(user, chat, callback_data=callback_data)
+            if label == "single":
+                await bot.handle_document_selection(update, context)
+            else:
+                await bot.handle_library_selection(update, context)
+            server.reset()
+            timings = [await ask(bot, context, user, chat, question()) for _ in range(args.queries)]
+            answers[label] = {
+                "latency_ms": percentiles([t["total"] for t in timings]),
+                "first_text_ms": percentiles([t["first_text"] for t in timings]),
+                "embedding_requests": server.request_count("/v1/embeddings")
+            }
+    finally:
+        await bot.post_shutdown(None)
+    
+    return {"retrieval_ms": retrieval, "answers": answers}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=16)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=20, help="Questions per measurement")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per embeddings request")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    
+    server = FakeOpenAIServer(latency=args.latency).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, value in {
+            "CHROMA_DIR": "chroma_db",
+            "EMBEDDING_CACHE_PATH": "embedding_cache.sqlite3",
+            "METADATA_DB_PATH": "documents.sqlite3",
+            "INGESTION_JOBS_PATH": "ingestion_jobs.sqlite3",
+            "LEXICAL_INDEX_PATH": "lexical_index.sqlite3",
+            "SESSION_DB_PATH": "sessions.sqlite3",
+            "COMPACT_STORE_DIR": "compact_vectors",
+            "RAILWAY_VOLUME_MOUNT_PATH": "uploads"
+        }.items():
+            os.environ[name] = os.path.join(tmp, value)
+        os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+        os.environ["REINDEX_ON_STARTUP"] = "false"
+        configure_environment(server.base_url)
+        try:
+            results = asyncio.run(run(args, server, tmp))
+        finally:
+            server.stop()
+    report = json.dumps({"benchmark": "library", "settings": vars(args), **results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
+
+if __name__ == "__main__":
+    main()
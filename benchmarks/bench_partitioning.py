@@ -0,0 +1,87 @@
+"""Benchmark single-document query latency against corpus size per partitioning strategy.
+
+Builds a throwaway Chroma store per (strategy, corpus size) with random
+vectors, then times filtered top-k queries the way VectorStore issues them:
+
+    python -m benchmarks.bench_partitioning --sizes 5000 20000 --dim 384
+"""
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import configure_environment
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run(strategy, corpus_size: int, dim: int, chunks_per_doc: int, docs_per_user: int, queries: int, seed: int):
+    import chromadb
+    
+    rng = random.Random(seed)
+    n_docs = max(1, corpus_size // chunks_per_doc)
+    documents = [(f"user{i // docs_per_user}", f"doc-{i:06d}") for i in range(n_docs)]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        client = chromadb.PersistentClient(path=tmp)
+        collections = {}
+        
+        start = time.perf_counter()
+        for user_id, document_id in documents:
+            name = strategy.collection_name(user_id, document_id)
+            if name not in collections:
+                collections[name] = client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+            collections[name].add(
+                ids=[f"{document_id}_{i}" for i in range(chunks_per_doc)],
+                embeddings=[[rng.gauss(0, 1) for _ in range(dim)] for _ in range(chunks_per_doc)],
+                metadatas=[{"user_id": user_id, "document_id": document_id}] * chunks_per_doc
+            )
+        build_seconds = time.perf_counter() - start
+        
+        latencies = []
+        for _ in range(queries):
+            user_id, document_id = rng.choice(documents)
+            collection = collections[strategy.collection_name(user_id, document_id)]
+            embedding = [rng.gauss(0, 1) for _ in range(dim)]
+            start = time.perf_counter()
+            collection.query(query_embeddings=[embedding], n_results=3, where=strategy.where(document_id))
+            latencies.append((time.perf_counter() - start) * 1000)
+    
+    return {
+        "strategy": strategy.name,
+        "corpus_size": n_docs * chunks_per_doc,
+        "collections": len(collections),
+        "build_seconds": round(build_seconds, 2),
+        "query_ms_p50": round(statistics.median(latencies), 2),
+        "query_ms_p95": round(percentile(latencies, 95), 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000])
+    parser.add_argument("--strategies", nargs="+", default=["global", "user", "document", "shard"])
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--chunks-per-doc", type=int, default=200)
+    parser.add_argument("--docs-per-user", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    
+    configure_environment()
+    from src.partitioning import make_partition_strategy
+    
+    results = []
+    for size in args.sizes:
+        for name in args.strategies:
+            strategy = make_partition_strategy(name, args.shards)
+            results.append(run(
+                strategy, size, args.dim, args.chunks_per_doc, args.docs_per_user, args.queries, seed=size
+            ))
+    
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
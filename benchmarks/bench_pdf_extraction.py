@@ -0,0 +1,107 @@
+"""Benchmark PDF extraction throughput and peak memory, old path vs new.
+
+Generates a synthetic multi-hundred-page PDF with headings, lists and
+paragraphs, then converts it in a fresh subprocess per method so peak RSS
+(including worker processes) is measured independently:
+
+    python -m benchmarks.bench_pdf_extraction --pages 300 400
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import configure_environment, synthetic_text
+
+def make_pdf(path: str, pages: int, seed: int = 0):
+    """Write a synthetic PDF with a heading, a list and body paragraphs per page.
+    
+    Different seeds give different text, so the files don't share vectors.
+    """
+    import fitz
+    
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        y = 60
+        page.insert_text((56, y), f"Chapter {i // 10 + 1}.{i % 10 + 1}", fontsize=20)
+        y += 36
+        for j in range(3):
+            page.insert_text((64, y), f"• Key point {j + 1}: {synthetic_text(8, seed=seed * 1000003 + i * 10 + j)}", fontsize=11)
+            y += 16
+        y += 10
+        for line in range(30):
+            page.insert_text((56, y), synthetic_text(14, seed=seed * 1000003 + i * 100 + line), fontsize=11)
+            y += 14
+    doc.save(path)
+    doc.close()
+
+def legacy_pdf_to_markdown(pdf_path: str) -> str:
+    """The original implementation: string concatenation plus markdownify."""
+    import fitz
+    from markdownify import markdownify
+    
+    doc = fitz.open(pdf_path)
+    text = ""
+    for page in doc:
+        text += page.get_text()
+    return markdownify(text, heading_style="ATX")
+
+def run_method(method: str, pdf_path: str):
+    """Child mode: convert once and print timing and peak memory as JSON."""
+    configure_environment()
+    from src.document_processor import DocumentProcessor
+    
+    start = time.perf_counter()
+    if method == "legacy":
+        markdown = legacy_pdf_to_markdown(pdf_path)
+    else:
+        markdown = DocumentProcessor().pdf_to_markdown(pdf_path)
+    elapsed = time.perf_counter() - start
+    
+    # ru_maxrss is in kilobytes on Linux
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(json.dumps({
+        "seconds": elapsed,
+        "peak_rss_mb": round(self_rss / 1024, 1),
+        "peak_worker_rss_mb": round(children_rss / 1024, 1),
+        "output_chars": len(markdown)
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[200, 400])
+    parser.add_argument("--run", choices=["legacy", "current"], help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.run:
+        run_method(args.run, args.pdf)
+        return
+    
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            pdf_path = os.path.join(tmp, f"synthetic_{pages}.pdf")
+            make_pdf(pdf_path, pages)
+            row = {"pages": pages}
+            for method in ("legacy", "current"):
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_pdf_extraction", "--run", method, "--pdf", pdf_path],
+                    check=True, capture_output=True, text=True
+                ).stdout.strip().splitlines()[-1]
+                stats = json.loads(output)
+                stats["pages_per_second"] = round(pages / stats["seconds"], 1)
+                stats["seconds"] = round(stats["seconds"], 3)
+                row[method] = stats
+            results.append(row)
+    
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
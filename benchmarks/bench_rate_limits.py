@@ -0,0 +1,111 @@
+"""Check the client-side OpenAI rate limiter against a fake API that enforces limits.
+
+Several uploads embed their chunks at once (bulk lane) while users ask
+questions (interactive query embeddings, including bursts of the same
+question). Runs once without client-side limits and once with them set to
+the fake's limits, and reports 429s, failed uploads, upload time and
+question latency. The fake's limits replenish over --window seconds instead
+of a minute, so the run stays short:
+
+    python -m benchmarks.bench_rate_limits --uploads 6 --chunks 60 --rpm 60 --tpm 200000
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+from benchmarks.bench_end_to_end import percentiles
+from benchmarks.common import configure_environment, synthetic_text
+from benchmarks.fake_openai import FakeOpenAIServer
+
+async def run(args, server: FakeOpenAIServer, limited: bool) -> Dict[str, object]:
+    from config.config import Config
+    from src import openai_client
+    from src.embedding_backends import OpenAIEmbeddingBackend
+    from src.embedding_pipeline import EmbeddingPipeline
+
+    # Per-minute limits that match the fake's per-window ones
+    scale = 60.0 / args.window
+    Config.OPENAI_EMBEDDING_RPM = int(args.rpm * scale) if limited else 0
+    Config.OPENAI_EMBEDDING_TPM = int(args.tpm * scale) if limited else 0
+    openai_client.reset_limiters()
+    server.reset()
+    merged_before = openai_client.embedding_flights.merged
+
+    backend = OpenAIEmbeddingBackend(Config.EMBEDDING_MODEL)
+    uploads = [
+        [synthetic_text(args.words_per_chunk, seed=u * 100000 + i) for i in range(args.chunks)]
+        for u in range(args.uploads)
+    ]
+
+    def ingest(chunks: List[str]) -> bool:
+        pipeline = EmbeddingPipeline(backend=backend, max_retries=args.retries, base_backoff=0.2, max_backoff=2.0)
+        try:
+            pipeline.embed(chunks)
+            return True
+        except Exception:
+            return False
+
+    async def ask(question: str) -> float:
+        start = time.perf_counter()
+        await backend.aembed(question)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    ingestion = asyncio.gather(*(asyncio.to_thread(ingest, chunks) for chunks in uploads))
+    latencies = []
+    failed_questions = 0
+    for q in range(args.questions):
+        await asyncio.sleep(args.question_interval)
+        # Every few questions, a burst of users asks the same thing at once
+        burst = args.burst if q % 5 == 0 else 1
+        question = f"What does chapter {q} say about {synthetic_text(6, seed=q)}?"
+        for result in await asyncio.gather(*(ask(question) for _ in range(burst)), return_exceptions=True):
+            if isinstance(result, Exception):
+                failed_questions += 1
+            else:
+                latencies.append(result)
+    uploaded = await ingestion
+    elapsed = time.perf_counter() - start
+
+    return {
+        "client_limits": limited,
+        "rejected_429": server.rejected_count("/v1/embeddings"),
+        "embedding_requests": server.request_count("/v1/embeddings"),
+        "failed_uploads": uploaded.count(False),
+        "failed_questions": failed_questions,
+        "seconds": round(elapsed, 2),
+        "question_latency_ms": percentiles(latencies),
+        "merged_requests": openai_client.embedding_flights.merged - merged_before
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uploads", type=int, default=6)
+    parser.add_argument("--chunks", type=int, default=60, help="Chunks per upload")
+    parser.add_argument("--words-per-chunk", type=int, default=300)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--question-interval", type=float, default=0.2)
+    parser.add_argument("--burst", type=int, default=5, help="Users asking the same question at once")
+    parser.add_argument("--rpm", type=int, default=60, help="Requests the fake accepts per window")
+    parser.add_argument("--tpm", type=int, default=200000, help="Tokens the fake accepts per window")
+    parser.add_argument("--window", type=float, default=10.0, help="Seconds over which the fake's limits replenish")
+    parser.add_argument("--retries", type=int, default=3, help="Embedding retries before an upload fails")
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=args.latency, rpm=args.rpm, tpm=args.tpm, limit_window=args.window).start()
+    configure_environment(server.base_url)
+    try:
+        results = []
+        for limited in (False, True):
+            results.append(asyncio.run(run(args, server, limited)))
+            # Let the fake's budget refill between runs
+            time.sleep(args.window)
+    finally:
+        server.stop()
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
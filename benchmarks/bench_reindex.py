@@ -0,0 +1,173 @@
+"""Benchmark background re-indexing after a chunking change, under query load.
+
+Uploads documents (and a duplicate of the first, by another user) with one
+CHUNK_SIZE, then a few more with a new one. The re-indexer then rebuilds
+the stale documents while users keep searching theirs; it is stopped once
+part-way and restarted, to check it resumes from its checkpoint. Reports
+which documents were rebuilt or left alone, failed or empty searches during
+the run, and the embedding requests spent:
+
+    python -m benchmarks.bench_reindex --documents 4 --pages 20 --chunk-size 500 --new-chunk-size 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_end_to_end import percentiles, upload
+from benchmarks.bench_pdf_extraction import make_pdf
+from benchmarks.common import WORDS, configure_environment
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBot, FakeContext, FakeUser
+
+async def run(args, server: FakeOpenAIServer, tmp: str) -> dict:
+    from config.config import Config
+    from src.bot import TelegramBot
+    from src.reindexer import Reindexer
+    
+    Config.CHUNK_SIZE = args.chunk_size
+    bot = TelegramBot()
+    await bot.post_init(None)
+    fake_bot = FakeBot()
+    context = FakeContext(fake_bot)
+    store = bot.vector_store
+    try:
+        paths = []
+        for d in range(args.documents + args.current):
+            path = os.path.join(tmp, f"document-{d}.pdf")
+            make_pdf(path, args.pages, seed=d + 1)
+            paths.append(path)
+        users = [FakeUser(d + 1) for d in range(len(paths) + 1)]
+        for user, path in zip(users, paths[:args.documents]):
+            await upload(bot, context, fake_bot, user, path)
+        # The first document again, from another user; it only points at the first upload's vectors
+        await upload(bot, context, fake_bot, users[-1], paths[0])
+        # Settings change; later uploads are already indexed with the new ones
+        Config.CHUNK_SIZE = args.new_chunk_size
+        for user, path in zip(users[args.documents:], paths[args.documents:]):
+            await upload(bot, context, fake_bot, user, path)
+        
+        documents = {user.id: store.get_user_documents(str(user.id))[0] for user in users}
+        before = {user_id: document.vector_document_id for user_id, document in documents.items()}
+        
+        # Users search their documents for as long as re-indexing runs
+        rng = random.Random(0)
+        latencies = []
+        failures = []
+        empty = 0
+        done = asyncio.Event()
+        
+        async def search(user: FakeUser):
+            nonlocal empty
+            while not done.is_set():
+                query = f"What does the document say about {rng.choice(WORDS)} and {rng.choice(WORDS)}?"
+                start = time.perf_counter()
+                try:
+                    chunks = await store.asearch(query, str(user.id), documents[user.id].doc_id, n_results=5)
+                    latencies.append(time.perf_counter() - start)
+                    empty += not chunks
+                except Exception as e:
+                    failures.append(str(e))
+                await asyncio.sleep(args.query_interval)
+        
+        searches = [asyncio.create_task(search(user)) for user in users]
+        server.reset()
+        start = time.perf_counter()
+        reindexer = Reindexer(store, bot.document_processor, bot.ingestion, args.rate, args.retire_seconds)
+        await reindexer.start()
+        await asyncio.sleep(args.interrupt_after)
+        await reindexer.stop()
+        interrupted = {
+            document.doc_id: store.document_store.get_reindex_checkpoint(document.doc_id)
+            for document in documents.values()
+        }
+        checkpointed = sum(checkpoint.stored for checkpoint in interrupted.values() if checkpoint)
+        
+        # A new re-indexer, as after a restart
+        reindexer = Reindexer(store, bot.document_processor, bot.ingestion, args.rate, args.retire_seconds)
+        await reindexer.start()
+        while await asyncio.to_thread(reindexer.stale_documents):
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - start
+        done.set()
+        await asyncio.gather(*searches)
+        # Let the replaced vectors be deleted
+        await asyncio.wait_for(reindexer.task, args.retire_seconds + 30)
+        
+        after = {user.id: store.get_document(documents[user.id].doc_id) for user in users}
+        rebuilt = sorted(user_id for user_id in after if after[user_id].vector_document_id != before[user_id])
+        owners = {before[user.id]: str(user.id) for user in reversed(users)}
+        leftover = [
+            vector_document_id for vector_document_id in set(before.values()) - {d.vector_document_id for d in after.values()}
+            if store.collection_for(owners[vector_document_id], vector_document_id).get(
+                where={"document_id": {"$eq": vector_document_id}}, limit=1
+            )["ids"]
+        ]
+    finally:
+        await bot.post_shutdown(None)
+    
+    return {
+        "documents": {
+            "stale": args.documents,
+            "current": args.current,
+            "rebuilt_for_users": rebuilt,
+            "chunk_size": sorted({d.index_params["chunk_size"] for d in after.values()})
+        },
+        "interrupt": {
+            "after_seconds": args.interrupt_after,
+            "checkpointed_chunks": checkpointed
+        },
+        "reindex_seconds": round(elapsed, 2),
+        "embedding_requests": server.request_count("/v1/embeddings"),
+        "searches": {
+            "count": len(latencies) + len(failures),
+            "failed": len(failures),
+            "empty": empty,
+            "latency_ms": percentiles(latencies)
+        },
+        "replaced_vectors_left": len(leftover)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=4, help="Documents indexed with --chunk-size")
+    parser.add_argument("--current", type=int, default=2, help="Documents indexed with --new-chunk-size")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--new-chunk-size", type=int, default=300)
+    parser.add_argument("--rate", type=int, default=3000, help="Re-indexed chunks per minute")
+    parser.add_argument("--batch-size", type=int, default=16, help="Chunks per embeddings request; checkpoints come every few batches")
+    parser.add_argument("--interrupt-after", type=float, default=2.0, help="Seconds before the first re-indexer is stopped")
+    parser.add_argument("--retire-seconds", type=float, default=2.0)
+    parser.add_argument("--query-interval", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per embeddings request")
+    args = parser.parse_args()
+    
+    server = FakeOpenAIServer(latency=args.latency).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, value in {
+            "CHROMA_DIR": "chroma_db",
+            "EMBEDDING_CACHE_PATH": "embedding_cache.sqlite3",
+            "METADATA_DB_PATH": "documents.sqlite3",
+            "INGESTION_JOBS_PATH": "ingestion_jobs.sqlite3",
+            "LEXICAL_INDEX_PATH": "lexical_index.sqlite3",
+            "SESSION_DB_PATH": "sessions.sqlite3",
+            "COMPACT_STORE_DIR": "compact_vectors",
+            "RAILWAY_VOLUME_MOUNT_PATH": "uploads"
+        }.items():
+            os.environ[name] = os.path.join(tmp, value)
+        os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+        os.environ["REINDEX_ON_STARTUP"] = "false"
+        os.environ["EMBEDDING_BATCH_SIZE"] = str(args.batch_size)
+        configure_environment(server.base_url)
+        try:
+            results = asyncio.run(run(args, server, tmp))
+        finally:
+            server.stop()
+    print(json.dumps({"benchmark": "reindex", "settings": vars(args), **results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Startup benchmark: how long a fresh bot process takes before it can handle updates.
+
+Each run starts a new interpreter that imports src.bot, builds TelegramBot
+and runs post_init, then waits for the background warm-up. Reports the
+median of each step, the packages whose imports cost the most, and exits
+non-zero when the time to ready is over budget, so it can gate deploys:
+
+    python -m benchmarks.bench_startup --runs 5 --budget 1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict
+
+from benchmarks.common import configure_environment
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+from src.bot import TelegramBot
+imported = time.perf_counter()
+bot = TelegramBot()
+constructed = time.perf_counter()
+
+async def main():
+    await bot.post_init(None)
+    ready = time.perf_counter()
+    if bot.warm_up_task is not None:
+        await bot.warm_up_task
+    warmed = time.perf_counter()
+    await bot.post_shutdown(None)
+    return ready, warmed
+
+ready, warmed = asyncio.run(main())
+print(json.dumps({
+    "import": imported - started,
+    "construct": constructed - imported,
+    "post_init": ready - constructed,
+    "ready": ready - started,
+    "warm_up": warmed - ready
+}))
+"""
+
+def run_child(env: Dict[str, str]) -> Dict[str, float]:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - start
+    return timings
+
+def interpreter_seconds(env: Dict[str, str]) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], cwd=ROOT, env=env, check=True)
+    return time.perf_counter() - start
+
+def import_profile(env: Dict[str, str], top: int) -> Dict[str, float]:
+    """Milliseconds of import time per top-level package, from python -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import src.bot"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    totals: Counter = Counter()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        totals[name.strip().split(".")[0]] += int(self_us)
+    return {package: round(us / 1000, 1) for package, us in totals.most_common(top)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.5, help="Seconds from interpreter start to ready")
+    parser.add_argument("--top", type=int, default=10, help="Slowest packages to list")
+    args = parser.parse_args()
+    
+    configure_environment()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, ANONYMIZED_TELEMETRY="False", WARM_UP="true")
+        for name, value in {
+            "CHROMA_DIR": "chroma_db",
+            "EMBEDDING_CACHE_PATH": "embedding_cache.sqlite3",
+            "METADATA_DB_PATH": "documents.sqlite3",
+            "INGESTION_JOBS_PATH": "ingestion_jobs.sqlite3",
+            "LEXICAL_INDEX_PATH": "lexical_index.sqlite3",
+            "SESSION_DB_PATH": "sessions.sqlite3",
+            "COMPACT_STORE_DIR": "compact_vectors",
+            "RAILWAY_VOLUME_MOUNT_PATH": "uploads"
+        }.items():
+            env[name] = os.path.join(tmp, value)
+        
+        # The first run pays for cold disk caches and .pyc compilation; keep it out of the medians
+        run_child(env)
+        runs = [run_child(env) for _ in range(args.runs)]
+        interpreter = statistics.median(interpreter_seconds(env) for _ in range(args.runs))
+        profile = import_profile(env, args.top)
+    
+    medians = {
+        f"{step}_ms": round(statistics.median(run[step] for run in runs) * 1000, 1)
+        for step in ("import", "construct", "post_init", "ready", "warm_up", "process")
+    }
+    ready = medians["ready_ms"] / 1000
+    results = {
+        "benchmark": "startup",
+        "runs": args.runs,
+        "interpreter_ms": round(interpreter * 1000, 1),
+        **medians,
+        "import_ms_by_package": profile,
+        "budget_ms": round(args.budget * 1000, 1),
+        "within_budget": ready <= args.budget
+    }
+    print(json.dumps(results, indent=2))
+    if ready > args.budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Benchmark broad questions answered from precomputed summaries against chunk retrieval.
+
+Uploads a PDF whose pages are headed "Chapter c.p", waits for its section
+and document summaries to be written in the background, then asks broad
+questions ("Summarize chapter 2", "What is this document about?") with
+summaries on and off. Reports the summarization cost, and per question
+the answer latency, prompt tokens and how many of the chapter's sections
+the context covered:
+
+    python -m benchmarks.bench_summaries --pages 40 --queries 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import tempfile
+import time
+
+from benchmarks.bench_end_to_end import ask, percentiles, upload
+from benchmarks.bench_pdf_extraction import make_pdf
+from benchmarks.common import configure_environment
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBot, FakeChat, FakeContext, FakeUpdate, FakeUser
+
+async def run(args, server: FakeOpenAIServer, tmp: str) -> dict:
+    from config.config import Config
+    from src.bot import TelegramBot
+    
+    bot = TelegramBot()
+    await bot.post_init(None)
+    fake_bot = FakeBot()
+    context = FakeContext(fake_bot)
+    store = bot.vector_store
+    user = FakeUser(1)
+    try:
+        path = os.path.join(tmp, "document.pdf")
+        make_pdf(path, args.pages, seed=1)
+        server.reset()
+        start = time.perf_counter()
+        await upload(bot, context, fake_bot, user, path)
+        indexed = time.perf_counter() - start
+        document = store.get_user_documents(str(user.id))[0]
+        while store.document_store.get_document_summary(document.vector_document_id) is None:
+            if bot.summarizer.counts["failed"]:
+                raise RuntimeError("Summarizing the document failed")
+            await asyncio.sleep(0.05)
+        summarized = time.perf_counter() - start
+        sections = store.document_store.get_sections(document.vector_document_id)
+        summary_requests = server.request_count("/v1/chat/completions")
+        
+        # Prompt sizes and the chapter headings each answer's context covered
+        prompts = []
+        build_messages = bot.query_engine.build_messages
+        
+        def measured_build_messages(query, context_chunks, history=None):
+            messages = build_messages(query, context_chunks, history)
+            prompts.append((bot.query_engine.count_tokens(messages), "\n".join(context_chunks)))
+            return messages
+        
+        bot.query_engine.build_messages = measured_build_messages
+        chapters = (args.pages + 9) // 10
+        questions = [
+            f"Summarize chapter {q % chapters + 1}" if q % 2 == 0 else "What is this document about?"
+            for q in range(args.queries)
+        ]
+        
+        results = {}
+        for label, enabled in (("summaries", True), ("retrieval", False)):
+            Config.SUMMARIES_ENABLED = enabled
+            chat = FakeChat()
+            await bot.handle_document_selection(
+                FakeUpdate(user, chat, callback_data=f"select_doc_{document.doc_id}"), context
+            )
+            store.answer_cache.invalidate(document.vector_document_id)
+            prompts.clear()
+            server.reset()
+            timings = [await ask(bot, context, user, chat, question) for question in questions]
+            coverage = []
+            for question, (_, text) in zip(questions, prompts):
+                match = re.search(r"chapter (\d+)", question)
+                if match:
+                    chapter = int(match.group(1))
+                    pages = min(10, args.pages - (chapter - 1) * 10)
+                    found = {int(p) for p in re.findall(rf"Chapter {chapter}\.(\d+)\b", text)}
+                    coverage.append(len(found) / pages)
+            results[label] = {
+                "latency_ms": percentiles([t["total"] for t in timings]),
+                "first_text_ms": percentiles([t["first_text"] for t in timings]),
+                "prompt_tokens": round(sum(tokens for tokens, _ in prompts) / len(prompts)),
+                "chapter_coverage": round(sum(coverage) / len(coverage), 2) if coverage else None,
+                "chat_requests": server.request_count("/v1/chat/completions"),
+                "embedding_requests": server.request_count("/v1/embeddings")
+            }
+    finally:
+        await bot.post_shutdown(None)
+    
+    return {
+        "document": {
+            "sections": len(sections),
+            "indexed_seconds": round(indexed, 2),
+            "summarized_seconds": round(summarized, 2),
+            "summary_requests": summary_requests
+        },
+        "questions": results
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=6, help="Broad questions per mode")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per embeddings request")
+    parser.add_argument("--completion-latency", type=float, default=0.3, help="Seconds to a completion's first token")
+    args = parser.parse_args()
+    
+    server = FakeOpenAIServer(latency=args.latency, completion_latency=args.completion_latency).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, value in {
+            "CHROMA_DIR": "chroma_db",
+            "EMBEDDING_CACHE_PATH": "embedding_cache.sqlite3",
+            "METADATA_DB_PATH": "documents.sqlite3",
+            "INGESTION_JOBS_PATH": "ingestion_jobs.sqlite3",
+            "LEXICAL_INDEX_PATH": "lexical_index.sqlite3",
+            "SESSION_DB_PATH": "sessions.sqlite3",
+            "COMPACT_STORE_DIR": "compact_vectors",
+            "RAILWAY_VOLUME_MOUNT_PATH": "uploads"
+        }.items():
+            os.environ[name] = os.path.join(tmp, value)
+        os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+        os.environ["REINDEX_ON_STARTUP"] = "false"
+        os.environ["SUMMARIES_ENABLED"] = "true"
+        configure_environment(server.base_url)
+        try:
+            results = asyncio.run(run(args, server, tmp))
+        finally:
+            server.stop()
+    print(json.dumps({"benchmark": "summaries", "settings": vars(args), **results}, indent=2))
+
+if __name__ == "__main__":
+    main()
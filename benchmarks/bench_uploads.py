@@ -0,0 +1,206 @@
+"""Benchmark parsing uploads from memory and the retention policy for their originals.
+
+Parses a PDF and a DOCX the old way, written to the volume and read back
+from their paths, and the new way, from the downloaded bytes; reports the
+time per mode and the bytes written. Then saves a set of PDFs to an upload
+store with a small budget and reports how well they compress, how many were
+evicted and that files other than uploads were left alone. Finally uploads
+a document through the bot, evicts its original and re-indexes it with a
+new CHUNK_SIZE from its stored chunks:
+
+    python -m benchmarks.bench_uploads --pages 200 --documents 10 --retention-mb 1
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.bench_end_to_end import percentiles, upload
+from benchmarks.bench_pdf_extraction import make_pdf
+from benchmarks.common import WORDS, configure_environment
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBot, FakeContext, FakeUser
+
+def make_docx(path: str, paragraphs: int):
+    """Write a minimal DOCX file (a zip of its XML parts) with paragraphs of filler text."""
+    import zipfile
+    
+    body = "".join(
+        f"<w:p><w:r><w:t>{' '.join(WORDS[(p + w) % len(WORDS)] for w in range(60))}</w:t></w:r></w:p>"
+        for p in range(paragraphs)
+    )
+    with zipfile.ZipFile(path, "w") as docx:
+        docx.writestr(
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            "</Types>"
+        )
+        docx.writestr(
+            "word/document.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f"<w:body>{body}</w:body></w:document>"
+        )
+
+def measure_parsing(args, tmp: str, executor) -> dict:
+    from src.document_processor import DocumentProcessor
+    
+    processor = DocumentProcessor()
+    files = {"pdf": os.path.join(tmp, "parse.pdf"), "docx": os.path.join(tmp, "parse.docx")}
+    make_pdf(files["pdf"], args.pages, seed=2)
+    make_docx(files["docx"], args.pages * 4)
+    volume = os.path.join(tmp, "volume")
+    os.makedirs(volume, exist_ok=True)
+    
+    results = {}
+    for kind, path in files.items():
+        with open(path, "rb") as f:
+            data = f.read()
+        file_name = os.path.basename(path)
+        modes = {}
+        for mode in ("disk", "memory"):
+            timings = []
+            written = 0
+            for run in range(args.runs):
+                start = time.perf_counter()
+                if mode == "disk":
+                    saved = os.path.join(volume, f"{run}-{file_name}")
+                    with open(saved, "wb") as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    written += len(data)
+                    text = processor.file_to_markdown(saved, executor)
+                    os.remove(saved)
+                else:
+                    text = processor.file_to_markdown(data, executor, file_name=file_name)
+                timings.append(time.perf_counter() - start)
+            modes[mode] = {
+                "ms": percentiles(timings),
+                "bytes_written_per_upload": written // args.runs,
+                "characters": len(text)
+            }
+        results[kind] = {"bytes": len(data), **modes}
+    return results
+
+def measure_retention(args, tmp: str) -> dict:
+    from src.upload_store import UploadStore
+    
+    directory = os.path.join(tmp, "retention")
+    # Stands in for the databases sharing the volume's root
+    other = os.path.join(directory, "chroma_db", "chroma.sqlite3")
+    os.makedirs(os.path.dirname(other), exist_ok=True)
+    with open(other, "wb") as f:
+        f.write(os.urandom(1024 * 1024))
+    
+    store = UploadStore(directory, max_bytes=args.retention_mb * 1024 * 1024)
+    kept = []
+    for d in range(args.documents):
+        path = os.path.join(tmp, f"kept-{d}.pdf")
+        make_pdf(path, args.pages // 4, seed=10 + d)
+        with open(path, "rb") as f:
+            data = f.read()
+        doc_id = f"{d:08d}-0000-0000-0000-000000000000"
+        store.save(str(d % 3), doc_id, "kept.pdf", data)
+        kept.append((str(d % 3), doc_id, data))
+        time.sleep(0.01)
+    loadable = sum(store.load(user_id, doc_id, "kept.pdf") == data for user_id, doc_id, data in kept)
+    return {
+        "budget_bytes": store.max_bytes,
+        "bytes_on_disk": store.total_bytes(),
+        "compression_ratio": round(store.stats["original_bytes"] / max(1, store.stats["stored_bytes"]), 2),
+        "loadable": loadable,
+        "other_files_kept": os.path.exists(other),
+        **store.stats
+    }
+
+async def measure_reindex(args, tmp: str) -> dict:
+    from config.config import Config
+    from src.bot import TelegramBot
+    
+    bot = TelegramBot()
+    await bot.post_init(None)
+    fake_bot = FakeBot()
+    context = FakeContext(fake_bot)
+    store = bot.vector_store
+    user = FakeUser(1)
+    try:
+        path = os.path.join(tmp, "reindexed.pdf")
+        make_pdf(path, args.pages // 4, seed=3)
+        start = time.perf_counter()
+        await upload(bot, context, fake_bot, user, path)
+        indexed = time.perf_counter() - start
+        document = store.get_user_documents(str(user.id))[0]
+        kept = bot.uploads.load(document.user_id, document.doc_id, document.name) is not None
+        
+        bot.uploads.delete(document.user_id, document.doc_id, document.name)
+        Config.CHUNK_SIZE = args.new_chunk_size
+        bot.reindexer.chunks_per_minute = 0
+        reindexed = await bot.reindexer.reindex(document)
+        rebuilt = store.get_user_documents(str(user.id))[0]
+        return {
+            "indexed_seconds": round(indexed, 2),
+            "original_kept": kept,
+            "reindexed_from_chunks": reindexed,
+            "chunks_before": document.chunk_count,
+            "chunks_after": rebuilt.chunk_count,
+            "buffered_bytes_after": bot.ingestion.buffered
+        }
+    finally:
+        await bot.post_shutdown(None)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=5, help="Parses per file and mode")
+    parser.add_argument("--documents", type=int, default=10, help="Originals saved to the upload store")
+    parser.add_argument("--retention-mb", type=float, default=1)
+    parser.add_argument("--new-chunk-size", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds per embeddings request")
+    args = parser.parse_args()
+    
+    server = FakeOpenAIServer(latency=args.latency).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, value in {
+            "CHROMA_DIR": "chroma_db",
+            "EMBEDDING_CACHE_PATH": "embedding_cache.sqlite3",
+            "METADATA_DB_PATH": "documents.sqlite3",
+            "INGESTION_JOBS_PATH": "ingestion_jobs.sqlite3",
+            "LEXICAL_INDEX_PATH": "lexical_index.sqlite3",
+            "SESSION_DB_PATH": "sessions.sqlite3",
+            "COMPACT_STORE_DIR": "compact_vectors",
+            "RAILWAY_VOLUME_MOUNT_PATH": "uploads"
+        }.items():
+            os.environ[name] = os.path.join(tmp, value)
+        os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+        os.environ["REINDEX_ON_STARTUP"] = "false"
+        os.environ["SUMMARIES_ENABLED"] = "false"
+        configure_environment(server.base_url)
+        try:
+            executor = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+            try:
+                parsing = measure_parsing(args, tmp, executor)
+            finally:
+                executor.shutdown()
+            retention = measure_retention(args, tmp)
+            reindex = asyncio.run(measure_reindex(args, tmp))
+        finally:
+            server.stop()
+    print(json.dumps({
+        "benchmark": "uploads",
+        "settings": vars(args),
+        "parsing": parsing,
+        "retention": retention,
+        "reindex": reindex
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Load-test webhook mode: throughput of synthetic Telegram updates against bot worker count.
+
+Starts `python main.py` with BOT_MODE=webhook for each worker count, posts
+updates from many simulated users to the gunicorn front, and waits until the
+fake Bot API has received every reply. Each user alternates /help and /list,
+so replies arriving out of order show up as ordering violations:
+
+    python -m benchmarks.bench_webhook --workers 1 2 4 --users 200 --updates-per-user 5
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import configure_environment
+from benchmarks.fake_telegram import FakeTelegramServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = ["/help", "/list"]
+REPLIES = ["Available commands", "No documents uploaded yet"]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        }
+    }
+
+def post(port: int, path: str, update: dict) -> float:
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        connection.request("POST", path, json.dumps(update), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Webhook returned {response.status}")
+    finally:
+        connection.close()
+    return (time.perf_counter() - start) * 1000
+
+def wait_for(condition, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for {what}")
+        time.sleep(0.05)
+
+def healthy(port: int) -> bool:
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+        connection.request("GET", "/healthz")
+        return connection.getresponse().status == 200
+    except OSError:
+        return False
+
+def run(workers: int, telegram: FakeTelegramServer, args) -> dict:
+    telegram.reset()
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            BOT_MODE="webhook",
+            BOT_WORKERS=str(workers),
+            WEBHOOK_FRONT_WORKERS=str(args.front_workers),
+            WEBHOOK_URL="",
+            PORT=str(port),
+            TELEGRAM_BASE_URL=telegram.base_url,
+            UPDATE_QUEUE_PATH=os.path.join(tmp, "updates.sqlite3"),
+            METADATA_DB_PATH=os.path.join(tmp, "documents.sqlite3"),
+            INGESTION_JOBS_PATH=os.path.join(tmp, "ingestion_jobs.sqlite3"),
+            SESSION_DB_PATH=os.path.join(tmp, "sessions.sqlite3"),
+            LEXICAL_INDEX_PATH=os.path.join(tmp, "lexical_index.sqlite3"),
+            EMBEDDING_CACHE_PATH=os.path.join(tmp, "embedding_cache.sqlite3"),
+            CHROMA_DIR=os.path.join(tmp, "chroma_db"),
+            COMPACT_STORE_DIR=os.path.join(tmp, "compact_vectors"),
+            RAILWAY_VOLUME_MOUNT_PATH=os.path.join(tmp, "uploads"),
+            ANONYMIZED_TELEMETRY="False"
+        )
+        with open(os.path.join(tmp, "server.log"), "w") as log:
+            server = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+            try:
+                wait_for(lambda: healthy(port) and telegram.request_count("getMe") >= workers, 120, "the webhook to start")
+                
+                updates = [
+                    (user, make_update(user * 1000 + i, user, COMMANDS[i % 2]))
+                    for i in range(args.updates_per_user) for user in range(1, args.users + 1)
+                ]
+                start = time.perf_counter()
+                with ThreadPoolExecutor(args.clients) as pool:
+                    post_ms = list(pool.map(lambda item: post(port, "/telegram", item[1]), updates))
+                accepted = time.perf_counter() - start
+                wait_for(lambda: telegram.request_count("sendMessage") >= len(updates), 300, "every reply")
+                elapsed = time.perf_counter() - start
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
+    
+    violations = 0
+    for user in range(1, args.users + 1):
+        for i, text in enumerate(telegram.sent_to(user)):
+            if not text.startswith(REPLIES[i % 2]):
+                violations += 1
+                break
+    return {
+        "workers": workers,
+        "updates": len(updates),
+        "accepted_per_second": round(len(updates) / accepted, 1),
+        "handled_per_second": round(len(updates) / elapsed, 1),
+        "post_ms_p50": round(statistics.median(post_ms), 2),
+        "post_ms_p95": round(sorted(post_ms)[int(0.95 * (len(post_ms) - 1))], 2),
+        "users_out_of_order": violations
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--front-workers", type=int, default=2)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates-per-user", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent connections posting updates")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per Bot API call")
+    args = parser.parse_args()
+    
+    configure_environment()
+    telegram = FakeTelegramServer(latency=args.latency).start()
+    try:
+        results = [run(workers, telegram, args) for workers in args.workers]
+    finally:
+        telegram.stop()
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import random
+import sys
+
+# Make `config` and `src` importable when run as `python -m benchmarks.<name>`
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = (
+    "lecture exam chapter theorem proof definition example equation model data "
+    "analysis method result figure table section course student question answer "
+    "network energy matrix vector function integral derivative probability"
+).split()
+
+def configure_environment(base_url: str = None):
+    """Set dummy credentials so Config can be imported without real secrets."""
+    os.environ.setdefault("TELEGRAM_TOKEN", "benchmark-token")
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark-key")
+    # The fakes don't enforce OpenAI's limits, so don't throttle against them
+    for name in ("OPENAI_EMBEDDING_RPM", "OPENAI_EMBEDDING_TPM", "OPENAI_CHAT_RPM", "OPENAI_CHAT_TPM"):
+        os.environ.setdefault(name, "0")
+    if base_url:
+        os.environ["OPENAI_BASE_URL"] = base_url
+        import openai
+        openai.base_url = base_url
+
+def synthetic_text(n_words: int, seed: int = 0) -> str:
+    """Generate deterministic filler text with sentence punctuation."""
+    rng = random.Random(seed)
+    words = []
+    for i in range(n_words):
+        word = rng.choice(WORDS)
+        words.append(word + ("." if i % 15 == 14 else ""))
+    return " ".join(words)
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+WORDS = (
+    "the answer depends on the section where the document explains this result "
+    "in terms of the main definition and the example that follows it"
+).split()
+
+class FakeOpenAIServer:
+    """Local stand-in for the OpenAI embeddings and chat completions APIs with configurable latency.
+    
+    Chat completions wait completion_latency before the first token, then
+    send completion_tokens words token_delay apart, streamed or not. With
+    rpm or tpm set, each endpoint enforces those limits like OpenAI does,
+    replenishing continuously over limit_window seconds, and answers 429
+    with a retry-after header when a request would exceed them.
+    """
+    
+    def __init__(
+        self,
+        latency: float = 0.05,
+        per_item_latency: float = 0.0,
+        dimensions: int = 1536,
+        error_rate: float = 0.0,
+        completion_latency: float = 0.3,
+        token_delay: float = 0.01,
+        completion_tokens: int = 80,
+        rpm: int = 0,
+        tpm: int = 0,
+        limit_window: float = 60.0,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ):
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.dimensions = dimensions
+        self.error_rate = error_rate
+        self.completion_latency = completion_latency
+        self.token_delay = token_delay
+        self.completion_tokens = completion_tokens
+        self.rpm = rpm
+        self.tpm = tpm
+        self.limit_window = limit_window
+        self.requests: Dict[str, int] = {}
+        self.items: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+        # Per endpoint: (requests left, tokens left, last refill)
+        self._budgets: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+    
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.items.clear()
+            self.rejected.clear()
+            self._budgets.clear()
+    
+    def request_count(self, path: str = "/v1/embeddings") -> int:
+        with self._lock:
+            return self.requests.get(path, 0)
+    
+    def rejected_count(self, path: str = "/v1/embeddings") -> int:
+        with self._lock:
+            return self.rejected.get(path, 0)
+    
+    def admit(self, path: str, tokens: int) -> float:
+        """Charge a request against the endpoint's limits; returns 0, or seconds to retry after."""
+        if not self.rpm and not self.tpm:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            requests, token_budget, updated = self._budgets.get(path, (self.rpm, self.tpm, now))
+            elapsed = now - updated
+            requests = min(self.rpm, requests + elapsed * self.rpm / self.limit_window)
+            token_budget = min(self.tpm, token_budget + elapsed * self.tpm / self.limit_window)
+            retry_after = 0.0
+            if self.rpm and requests < 1:
+                retry_after = (1 - requests) * self.limit_window / self.rpm
+            if self.tpm and token_budget < tokens:
+                retry_after = max(retry_after, (tokens - token_budget) * self.limit_window / self.tpm)
+            if retry_after:
+                self.rejected[path] = self.rejected.get(path, 0) + 1
+            else:
+                requests -= 1
+                token_budget -= tokens
+            self._budgets[path] = (requests, token_budget, now)
+            return retry_after
+    
+    def count_tokens(self, texts: List[str]) -> int:
+        from src.tokenizer import get_tokenizer
+        
+        tokenizer = get_tokenizer()
+        return sum(len(tokenizer.encode(str(text))) for text in texts)
+    
+    def embedding(self, text: str) -> List[float]:
+        """Deterministic pseudo-embedding so identical text maps to identical vectors."""
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [rng.uniform(-1.0, 1.0) for _ in range(self.dimensions)]
+    
+    def _record(self, path: str, n_items: int):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            self.items[path] = self.items.get(path, 0) + n_items
+    
+    def handle_embeddings(self, body: dict) -> dict:
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return {
+            "object": "list",
+            "model": body.get("model", "text-embedding-ada-002"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": self.embedding(text)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}
+        }
+    
+    def completion_words(self, body: dict) -> List[str]:
+        """Deterministic answer words for the last message of a chat request."""
+        messages = body.get("messages") or [{"content": ""}]
+        seed = int.from_bytes(hashlib.sha256(str(messages[-1].get("content", "")).encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [rng.choice(WORDS) + " " for _ in range(self.completion_tokens)]
+    
+    def completion_chunk(self, body: dict, delta: dict, finish_reason=None) -> dict:
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+    
+    def handle_completion(self, body: dict) -> dict:
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(self.completion_words(body)).strip()},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": self.completion_tokens, "total_tokens": self.completion_tokens}
+        }
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def _send_json(self, status: int, payload: dict, headers: dict = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def _stream_completion(self, body: dict):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                events = [server.completion_chunk(body, {"role": "assistant", "content": ""})]
+                events += [server.completion_chunk(body, {"content": word}) for word in server.completion_words(body)]
+                events.append(server.completion_chunk(body, {}, "stop"))
+                for i, event in enumerate(events):
+                    if i > 1:
+                        time.sleep(server.token_delay)
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+            
+            def _rejected(self, path: str, texts: List[str], extra_tokens: int = 0) -> bool:
+                tokens = server.count_tokens(texts) + extra_tokens if server.tpm else 0
+                retry_after = server.admit(path, tokens)
+                if retry_after:
+                    self._send_json(
+                        429,
+                        {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                        {"retry-after": f"{retry_after:.3f}"}
+                    )
+                return bool(retry_after)
+            
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                path = self.path.split("?")[0]
+                
+                if path.endswith("/embeddings"):
+                    inputs = body.get("input", [])
+                    n_items = 1 if isinstance(inputs, str) else len(inputs)
+                    server._record("/v1/embeddings", n_items)
+                    if self._rejected("/v1/embeddings", [inputs] if isinstance(inputs, str) else inputs):
+                        return
+                    time.sleep(server.latency + server.per_item_latency * n_items)
+                    if server.error_rate and random.random() < server.error_rate:
+                        self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+                        return
+                    self._send_json(200, server.handle_embeddings(body))
+                elif path.endswith("/chat/completions"):
+                    server._record("/v1/chat/completions", 1)
+                    prompt = [message.get("content", "") for message in body.get("messages", [])]
+                    if self._rejected("/v1/chat/completions", prompt, body.get("max_tokens") or 0):
+                        return
+                    time.sleep(server.completion_latency)
+                    if server.error_rate and random.random() < server.error_rate:
+                        self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+                        return
+                    if body.get("stream"):
+                        self._stream_completion(body)
+                    else:
+                        time.sleep(server.token_delay * server.completion_tokens)
+                        self._send_json(200, server.handle_completion(body))
+                else:
+                    self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+        
+        return Handler
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs
+
+class FakeTelegramServer:
+    """Local stand-in for the Telegram Bot API that records the messages a bot sends."""
+    
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.requests: Dict[str, int] = {}
+        # (chat_id, method, text) in the order the bot sent them
+        self.sent: List[Tuple[int, str, str]] = []
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self) -> "FakeTelegramServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.sent.clear()
+    
+    def request_count(self, method: str) -> int:
+        with self._lock:
+            return self.requests.get(method, 0)
+    
+    def sent_to(self, chat_id: int) -> List[str]:
+        with self._lock:
+            return [text for chat, _, text in self.sent if chat == chat_id]
+    
+    def handle(self, method: str, params: dict) -> object:
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            if method == "getMe":
+                return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+            if method in ("sendMessage", "editMessageText"):
+                chat_id = int(params.get("chat_id", 0))
+                self.sent.append((chat_id, method, params.get("text", "")))
+                if method == "sendMessage":
+                    self._message_id += 1
+                message_id = int(params.get("message_id", self._message_id))
+                return {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": params.get("text", "")
+                }
+            # setWebhook, deleteMessage, answerCallbackQuery, ...
+            return True
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or "{}")
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body).items()}
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                
+                time.sleep(server.latency)
+                data = json.dumps({"ok": True, "result": server.handle(method, params)}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+        
+        return Handler
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+class FakeDocument:
+    def __init__(self, file_id: str, file_name: str):
+        self.file_id = file_id
+        self.file_name = file_name
+
+class FakeMessage:
+    """In-process stand-in for telegram.Message that records what the bot shows."""
+    
+    def __init__(self, chat: "FakeChat", text: str = None, document: FakeDocument = None):
+        self.chat = chat
+        self.text = text
+        self.document = document
+        self.deleted = False
+    
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        message = FakeMessage(self.chat, text)
+        self.chat.record(message, text)
+        return message
+    
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        self.text = text
+        self.chat.record(self, text)
+        return self
+    
+    async def delete(self):
+        self.deleted = True
+
+class FakeChat:
+    """Everything the bot sent to one user, with timestamps."""
+    
+    def __init__(self):
+        self.events: List[Tuple[float, "FakeMessage", str]] = []
+    
+    def record(self, message: FakeMessage, text: str):
+        self.events.append((time.perf_counter(), message, text))
+
+class FakeCallbackQuery:
+    def __init__(self, user: FakeUser, data: str, chat: FakeChat):
+        self.from_user = user
+        self.data = data
+        self.message = FakeMessage(chat)
+    
+    async def answer(self, text: str = None, **kwargs):
+        pass
+    
+    async def edit_message_reply_markup(self, reply_markup=None, **kwargs):
+        self.message.reply_markup = reply_markup
+
+class FakeUpdate:
+    """In-process stand-in for telegram.Update carrying a message or a callback query."""
+    
+    def __init__(self, user: FakeUser, chat: FakeChat, text: str = None, document: FakeDocument = None, callback_data: str = None):
+        self.effective_user = user
+        self.message = FakeMessage(chat, text, document) if callback_data is None else None
+        self.callback_query = FakeCallbackQuery(user, callback_data, chat) if callback_data is not None else None
+
+class FakeFile:
+    def __init__(self, data: bytes):
+        self.data = data
+    
+    async def download_as_bytearray(self) -> bytearray:
+        return bytearray(self.data)
+
+class FakeBot:
+    """Serves uploaded files by id for context.bot.get_file."""
+    
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+    
+    async def get_file(self, file_id: str) -> FakeFile:
+        return FakeFile(self.files[file_id])
+
+class FakeContext:
+    def __init__(self, bot: FakeBot):
+        self.bot = bot
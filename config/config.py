@@ -1,30 +1,29 @@
 import os
 import sys
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 import logging
 from .secrets import get_secret
 
-# Configure logging first
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('bot.log')
-    ]
-)
-
 logger = logging.getLogger(__name__)
 
-# Find and load .env file
+# Find and load .env file. Importing this module has no other side effects:
+# logging, validation and directories are set up by Config.init()
 env_path = Path(__file__).parent.parent / '.env'
-logger.info(f"Looking for .env file at: {env_path}")
 if env_path.exists():
-    logger.info(f"Loading environment variables from {env_path}")
     load_dotenv(env_path)
-else:
-    logger.warning(f".env file not found at {env_path}")
+
+def configure_logging():
+    """Log to stdout and bot.log."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler('bot.log')
+        ]
+    )
 
 def get_telegram_token():
     """Get Telegram token with detailed logging."""
@@ -57,8 +56,8 @@ class Config:
     RAILWAY_ENVIRONMENT_NAME = os.getenv('RAILWAY_ENVIRONMENT_NAME', 'development')
     RAILWAY_SERVICE_NAME = os.getenv('RAILWAY_SERVICE_NAME', 'local')
     
-    # Log environment variables
-    log_environment_variables()
+    # Log every environment variable (sensitive ones hidden) at startup
+    LOG_ENVIRONMENT = os.getenv('LOG_ENVIRONMENT', 'false').lower() == 'true'
     
     # Bot Configuration - try multiple methods
     TELEGRAM_TOKEN = (
@@ -67,40 +66,208 @@ class Config:
         get_secret('BOT_TOKEN')
     )
     
-    if not TELEGRAM_TOKEN:
-        available_vars = [
-            key for key in os.environ.keys()
-            if 'TOKEN' in key or 'KEY' in key
-        ]
-        logger.error(f"Available environment variables with TOKEN/KEY: {available_vars}")
-        raise ValueError(
-            "No Telegram token found in any configuration source. "
-            "Please set TELEGRAM_TOKEN or TELEGRAM_BOT_TOKEN in environment variables or config files."
-        )
-    
     # OpenAI Configuration
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
-    if not OPENAI_API_KEY:
-        raise ValueError(
-            "OPENAI_API_KEY not found in environment variables. "
-            "Please set it in Railway's environment variables."
-        )
-    
-    # Model configurations
-    EMBEDDING_MODEL = "text-embedding-ada-002"
+    
+    # Model configurations. EMBEDDING_MODEL may name a local CPU model instead of
+    # an OpenAI one: onnx/all-MiniLM-L6-v2, or local/<sentence-transformers model>
+    EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+    # Where local embedding models are cached; empty uses each library's default
+    LOCAL_EMBEDDING_MODEL_DIR = os.getenv('LOCAL_EMBEDDING_MODEL_DIR', '')
     GPT_MODEL = "gpt-4o-mini"
     
-    # Chunking configurations
-    CHUNK_SIZE = 500
-    CHUNK_OVERLAP = 50
+    # Embedding pipeline configurations
+    EMBEDDING_BATCH_TOKENS = int(os.getenv('EMBEDDING_BATCH_TOKENS', '20000'))
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '100'))
+    EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', '4'))
+    EMBEDDING_MAX_RETRIES = int(os.getenv('EMBEDDING_MAX_RETRIES', '5'))
+    
+    # Client-side OpenAI rate limits per minute (0 disables one), set to the account's
+    # limits for EMBEDDING_MODEL and GPT_MODEL; split evenly between webhook bot workers.
+    # Bulk calls (ingestion, summaries) leave OPENAI_INTERACTIVE_SHARE of each budget to questions
+    OPENAI_EMBEDDING_RPM = int(os.getenv('OPENAI_EMBEDDING_RPM', '3000'))
+    OPENAI_EMBEDDING_TPM = int(os.getenv('OPENAI_EMBEDDING_TPM', '1000000'))
+    OPENAI_CHAT_RPM = int(os.getenv('OPENAI_CHAT_RPM', '500'))
+    OPENAI_CHAT_TPM = int(os.getenv('OPENAI_CHAT_TPM', '200000'))
+    OPENAI_INTERACTIVE_SHARE = float(os.getenv('OPENAI_INTERACTIVE_SHARE', '0.2'))
+    # Retries of a chat call or a question's embedding after a 429, 5xx or connection error
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+    
+    # Vector and embedding cache storage
+    CHROMA_DIR = os.getenv('CHROMA_DIR', './chroma_db')
+    # A Chroma server to use instead of CHROMA_DIR, e.g. when several bot processes share it
+    CHROMA_HOST = os.getenv('CHROMA_HOST', '')
+    CHROMA_PORT = int(os.getenv('CHROMA_PORT', '8000'))
+    # How vectors are split across collections: global, user, document or shard
+    CHROMA_PARTITIONING = os.getenv('CHROMA_PARTITIONING', 'global')
+    CHROMA_SHARDS = int(os.getenv('CHROMA_SHARDS', '16'))
+    # 'chroma', or 'compact' for quantized per-document vector files (partitioning doesn't apply)
+    VECTOR_STORE = os.getenv('VECTOR_STORE', 'chroma')
+    COMPACT_STORE_DIR = os.getenv('COMPACT_STORE_DIR', './compact_vectors')
+    # float16 or int8; with COMPACT_RERANK, the best n_results * COMPACT_RERANK_FACTOR
+    # candidates are re-scored against a float32 copy kept on disk
+    COMPACT_QUANTIZATION = os.getenv('COMPACT_QUANTIZATION', 'int8')
+    COMPACT_RERANK = os.getenv('COMPACT_RERANK', 'true').lower() == 'true'
+    COMPACT_RERANK_FACTOR = int(os.getenv('COMPACT_RERANK_FACTOR', '4'))
+    # Selected documents up to MATRIX_CACHE_MAX_CHUNKS chunks are searched in memory
+    MATRIX_CACHE_DOCUMENTS = int(os.getenv('MATRIX_CACHE_DOCUMENTS', '64'))
+    MATRIX_CACHE_MAX_CHUNKS = int(os.getenv('MATRIX_CACHE_MAX_CHUNKS', '5000'))
+    EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', './embedding_cache.sqlite3')
+    EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv('EMBEDDING_CACHE_MEMORY_ITEMS', '10000'))
+    EMBEDDING_CACHE_MAX_BYTES = int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', str(1024 ** 3)))
+    
+    # Document metadata storage
+    METADATA_DB_PATH = os.getenv('METADATA_DB_PATH', './documents.sqlite3')
+    METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', '1024'))
+    
+    # Per-document BM25 index, fused with vector hits by reciprocal rank
+    LEXICAL_INDEX_PATH = os.getenv('LEXICAL_INDEX_PATH', './lexical_index.sqlite3')
+    HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+    
+    # Minimum seconds between edits while streaming an answer into Telegram
+    STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+    
+    # Answer cache: exact and semantic (cosine >= ANSWER_CACHE_SIMILARITY) matches per document
+    ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '5000'))
+    ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', str(24 * 3600)))
+    ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.95'))
+    
+    # User sessions: sqlite (SESSION_DB_PATH), redis (REDIS_URL) or memory;
+    # sessions idle for SESSION_TTL seconds expire
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite')
+    SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', './sessions.sqlite3')
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    SESSION_TTL = int(os.getenv('SESSION_TTL', str(30 * 24 * 3600)))
     
-    # File storage - use Railway's persistent storage path if available
+    # Conversation memory: recent turns up to HISTORY_MAX_TOKENS go into the prompt,
+    # older ones are folded into a summary of at most HISTORY_SUMMARY_TOKENS (0 drops them)
+    HISTORY_MAX_TOKENS = int(os.getenv('HISTORY_MAX_TOKENS', '1500'))
+    HISTORY_SUMMARY_TOKENS = int(os.getenv('HISTORY_SUMMARY_TOKENS', '200'))
+    
+    # Retrieval: RETRIEVAL_CANDIDATES chunks are fetched, those within
+    # RETRIEVAL_DISTANCE_MARGIN of the closest are merged, deduplicated and
+    # packed into CONTEXT_MAX_TOKENS of prompt
+    RETRIEVAL_CANDIDATES = int(os.getenv('RETRIEVAL_CANDIDATES', '12'))
+    RETRIEVAL_DISTANCE_MARGIN = float(os.getenv('RETRIEVAL_DISTANCE_MARGIN', '0.15'))
+    CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv('CONTEXT_DUPLICATE_THRESHOLD', '0.8'))
+    CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', '2500'))
+    ANSWER_MAX_TOKENS = int(os.getenv('ANSWER_MAX_TOKENS', '1000'))
+    
+    # Questions over several documents: each is searched for LIBRARY_RETRIEVAL_CANDIDATES
+    # chunks, SEARCH_FANOUT at a time, the best LIBRARY_RETRIEVAL_CANDIDATES overall are
+    # kept and packed into LIBRARY_CONTEXT_MAX_TOKENS of prompt
+    SEARCH_FANOUT = int(os.getenv('SEARCH_FANOUT', '8'))
+    LIBRARY_RETRIEVAL_CANDIDATES = int(os.getenv('LIBRARY_RETRIEVAL_CANDIDATES', '24'))
+    LIBRARY_CONTEXT_MAX_TOKENS = int(os.getenv('LIBRARY_CONTEXT_MAX_TOKENS', '4000'))
+    
+    # Chunking configurations. Documents indexed with other values (or another
+    # EMBEDDING_MODEL) are re-indexed in the background at startup, from their kept originals
+    # or else their stored chunks, at most REINDEX_CHUNKS_PER_MINUTE chunks a minute (0 for no limit).
+    # Replaced vectors are kept REINDEX_RETIRE_SECONDS for queries already using them
+    CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '500'))
+    CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '50'))
+    REINDEX_ON_STARTUP = os.getenv('REINDEX_ON_STARTUP', 'true').lower() == 'true'
+    REINDEX_CHUNKS_PER_MINUTE = int(os.getenv('REINDEX_CHUNKS_PER_MINUTE', '600'))
+    REINDEX_RETIRE_SECONDS = float(os.getenv('REINDEX_RETIRE_SECONDS', '600'))
+    
+    # Summaries: after ingestion, each section (from the document's headings, or every
+    # SECTION_FALLBACK_CHUNKS chunks without them) and then the whole document is summarized
+    # in the background, reading at most SUMMARY_INPUT_TOKENS per request. Broad questions
+    # ("summarize chapter 2", "what is this about") are answered from these summaries
+    SUMMARIES_ENABLED = os.getenv('SUMMARIES_ENABLED', 'true').lower() == 'true'
+    SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', GPT_MODEL)
+    SUMMARY_INPUT_TOKENS = int(os.getenv('SUMMARY_INPUT_TOKENS', '6000'))
+    SECTION_SUMMARY_TOKENS = int(os.getenv('SECTION_SUMMARY_TOKENS', '200'))
+    DOCUMENT_SUMMARY_TOKENS = int(os.getenv('DOCUMENT_SUMMARY_TOKENS', '400'))
+    SECTION_FALLBACK_CHUNKS = int(os.getenv('SECTION_FALLBACK_CHUNKS', '20'))
+    SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '4'))
+    
+    # PDF extraction: documents with at least PDF_PARALLEL_MIN_PAGES pages are
+    # split into PDF_PAGES_PER_TASK page ranges across worker processes
+    PDF_WORKERS = int(os.getenv('PDF_WORKERS', str(os.cpu_count() or 1)))
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '32'))
+    PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '16'))
+    
+    # Ingestion queue configurations
+    INGESTION_QUEUE_SIZE = int(os.getenv('INGESTION_QUEUE_SIZE', '100'))
+    INGESTION_CONCURRENCY = int(os.getenv('INGESTION_CONCURRENCY', '2'))
+    INGESTION_PER_USER_LIMIT = int(os.getenv('INGESTION_PER_USER_LIMIT', '2'))
+    INGESTION_PROCESS_WORKERS = int(os.getenv('INGESTION_PROCESS_WORKERS', str(os.cpu_count() or 1)))
+    # Queued and running jobs, uploads included, saved so the next start resumes them
+    INGESTION_JOBS_PATH = os.getenv('INGESTION_JOBS_PATH', './ingestion_jobs.sqlite3')
+    
+    # Serving: 'polling' runs one process; 'webhook' runs WEBHOOK_FRONT_WORKERS gunicorn
+    # workers on PORT that queue updates for BOT_WORKERS bot processes, partitioned by user
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    # Public base URL Telegram should post to, e.g. https://mybot.up.railway.app
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    PORT = int(os.getenv('PORT', '8080'))
+    WEBHOOK_FRONT_WORKERS = int(os.getenv('WEBHOOK_FRONT_WORKERS', '2'))
+    BOT_WORKERS = int(os.getenv('BOT_WORKERS', str(os.cpu_count() or 1)))
+    UPDATE_QUEUE_PATH = os.getenv('UPDATE_QUEUE_PATH', './updates.sqlite3')
+    # Updates each bot process handles at once (in polling mode too; a user's updates
+    # are always handled one at a time), and seconds before an unacknowledged
+    # update (from a process that died) is handed out again
+    WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '32'))
+    WORKER_POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '0.05'))
+    UPDATE_CLAIM_TIMEOUT = float(os.getenv('UPDATE_CLAIM_TIMEOUT', '300'))
+    # Prometheus metrics on http://host:METRICS_PORT/metrics (0 disables; webhook bot
+    # workers use METRICS_PORT + their partition), and a timing line per request in the log
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+    TRACE_LOG = os.getenv('TRACE_LOG', 'false').lower() == 'true'
+    # Load the tokenizer, vector database client and parsers in the background at
+    # startup, instead of on the first upload or question
+    WARM_UP = os.getenv('WARM_UP', 'true').lower() == 'true'
+    # Bot API server to talk to instead of api.telegram.org (a local Bot API server or a fake)
+    TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', '')
+    
+    # File storage - use Railway's persistent storage path if available. Uploads are
+    # parsed from memory; originals are kept in UPLOAD_DIR only for re-indexing,
+    # gzip-compressed at UPLOAD_COMPRESSION_LEVEL, none over UPLOAD_RETENTION_MAX_FILE_MB,
+    # and the least recently used evicted past UPLOAD_RETENTION_MB in total (0 keeps none)
     UPLOAD_DIR = os.getenv('RAILWAY_VOLUME_MOUNT_PATH', 'uploads')
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-
+    UPLOAD_RETENTION_MB = float(os.getenv('UPLOAD_RETENTION_MB', '1024'))
+    UPLOAD_RETENTION_MAX_FILE_MB = float(os.getenv('UPLOAD_RETENTION_MAX_FILE_MB', '50'))
+    UPLOAD_COMPRESSION_LEVEL = int(os.getenv('UPLOAD_COMPRESSION_LEVEL', '6'))
+    # Scratch files, off the volume: large PDFs split across processes, and uploads queued
+    # past INGESTION_BUFFER_MB in memory. /dev/shm keeps them in memory, where it is large enough
+    SPOOL_DIR = os.getenv('SPOOL_DIR', tempfile.gettempdir())
+    INGESTION_BUFFER_MB = float(os.getenv('INGESTION_BUFFER_MB', '256'))
+    
+    @classmethod
+    def init(cls):
+        """Set up logging, check the configuration and create directories. Call once at startup."""
+        configure_logging()
+        if env_path.exists():
+            logger.info(f"Loaded environment variables from {env_path}")
+        else:
+            logger.warning(f".env file not found at {env_path}")
+        if cls.LOG_ENVIRONMENT:
+            log_environment_variables()
+        cls.validate()
+        os.makedirs(cls.UPLOAD_DIR, exist_ok=True)
+    
     @classmethod
     def validate(cls):
-        """Print current configuration values (safely)"""
+        """Check required secrets and print current configuration values (safely)"""
+        if not cls.TELEGRAM_TOKEN:
+            available_vars = [
+                key for key in os.environ.keys()
+                if 'TOKEN' in key or 'KEY' in key
+            ]
+            logger.error(f"Available environment variables with TOKEN/KEY: {available_vars}")
+            raise ValueError(
+                "No Telegram token found in any configuration source. "
+                "Please set TELEGRAM_TOKEN or TELEGRAM_BOT_TOKEN in environment variables or config files."
+            )
+        if not cls.OPENAI_API_KEY:
+            raise ValueError(
+                "OPENAI_API_KEY not found in environment variables. "
+                "Please set it in Railway's environment variables."
+            )
+        
         logger.info("=== Current Configuration ===")
         logger.info(f"Environment: {cls.RAILWAY_ENVIRONMENT_NAME}")
         logger.info(f"Service: {cls.RAILWAY_SERVICE_NAME}")
@@ -108,6 +275,3 @@ class Config:
         logger.info(f"OPENAI_API_KEY exists: {bool(cls.OPENAI_API_KEY)}")
         logger.info(f"UPLOAD_DIR: {cls.UPLOAD_DIR}")
         logger.info("=========================")
-
-# Validate configuration on module load
-Config.validate() 
\ No newline at end of file
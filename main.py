@@ -1,6 +1,12 @@
-from src.bot import TelegramBot
+from config.config import Config
 
 def main():
+    Config.init()
+    if Config.BOT_MODE == "webhook":
+        from src.webhook import serve
+        serve()
+        return
+    from src.bot import TelegramBot
     bot = TelegramBot()
     bot.run()
 
@@ -0,0 +1,149 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class CachedAnswer:
+    def __init__(self, answer: str, embedding: Optional[List[float]], latency: float):
+        self.answer = answer
+        self.embedding = np.asarray(embedding, dtype=np.float32) if embedding is not None else None
+        if self.embedding is not None:
+            norm = np.linalg.norm(self.embedding)
+            if norm:
+                self.embedding /= norm
+        self.latency = latency
+        self.created_at = time.time()
+
+class AnswerCache:
+    """Per-document cache of generated answers for repeated questions.
+    
+    The exact tier matches normalized query text; the semantic tier matches
+    query embeddings above a cosine similarity threshold. Entries expire
+    after a TTL, the least recently used are evicted past the size limit,
+    and a document's entries are dropped when it is re-indexed.
+    """
+    
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        similarity_threshold: Optional[float] = None
+    ):
+        self.max_entries = max_entries or Config.ANSWER_CACHE_SIZE
+        self.ttl = Config.ANSWER_CACHE_TTL if ttl is None else ttl
+        self.similarity_threshold = similarity_threshold or Config.ANSWER_CACHE_SIMILARITY
+        self._entries: "OrderedDict[Tuple[str, str], CachedAnswer]" = OrderedDict()
+        self._by_document: Dict[str, Dict[str, CachedAnswer]] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+    
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Lowercase, drop punctuation and collapse whitespace."""
+        return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+    
+    def _expired(self, entry: CachedAnswer) -> bool:
+        return self.ttl > 0 and time.time() - entry.created_at > self.ttl
+    
+    def _remove(self, key: Tuple[str, str]):
+        self._entries.pop(key, None)
+        document_entries = self._by_document.get(key[0])
+        if document_entries is not None:
+            document_entries.pop(key[1], None)
+            if not document_entries:
+                del self._by_document[key[0]]
+    
+    def _hit(self, key: Tuple[str, str], entry: CachedAnswer, tier: str) -> str:
+        self._entries.move_to_end(key)
+        if tier == "exact":
+            self.exact_hits += 1
+        else:
+            self.semantic_hits += 1
+        self.latency_saved += entry.latency
+        logger.info(f"Answer cache {tier} hit for document {key[0]}")
+        return entry.answer
+    
+    def lookup_exact(self, document_id: str, query: str) -> Optional[str]:
+        """Return a cached answer for the same normalized question, if any."""
+        key = (document_id, self.normalize(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                self._remove(key)
+                return None
+            return self._hit(key, entry, "exact")
+    
+    def lookup_semantic(self, document_id: str, query_embedding: List[float]) -> Optional[str]:
+        """Return the cached answer with the most similar question above the threshold.
+        
+        Counts a miss when nothing matches, so call it after lookup_exact.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        with self._lock:
+            document_entries = self._by_document.get(document_id, {})
+            candidates = [
+                (normalized, entry) for normalized, entry in document_entries.items()
+                if entry.embedding is not None and not self._expired(entry)
+            ]
+            if not candidates or not norm:
+                self.misses += 1
+                return None
+            
+            matrix = np.stack([entry.embedding for _, entry in candidates])
+            scores = matrix @ (query / norm)
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            normalized, entry = candidates[best]
+            return self._hit((document_id, normalized), entry, "semantic")
+    
+    def store(
+        self,
+        document_id: str,
+        query: str,
+        answer: str,
+        query_embedding: Optional[List[float]] = None,
+        latency: float = 0.0
+    ):
+        """Cache an answer, evicting the least recently used entries past the limit."""
+        key = (document_id, self.normalize(query))
+        entry = CachedAnswer(answer, query_embedding, latency)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._by_document.setdefault(document_id, {})[key[1]] = entry
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+    
+    def invalidate(self, document_id: str):
+        """Drop every cached answer for a document, e.g. when it is re-indexed."""
+        with self._lock:
+            for normalized in list(self._by_document.get(document_id, {})):
+                self._remove((document_id, normalized))
+    
+    def stats(self) -> Dict[str, float]:
+        """Hit rates per tier and the generation time saved by hits."""
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "latency_saved_seconds": round(self.latency_saved, 3)
+            }
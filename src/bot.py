@@ -1,27 +1,74 @@
+import asyncio
 import os
+import time
 import uuid
+import hashlib
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Application, ContextTypes, MessageHandler, CommandHandler, CallbackQueryHandler, filters
+from telegram.error import BadRequest
+from telegram.ext import (
+    Application, BaseUpdateProcessor, ContextTypes, MessageHandler, CommandHandler, CallbackQueryHandler, filters
+)
 import sys
 import logging
 import mimetypes
 from datetime import datetime
-from typing import List, Dict
+from typing import Any, AsyncIterator, Awaitable, List, Dict, Optional
 
 # Add the project root directory to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.config import Config
 from .document_processor import DocumentProcessor
-from .vector_store import VectorStore, Document
+from .vector_store import VectorStore, Document, index_fingerprint
 from .query_engine import QueryEngine
+from .ingestion import IngestionQueue, IngestionJob, IngestionBusyError
+from .reindexer import Reindexer
+from .summarizer import Summarizer
+from .upload_store import UploadStore
+from .lexical_index import exact_terms
+from .session_store import SessionStore, UserSession
+from . import metrics
+from .metrics import set_outcome, span, trace
 
 logger = logging.getLogger(__name__)
 
-class UserSession:
-    def __init__(self):
-        self.active_document_id: str = None
-        self.in_chat: bool = False
+# Telegram's limit on the length of a single message
+MAX_MESSAGE_LENGTH = 4096
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Handles updates concurrently, except that a user's updates wait for each other.
+    
+    Two quick messages from one user would otherwise race on their session
+    and could be answered out of order.
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._user_pending: Dict[int, int] = {}
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+        self._user_pending[user.id] = self._user_pending.get(user.id, 0) + 1
+        lock = self._user_locks.setdefault(user.id, asyncio.Lock())
+        try:
+            # asyncio.Lock wakes waiters first-in first-out, which keeps each user's order
+            async with lock:
+                await coroutine
+        finally:
+            self._user_pending[user.id] -= 1
+            if not self._user_pending[user.id]:
+                del self._user_pending[user.id]
+                del self._user_locks[user.id]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
 
 class TelegramBot:
     def __init__(self):
@@ -29,19 +76,76 @@ class TelegramBot:
         self.document_processor = DocumentProcessor()
         self.vector_store = VectorStore()
         self.query_engine = QueryEngine()
+        self.uploads = UploadStore()
+        self.ingestion = IngestionQueue(self.vector_store, self.document_processor, uploads=self.uploads)
+        self.summarizer = Summarizer(self.vector_store)
+        self.reindexer = Reindexer(
+            self.vector_store, self.document_processor, self.ingestion,
+            summarizer=self.summarizer if Config.SUMMARIES_ENABLED else None
+        )
         self.SUPPORTED_MIMES = [
             'application/pdf',
             'application/msword',
             'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
         ]
-        self.user_sessions: Dict[str, UserSession] = {}
+        self.sessions = SessionStore()
+        # Set in post_init; benchmarks run the bot without one
+        self.application: Optional[Application] = None
+        self.warm_up_task = None
+        self.register_metrics()
         logger.info("TelegramBot initialized successfully")
     
+    def register_metrics(self):
+        """Expose queue depth and cache hit rates, read from their stats at scrape time."""
+        metrics.register_callback(
+            "rag_ingestion_jobs", "Documents waiting for or in ingestion.",
+            lambda: {("queued",): self.ingestion.depth, ("active",): self.ingestion.active_jobs},
+            labels=["state"]
+        )
+        
+        def cache_requests():
+            answers = self.vector_store.answer_cache.stats()
+            embeddings = self.vector_store.embedding_cache.stats()
+            matrices = self.vector_store.matrix_cache.stats()
+            return {
+                ("answer", "exact_hit"): answers["exact_hits"],
+                ("answer", "semantic_hit"): answers["semantic_hits"],
+                ("answer", "miss"): answers["misses"],
+                ("embedding", "hit"): embeddings["hits"],
+                ("embedding", "miss"): embeddings["misses"],
+                ("matrix", "hit"): matrices["hits"],
+                ("matrix", "miss"): matrices["misses"]
+            }
+        
+        metrics.register_callback(
+            "rag_cache_requests_total", "Cache lookups by cache and result.",
+            cache_requests, kind="counter", labels=["cache", "result"]
+        )
+        metrics.register_callback(
+            "rag_reindexed_documents_total", "Documents re-indexed after a settings change, by result.",
+            lambda: {(result,): count for result, count in self.reindexer.counts.items()},
+            kind="counter", labels=["result"]
+        )
+        metrics.register_callback(
+            "rag_summarized_documents_total", "Documents whose section and document summaries were written, by result.",
+            lambda: {(result,): count for result, count in self.summarizer.counts.items()},
+            kind="counter", labels=["result"]
+        )
+        metrics.register_callback(
+            "rag_kept_uploads_bytes", "Bytes of original uploads kept for re-indexing, and in memory awaiting ingestion.",
+            lambda: {("kept",): self.uploads.total_bytes(), ("buffered",): self.ingestion.buffered},
+            labels=["state"]
+        )
+    
     def get_user_session(self, user_id: str) -> UserSession:
         """Get or create user session."""
-        if user_id not in self.user_sessions:
-            self.user_sessions[user_id] = UserSession()
-        return self.user_sessions[user_id]
+        with span("session"):
+            return self.sessions.get(user_id)
+    
+    def save_user_session(self, session: UserSession):
+        """Persist user session."""
+        with span("session"):
+            self.sessions.save(session)
     
     def get_mime_type(self, filename: str) -> str:
         """Get MIME type from filename."""
@@ -68,6 +172,26 @@ class TelegramBot:
                 f"📄 {doc.name}",
                 callback_data=f"select_doc_{doc.doc_id}"
             )])
+        if len(documents) > 1:
+            keyboard.append([
+                InlineKeyboardButton("📚 All documents", callback_data="select_all"),
+                InlineKeyboardButton("☑️ Choose several", callback_data="choose_docs")
+            ])
+        return InlineKeyboardMarkup(keyboard)
+    
+    def create_selection_keyboard(self, documents: List[Document], selected: List[str]) -> InlineKeyboardMarkup:
+        """Create inline keyboard for ticking several documents to chat with."""
+        keyboard = []
+        for doc in documents:
+            mark = "✅" if doc.doc_id in selected else "⬜"
+            keyboard.append([InlineKeyboardButton(
+                f"{mark} {doc.name}",
+                callback_data=f"toggle_doc_{doc.doc_id}"
+            )])
+        keyboard.append([InlineKeyboardButton(
+            f"💬 Chat with {len(selected)} selected",
+            callback_data="chat_selected"
+        )])
         return InlineKeyboardMarkup(keyboard)
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -79,8 +203,8 @@ class TelegramBot:
             "👋 Welcome to the PDF RAG Bot!\n\n"
             "You can:\n"
             "1. Send me PDF or Word documents (DOC/DOCX)\n"
-            "2. Select a document to chat about\n"
-            "3. Ask questions about the selected document\n\n"
+            "2. Select a document, several or all of them to chat about\n"
+            "3. Ask questions about the selected documents\n\n"
             "Available commands:\n"
             "/list - Show your documents\n"
             "/finish - End chat session\n"
@@ -117,11 +241,15 @@ class TelegramBot:
         user_id = str(query.from_user.id)
         doc_id = query.data.replace("select_doc_", "")
         
-        session = self.get_user_session(user_id)
-        session.active_document_id = doc_id
-        session.in_chat = True
-        
         document = self.vector_store.get_document(doc_id)
+        if document is None or document.user_id != user_id:
+            logger.warning(f"User {user_id} tried to select unavailable document {doc_id}")
+            await query.answer("❌ Document not found.")
+            return
+        
+        session = self.get_user_session(user_id)
+        session.start_chat(doc_id)
+        self.save_user_session(session)
         
         # Create custom keyboard with "Finish Chat" button
         keyboard = ReplyKeyboardMarkup([["✅ Finish Chat"]], resize_keyboard=True)
@@ -132,14 +260,87 @@ class TelegramBot:
             reply_markup=keyboard
         )
         await query.answer()
+        
+        # Warm the in-memory matrix so questions skip the filtered HNSW search
+        try:
+            await asyncio.to_thread(self.vector_store.load_document_matrix, user_id, doc_id)
+        except Exception as e:
+            logger.warning(f"Could not preload document {doc_id}: {str(e)}")
+    
+    async def handle_library_selection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle choosing several documents, or all of them, via inline keyboard."""
+        query = update.callback_query
+        user_id = str(query.from_user.id)
+        documents = self.vector_store.get_user_documents(user_id)
+        session = self.get_user_session(user_id)
+        
+        if query.data == "choose_docs":
+            session.selection = []
+            self.save_user_session(session)
+            await query.message.reply_text(
+                "Tick the documents to chat with:",
+                reply_markup=self.create_selection_keyboard(documents, session.selection)
+            )
+            await query.answer()
+            return
+        
+        if query.data.startswith("toggle_doc_"):
+            doc_id = query.data.replace("toggle_doc_", "")
+            if doc_id not in {doc.doc_id for doc in documents}:
+                logger.warning(f"User {user_id} tried to select unavailable document {doc_id}")
+                await query.answer("❌ Document not found.")
+                return
+            if doc_id in session.selection:
+                session.selection.remove(doc_id)
+            else:
+                session.selection.append(doc_id)
+            self.save_user_session(session)
+            await query.edit_message_reply_markup(
+                reply_markup=self.create_selection_keyboard(documents, session.selection)
+            )
+            await query.answer()
+            return
+        
+        if query.data == "chat_selected":
+            available = {doc.doc_id for doc in documents}
+            selected = [doc_id for doc_id in session.selection if doc_id in available]
+            if not selected:
+                await query.answer("Tick at least one document first.")
+                return
+            session.start_library_chat(selected)
+            names = [doc.name for doc in documents if doc.doc_id in selected]
+        else:
+            if not documents:
+                await query.answer("❌ No documents uploaded yet.")
+                return
+            session.start_library_chat()
+            selected = [doc.doc_id for doc in documents]
+            names = ["all your documents"]
+        self.save_user_session(session)
+        
+        keyboard = ReplyKeyboardMarkup([["✅ Finish Chat"]], resize_keyboard=True)
+        await query.message.reply_text(
+            "You are now chatting with: 📚 " + ", ".join(names) + "\n"
+            "Send your queries below or click 'Finish Chat' when done.",
+            reply_markup=keyboard
+        )
+        await query.answer()
+        
+        # Warm the in-memory matrices while they all fit in the cache
+        if len(selected) <= self.vector_store.matrix_cache.max_documents:
+            for doc_id in selected:
+                try:
+                    await asyncio.to_thread(self.vector_store.load_document_matrix, user_id, doc_id)
+                except Exception as e:
+                    logger.warning(f"Could not preload document {doc_id}: {str(e)}")
     
     async def finish_chat(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle finish chat request."""
         user_id = str(update.effective_user.id)
         session = self.get_user_session(user_id)
         
-        session.active_document_id = None
-        session.in_chat = False
+        session.start_chat(None)
+        self.save_user_session(session)
         
         documents = self.vector_store.get_user_documents(user_id)
         
@@ -156,6 +357,11 @@ class TelegramBot:
     
     async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle document uploads."""
+        with trace("upload", user=str(update.effective_user.id)):
+            await self.receive_document(update, context)
+    
+    async def receive_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Download an upload and queue it for ingestion, or reuse an identical indexed document."""
         user_id = str(update.effective_user.id)
         try:
             logger.info(f"Received document from user {user_id}")
@@ -174,29 +380,44 @@ class TelegramBot:
             # Download the file
             file_id = update.message.document.file_id
             document_id = str(uuid.uuid4())
-            file = await context.bot.get_file(file_id)
-            
-            # Create user directory if it doesn't exist
-            user_dir = os.path.join(Config.UPLOAD_DIR, user_id)
-            os.makedirs(user_dir, exist_ok=True)
-            
-            # Keep original extension
-            original_extension = os.path.splitext(file_name)[1]
-            file_path = os.path.join(user_dir, f"{document_id}{original_extension}")
-            await file.download_to_drive(file_path)
-            
-            logger.info(f"Downloaded document for user {user_id} to {file_path}")
+            with span("download"):
+                file = await context.bot.get_file(file_id)
+                data = bytes(await file.download_as_bytearray())
+            content_hash = hashlib.sha256(data).hexdigest()
+            fingerprint = index_fingerprint(content_hash)
             
-            # Process the document
-            await update.message.reply_text("📄 Processing your document...")
-            chunks = self.document_processor.process_document(file_path)
-            logger.info(f"Processed document into {len(chunks)} chunks")
-            
-            # Store in vector database
-            self.vector_store.add_chunks(chunks, user_id, document_id)
-            # Add document metadata
-            self.vector_store.add_document(document_id, file_name, user_id)
-            logger.info("Stored document in vector database")
+            # Identical bytes indexed with the same settings can reuse existing vectors
+            existing_id = await asyncio.to_thread(self.vector_store.find_indexed_document, fingerprint)
+            if existing_id:
+                await asyncio.to_thread(
+                    self.vector_store.add_document,
+                    document_id, file_name, user_id,
+                    content_hash=content_hash, vector_document_id=existing_id
+                )
+                logger.info(f"Document for user {user_id} matches indexed document {existing_id}, reusing vectors")
+            else:
+                logger.info(f"Downloaded document for user {user_id} ({len(data)} bytes)")
+                
+                # Parsing and embedding happen in the ingestion queue, off the event loop,
+                # from the downloaded bytes; the original is kept afterwards if retention allows
+                status_message = await update.message.reply_text("📄 Processing your document...")
+                job = IngestionJob(
+                    user_id, document_id, file_name, data,
+                    content_hash=content_hash,
+                    fingerprint=fingerprint,
+                    on_progress=status_message.edit_text,
+                    on_complete=lambda job: self.on_ingestion_complete(job, status_message),
+                    on_error=lambda job, error: status_message.edit_text(
+                        f"❌ Error processing document: {str(error)}"
+                    )
+                )
+                try:
+                    await self.ingestion.submit(job)
+                except IngestionBusyError as e:
+                    logger.warning(f"Rejected document from user {user_id}: {str(e)}")
+                    job.release()
+                    await status_message.edit_text(f"⏳ {str(e)}")
+                return
             
             # Get updated document list
             documents = self.vector_store.get_user_documents(user_id)
@@ -208,19 +429,60 @@ class TelegramBot:
             )
             
         except Exception as e:
+            set_outcome("error")
             logger.error(f"Error processing document for user {user_id}: {str(e)}")
             await update.message.reply_text(
                 f"❌ Error processing document: {str(e)}"
             )
     
+    async def on_ingestion_complete(self, job: IngestionJob, status_message):
+        """Replace the progress message once a queued document is indexed, and have it summarized."""
+        if Config.SUMMARIES_ENABLED:
+            self.summarizer.enqueue(job.document_id)
+        documents = self.vector_store.get_user_documents(job.user_id)
+        await status_message.edit_text(
+            f"✅ Document processed successfully! ({job.chunk_count} chunks)\n"
+            "Select a document to start chatting:",
+            reply_markup=self.create_document_keyboard(documents)
+        )
+    
+    async def on_resumed_ingestion_complete(self, job: IngestionJob):
+        """Tell a user that a document interrupted by a restart is indexed now, and have it summarized."""
+        if Config.SUMMARIES_ENABLED:
+            self.summarizer.enqueue(job.document_id)
+        await self.notify_user(
+            job.user_id,
+            f"✅ {job.file_name} was processed after a restart ({job.chunk_count} chunks). "
+            "Use /list to chat with it."
+        )
+    
+    async def on_resumed_ingestion_error(self, job: IngestionJob, error: Exception):
+        await self.notify_user(job.user_id, f"❌ Error processing {job.file_name}: {str(error)}")
+    
+    async def notify_user(self, user_id: str, text: str):
+        """Message a user outside of a reply, e.g. once work from before a restart is done."""
+        if self.application is None:
+            return
+        try:
+            # A private chat's id is its user's id
+            await self.application.bot.send_message(chat_id=int(user_id), text=text)
+        except Exception as e:
+            logger.warning(f"Could not notify user {user_id}: {str(e)}")
+    
     async def handle_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle user questions."""
+        with trace("query", user=str(update.effective_user.id)):
+            await self.answer_query(update, context)
+    
+    async def answer_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Answer a question about the user's active document, or documents."""
         user_id = str(update.effective_user.id)
         session = self.get_user_session(user_id)
         
         try:
             # Check if user is in chat session
-            if not session.in_chat or not session.active_document_id:
+            if not session.in_chat or not (session.active_document_id or session.in_library_chat):
+                set_outcome("no_document")
                 documents = self.vector_store.get_user_documents(user_id)
                 await update.message.reply_text(
                     "Please select a document to chat about:",
@@ -237,16 +499,59 @@ class TelegramBot:
             logger.info(f"Received query from user {user_id}: {query}")
             
             # Send "thinking" message
-            thinking_message = await update.message.reply_text(
-                "🤔 Generating response..."
-            )
+            with span("telegram"):
+                thinking_message = await update.message.reply_text(
+                    "🤔 Generating response..."
+                )
             
-            # Get relevant chunks from vector store for the active document
-            context_chunks = self.vector_store.query(
-                query, user_id, session.active_document_id
-            )
+            started = time.monotonic()
+            history = self.query_engine.history_messages(session)
+            if session.in_library_chat:
+                await self.answer_library_query(update, session, query, history, thinking_message, started)
+                return
+            
+            # Repeated questions on the same vectors are answered from the cache,
+            # except follow-ups, whose answer depends on the conversation so far
+            document = await asyncio.to_thread(self.vector_store.get_document, session.active_document_id)
+            if document is None or document.user_id != user_id:
+                raise PermissionError(f"Document {session.active_document_id} is not available to user {user_id}")
+            answer_cache = self.vector_store.answer_cache
+            cache_key = document.vector_document_id
+            query_embedding = None
+            with span("answer_cache"):
+                cached = None if history else answer_cache.lookup_exact(cache_key, query)
+            # Broad questions are answered from the document's precomputed summaries
+            context_chunks = None
+            if cached is None and Config.SUMMARIES_ENABLED and self.query_engine.is_broad(query):
+                context_chunks = await asyncio.to_thread(self.summary_context, query, document)
+            # Questions naming exact terms ("chapter 3" vs "chapter 4") embed too closely
+            # for the semantic tier, and may be answered from the lexical index alone
+            if cached is None and context_chunks is None and not exact_terms(query):
+                query_embedding = await self.vector_store.aget_embedding(query)
+                if not history:
+                    with span("answer_cache"):
+                        cached = answer_cache.lookup_semantic(cache_key, query_embedding)
+            if cached is not None:
+                set_outcome("cached")
+                await self.send_answer(update, thinking_message, cached)
+                await self.query_engine.remember(session, query, cached)
+                self.save_user_session(session)
+                logger.info(f"Answered from cache in {time.monotonic() - started:.2f}s: {answer_cache.stats()}")
+                return
+            
+            if context_chunks is not None:
+                set_outcome("summary")
+            else:
+                # Get candidate chunks for the active document and pack them into the prompt budget
+                candidates = await self.vector_store.asearch(
+                    query, user_id, session.active_document_id,
+                    n_results=Config.RETRIEVAL_CANDIDATES,
+                    query_embedding=query_embedding
+                )
+                context_chunks = self.query_engine.build_context(candidates)
             
             if not context_chunks:
+                set_outcome("no_context")
                 await thinking_message.delete()
                 logger.warning(f"No relevant chunks found for user {user_id}")
                 await update.message.reply_text(
@@ -254,19 +559,27 @@ class TelegramBot:
                 )
                 return
             
-            # Generate response
+            # Stream the response into the "thinking" message
             logger.info("Generating response with GPT")
-            response = self.query_engine.generate_response(query, context_chunks)
-            
-            # Delete thinking message and send response
-            await thinking_message.delete()
-            await update.message.reply_text(
-                response,
-                parse_mode='Markdown'
+            answer = await self.stream_to_message(
+                update, thinking_message,
+                self.query_engine.stream_response(query, context_chunks, history),
+                started
             )
+            if answer.strip():
+                if not history:
+                    with span("answer_cache"):
+                        answer_cache.store(
+                            cache_key, query, answer,
+                            query_embedding=query_embedding,
+                            latency=time.monotonic() - started
+                        )
+                await self.query_engine.remember(session, query, answer)
+                self.save_user_session(session)
             logger.info("Response sent successfully")
             
         except Exception as e:
+            set_outcome("error")
             logger.error(f"Error processing query for user {user_id}: {str(e)}")
             # Try to delete thinking message if it exists
             try:
@@ -277,6 +590,140 @@ class TelegramBot:
                 f"❌ Error processing query: {str(e)}"
             )
     
+    def summary_context(self, query: str, document: Document):
+        """Context from a document's section and document summaries for a broad question, if written."""
+        document_store = self.vector_store.document_store
+        with span("summaries"):
+            return self.query_engine.summary_context(
+                query,
+                document_store.get_sections(document.vector_document_id),
+                document_store.get_document_summary(document.vector_document_id)
+            )
+    
+    async def answer_library_query(
+        self,
+        update: Update,
+        session: UserSession,
+        query: str,
+        history: List[Dict[str, str]],
+        thinking_message,
+        started: float
+    ):
+        """Answer a question over several documents, searched in parallel.
+        
+        Answers aren't cached: they depend on which documents are chosen and,
+        for all documents, on uploads since.
+        """
+        user_id = session.user_id
+        if session.all_documents:
+            documents = await asyncio.to_thread(self.vector_store.get_user_documents, user_id)
+            document_ids = [doc.doc_id for doc in documents]
+        else:
+            document_ids = session.document_ids
+        
+        context_chunks = None
+        if Config.SUMMARIES_ENABLED and self.query_engine.is_broad(query):
+            context_chunks = await asyncio.to_thread(self.library_summary_context, query, user_id, document_ids)
+        if context_chunks is not None:
+            set_outcome("summary")
+        else:
+            candidates = await self.vector_store.asearch_documents(
+                query, user_id, document_ids,
+                n_results=Config.LIBRARY_RETRIEVAL_CANDIDATES
+            )
+            context_chunks = self.query_engine.build_context(candidates, Config.LIBRARY_CONTEXT_MAX_TOKENS)
+        
+        if not context_chunks:
+            set_outcome("no_context")
+            await thinking_message.delete()
+            logger.warning(f"No relevant chunks found in {len(document_ids)} documents for user {user_id}")
+            await update.message.reply_text(
+                "❌ No relevant information found in the selected documents."
+            )
+            return
+        
+        logger.info(f"Generating response with GPT from {len(document_ids)} documents")
+        answer = await self.stream_to_message(
+            update, thinking_message,
+            self.query_engine.stream_response(query, context_chunks, history),
+            started
+        )
+        if answer.strip():
+            await self.query_engine.remember(session, query, answer)
+            self.save_user_session(session)
+        logger.info("Response sent successfully")
+    
+    def library_summary_context(self, query: str, user_id: str, document_ids: List[str]):
+        """Context from the summaries of several documents for a broad question, if all are written."""
+        document_store = self.vector_store.document_store
+        with span("summaries"):
+            summaries = {}
+            for document_id in document_ids:
+                document = self.vector_store.get_document(document_id)
+                if document is None or document.user_id != user_id:
+                    continue
+                summaries.setdefault(
+                    document.vector_document_id,
+                    (document.name, document_store.get_document_summary(document.vector_document_id))
+                )
+            context = self.query_engine.library_summary_context(query, list(summaries.values()))
+            if context is None:
+                return None
+            # Too many documents to answer from their summaries at once
+            tokens = sum(len(self.query_engine.tokenizer.encode(text)) for text in context)
+            return context if tokens <= Config.LIBRARY_CONTEXT_MAX_TOKENS else None
+    
+    async def stream_to_message(self, update: Update, message, deltas: AsyncIterator[str], started: float) -> str:
+        """Show a streamed answer by editing message, throttled to Telegram's edit limits."""
+        text = ""
+        shown = ""
+        first_token_at = None
+        last_edit = 0.0
+        
+        async for delta in deltas:
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            text += delta
+            now = time.monotonic()
+            if now - last_edit >= Config.STREAM_EDIT_INTERVAL:
+                preview = text[:MAX_MESSAGE_LENGTH]
+                if preview.strip() and preview != shown:
+                    try:
+                        with span("telegram"):
+                            await message.edit_text(preview)
+                        shown = preview
+                    except Exception as e:
+                        logger.debug(f"Skipped streaming edit: {str(e)}")
+                last_edit = now
+        
+        await self.send_answer(update, message, text, shown)
+        
+        finished = time.monotonic()
+        ttft = (first_token_at or finished) - started
+        logger.info(f"Query answered: first token {ttft:.2f}s, total {finished - started:.2f}s")
+        return text
+    
+    async def send_answer(self, update: Update, message, text: str, shown: str = ""):
+        """Render a final answer into message with Markdown, splitting answers longer than one message."""
+        if not text.strip():
+            text = "❌ No response generated."
+        
+        with span("telegram"):
+            parts = [text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)]
+            for i, part in enumerate(parts):
+                try:
+                    if i == 0:
+                        await message.edit_text(part, parse_mode='Markdown')
+                    else:
+                        await update.message.reply_text(part, parse_mode='Markdown')
+                except BadRequest:
+                    # Partial or invalid Markdown; fall back to plain text
+                    if i == 0:
+                        if part != shown:
+                            await message.edit_text(part)
+                    else:
+                        await update.message.reply_text(part)
+    
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show available commands."""
         help_text = (
@@ -287,8 +734,8 @@ class TelegramBot:
             "/help - Show this help message\n\n"
             "You can also:\n"
             "• Send PDF or DOC/DOCX files to process\n"
-            "• Use buttons to select documents\n"
-            "• Ask questions about selected document"
+            "• Use buttons to select a document, several or all of them\n"
+            "• Ask questions about the selected documents"
         )
         await update.message.reply_text(help_text)
 
@@ -296,19 +743,77 @@ class TelegramBot:
         """Command version of finish chat."""
         await self.finish_chat(update, context)
 
-    def run(self):
-        """Run the bot."""
-        logger.info("Starting the bot")
-        app = Application.builder().token(Config.TELEGRAM_TOKEN).build()
+    async def post_init(self, app: Application):
+        """Start background workers once the event loop is running."""
+        self.application = app
+        await self.ingestion.start(
+            on_complete=self.on_resumed_ingestion_complete,
+            on_error=self.on_resumed_ingestion_error
+        )
+        if Config.SUMMARIES_ENABLED:
+            await self.summarizer.start()
+        if Config.REINDEX_ON_STARTUP:
+            await self.reindexer.start()
+        if Config.METRICS_PORT:
+            metrics.start_metrics_server(Config.METRICS_PORT)
+        if Config.WARM_UP:
+            # Updates are handled meanwhile; whatever is still loading loads on first use
+            self.warm_up_task = asyncio.create_task(asyncio.to_thread(self.warm_up))
+    
+    def warm_up(self):
+        """Load libraries and open stores that the first upload or question would otherwise wait for."""
+        started = time.monotonic()
+        try:
+            self.document_processor.warm_up()
+            self.vector_store.warm_up()
+            self.query_engine.warm_up()
+            logger.info(f"Warmed up in {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            logger.warning(f"Warm-up failed, loading on first use instead: {str(e)}")
+    
+    async def post_shutdown(self, app: Application):
+        """Stop background workers."""
+        await self.reindexer.stop()
+        await self.summarizer.stop()
+        await self.ingestion.stop()
+    
+    def build_application(self, updater: bool = True) -> Application:
+        """Build the Telegram application with all handlers registered.
+        
+        Without an updater the application only handles updates passed to
+        process_update, as webhook workers do.
+        """
+        builder = (
+            Application.builder()
+            .token(Config.TELEGRAM_TOKEN)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .concurrent_updates(UserOrderedUpdateProcessor(Config.WORKER_CONCURRENCY))
+        )
+        if Config.TELEGRAM_BASE_URL:
+            base_url = Config.TELEGRAM_BASE_URL.rstrip("/")
+            builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+        if not updater:
+            builder = builder.updater(None)
+        app = builder.build()
         
         # Add handlers
         app.add_handler(CommandHandler("start", self.start))
         app.add_handler(CommandHandler("help", self.help))
         app.add_handler(CommandHandler("list", self.list_documents))  # Shorter alias for list_documents
         app.add_handler(CommandHandler("finish", self.finish_chat_command))
+        app.add_handler(CallbackQueryHandler(
+            self.handle_library_selection, pattern=r"^(select_all|choose_docs|toggle_doc_|chat_selected)"
+        ))
         app.add_handler(CallbackQueryHandler(self.handle_document_selection))
         app.add_handler(MessageHandler(filters.Document.ALL, self.handle_document))
         app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_query))
+        return app
+    
+    def run(self):
+        """Run the bot, polling Telegram for updates."""
+        logger.info("Starting the bot")
+        app = self.build_application()
         
         # Start the bot
         logger.info("Bot is running...")
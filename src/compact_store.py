@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from config.config import Config
+from .partitioning import DocumentPartition, model_collection_name
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATIONS = {"float16": np.float16, "int8": np.int8}
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def quantize(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Compress float32 vectors; int8 also returns one scale per vector."""
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    if quantization == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown vector quantization: {quantization}")
+
+class CompactVectorStore:
+    """Quantized vectors in flat memory-mapped files, one directory per document.
+    
+    Vectors are normalized and appended to vectors.<quantization> (plus one
+    scale per vector for int8), and searched with blockwise dot products so
+    only a block at a time is expanded to float32. With rerank, a float32 copy
+    is kept in full.f32 and only the rows of the best candidates are read from
+    it to re-score them exactly. Chunk texts live in a SQLite table.
+    """
+    
+    BLOCK_ROWS = 8192
+    
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        quantization: Optional[str] = None,
+        rerank: Optional[bool] = None,
+        rerank_factor: Optional[int] = None,
+        model: Optional[str] = None
+    ):
+        self.root = root or Config.COMPACT_STORE_DIR
+        self.quantization = quantization or Config.COMPACT_QUANTIZATION
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown vector quantization: {self.quantization}")
+        self.rerank = Config.COMPACT_RERANK if rerank is None else rerank
+        self.rerank_factor = rerank_factor or Config.COMPACT_RERANK_FACTOR
+        self.model = model or Config.EMBEDDING_MODEL
+        self._naming = DocumentPartition()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    os.makedirs(self.root, exist_ok=True)
+                    conn = sqlite3.connect(os.path.join(self.root, "chunks.sqlite3"), check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS chunks ("
+                        " document_id TEXT NOT NULL,"
+                        " position INTEGER NOT NULL,"
+                        " text TEXT NOT NULL,"
+                        " PRIMARY KEY (document_id, position)) WITHOUT ROWID"
+                    )
+                    conn.commit()
+                    self._conn = conn
+        return self._conn
+    
+    def _document_dir(self, document_id: str) -> str:
+        name = self._naming.collection_name("", document_id)
+        return os.path.join(self.root, model_collection_name(name, self.model))
+    
+    def _path(self, document_id: str, name: str) -> str:
+        return os.path.join(self._document_dir(document_id), name)
+    
+    def _read_meta(self, document_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(document_id, "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def _rows(self, document_id: str, meta: Dict) -> int:
+        dtype = np.dtype(QUANTIZATIONS[meta["quantization"]])
+        try:
+            size = os.path.getsize(self._path(document_id, f"vectors.{meta['quantization']}"))
+        except FileNotFoundError:
+            return 0
+        return size // (dtype.itemsize * meta["dimensions"])
+    
+    def add(self, document_id: str, offset: int, embeddings: Sequence[Sequence[float]], chunks: Sequence[str]):
+        """Append the vectors and texts of chunks stored at positions offset, offset + 1, ..."""
+        vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            meta = self._read_meta(document_id)
+            if meta is None:
+                os.makedirs(self._document_dir(document_id), exist_ok=True)
+                meta = {
+                    "model": self.model,
+                    "dimensions": int(vectors.shape[1]),
+                    "quantization": self.quantization,
+                    "rerank": self.rerank
+                }
+                with open(self._path(document_id, "meta.json"), "w") as f:
+                    json.dump(meta, f)
+                rows = 0
+            elif meta["dimensions"] != vectors.shape[1]:
+                raise ValueError(
+                    f"Document {document_id} holds {meta['dimensions']}-dimensional vectors, got {vectors.shape[1]}"
+                )
+            else:
+                rows = self._rows(document_id, meta)
+            if offset != rows:
+                raise ValueError(f"Chunks for document {document_id} must be added in order: expected {rows}, got {offset}")
+            
+            # The quantized file goes last: its size is how many rows readers see
+            quantized, scales = quantize(vectors, meta["quantization"])
+            if scales is not None:
+                with open(self._path(document_id, "scales.f32"), "ab") as f:
+                    f.write(scales.tobytes())
+            if meta["rerank"]:
+                with open(self._path(document_id, "full.f32"), "ab") as f:
+                    f.write(vectors.tobytes())
+            with open(self._path(document_id, f"vectors.{meta['quantization']}"), "ab") as f:
+                f.write(quantized.tobytes())
+            
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks (document_id, position, text) VALUES (?, ?, ?)",
+                [(document_id, offset + i, text) for i, text in enumerate(chunks)]
+            )
+            self.conn.commit()
+    
+    def count(self, document_id: str) -> int:
+        """Rows stored for a document; the next add must start at this position."""
+        with self._lock:
+            meta = self._read_meta(document_id)
+            return self._rows(document_id, meta) if meta is not None else 0
+    
+    def delete(self, document_id: str):
+        with self._lock:
+            shutil.rmtree(self._document_dir(document_id), ignore_errors=True)
+            self.conn.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+            self.conn.commit()
+    
+    def _memmap(self, document_id: str, name: str, dtype, rows: int, columns: Optional[int] = None) -> np.memmap:
+        shape = (rows, columns) if columns else (rows,)
+        return np.memmap(self._path(document_id, name), dtype=dtype, mode="r", shape=shape)
+    
+    def query(self, document_id: str, embedding: Sequence[float], n_results: int) -> List[Tuple[int, str, float]]:
+        """Closest chunks to embedding as (position, text, cosine distance), best first."""
+        meta = self._read_meta(document_id)
+        if meta is None:
+            return []
+        rows = self._rows(document_id, meta)
+        if not rows:
+            return []
+        dimensions = meta["dimensions"]
+        query = normalize(np.asarray(embedding, dtype=np.float32))
+        if query.shape[0] != dimensions:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, document {document_id} has {dimensions}")
+        
+        vectors = self._memmap(document_id, f"vectors.{meta['quantization']}", QUANTIZATIONS[meta["quantization"]], rows, dimensions)
+        scales = self._memmap(document_id, "scales.f32", np.float32, rows) if meta["quantization"] == "int8" else None
+        scores = np.empty(rows, dtype=np.float32)
+        for start in range(0, rows, self.BLOCK_ROWS):
+            block = vectors[start:start + self.BLOCK_ROWS].astype(np.float32) @ query
+            if scales is not None:
+                block *= scales[start:start + self.BLOCK_ROWS]
+            scores[start:start + len(block)] = block
+        
+        rerank = meta["rerank"] and self.rerank
+        n_candidates = min(rows, n_results * self.rerank_factor if rerank else n_results)
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        if rerank:
+            full = self._memmap(document_id, "full.f32", np.float32, rows, dimensions)
+            ordered = np.sort(candidates)
+            scores[ordered] = full[ordered] @ query
+        best = candidates[np.argsort(-scores[candidates])][:n_results]
+        
+        texts = self.get(document_id, [int(position) for position in best])
+        return [
+            (int(position), texts[int(position)], float(1 - scores[position]))
+            for position in best if int(position) in texts
+        ]
+    
+    def get(self, document_id: str, positions: Sequence[int]) -> Dict[int, str]:
+        """Chunk texts of a document by position."""
+        if not positions:
+            return {}
+        placeholders = ", ".join("?" for _ in positions)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT position, text FROM chunks WHERE document_id = ? AND position IN ({placeholders})",
+                (document_id, *positions)
+            ).fetchall()
+        return dict(rows)
+    
+    def stats(self) -> Dict[str, int]:
+        """Documents, vectors and bytes on disk, by file kind."""
+        stats = {"documents": 0, "vectors": 0, "vector_bytes": 0, "full_precision_bytes": 0, "text_bytes": 0}
+        if not os.path.isdir(self.root):
+            return stats
+        for entry in os.scandir(self.root):
+            if entry.is_file():
+                stats["text_bytes"] += entry.stat().st_size
+                continue
+            try:
+                with open(os.path.join(entry.path, "meta.json")) as f:
+                    meta = json.load(f)
+            except FileNotFoundError:
+                continue
+            stats["documents"] += 1
+            for item in os.scandir(entry.path):
+                if item.name == "full.f32":
+                    stats["full_precision_bytes"] += item.stat().st_size
+                elif item.name.startswith(("vectors.", "scales.")):
+                    stats["vector_bytes"] += item.stat().st_size
+            dtype = np.dtype(QUANTIZATIONS[meta["quantization"]])
+            vector_file = os.path.join(entry.path, f"vectors.{meta['quantization']}")
+            if os.path.exists(vector_file):
+                stats["vectors"] += os.path.getsize(vector_file) // (dtype.itemsize * meta["dimensions"])
+        return stats
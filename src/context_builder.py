@@ -0,0 +1,147 @@
+import logging
+import re
+from typing import List, Optional, Set
+from config.config import Config
+from .tokenizer import get_tokenizer
+from .vector_store import RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+")
+
+class Passage:
+    """A run of consecutive chunks from one document, merged into a single text."""
+    
+    def __init__(self, chunk: RetrievedChunk, rank: int):
+        self.text = chunk.text
+        self.document_id = chunk.document_id
+        self.source = chunk.source
+        self.start = chunk.position
+        self.end = chunk.position
+        self.rank = rank
+    
+    def extend(self, chunk: RetrievedChunk, rank: int):
+        self.text = merge_overlapping(self.text, chunk.text)
+        self.end = chunk.position
+        self.rank = min(self.rank, rank)
+
+def merge_overlapping(first: str, second: str, max_overlap_chars: int = 4000) -> str:
+    """Join two consecutive chunks, keeping the text they share only once.
+    
+    Chunks carry trailing segments of the previous chunk as overlap, so the
+    start of second normally repeats the end of first verbatim.
+    """
+    probe = second[:16]
+    pos = first.find(probe, max(0, len(first) - max_overlap_chars)) if probe else -1
+    while pos != -1:
+        if second.startswith(first[pos:]):
+            return first + second[len(first) - pos:]
+        pos = first.find(probe, pos + 1)
+    return f"{first}\n\n{second}"
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class ContextBuilder:
+    """Turn retrieved candidates into the context that goes into the prompt.
+    
+    Candidates arrive best first. Those much further from the query than
+    the closest vector hit are dropped, consecutive chunks are merged so
+    their overlap is sent once, passages that repeat each other are removed,
+    and the best passages are packed into a token budget. The result is in
+    document order; passages from several documents are grouped by document
+    and labelled with its name.
+    """
+    
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        distance_margin: Optional[float] = None,
+        duplicate_threshold: Optional[float] = None
+    ):
+        self.max_tokens = max_tokens or Config.CONTEXT_MAX_TOKENS
+        self.distance_margin = Config.RETRIEVAL_DISTANCE_MARGIN if distance_margin is None else distance_margin
+        self.duplicate_threshold = duplicate_threshold or Config.CONTEXT_DUPLICATE_THRESHOLD
+    
+    @property
+    def tokenizer(self):
+        return get_tokenizer()
+    
+    def merge(self, chunks: List[RetrievedChunk]) -> List[Passage]:
+        """Merge chunks at consecutive positions of the same document into passages."""
+        passages: List[Passage] = []
+        ranked = list(enumerate(chunks))
+        positioned = sorted(
+            ((rank, c) for rank, c in ranked if c.position is not None),
+            key=lambda item: (item[1].document_id or "", item[1].position)
+        )
+        for rank, chunk in positioned:
+            if (
+                passages
+                and passages[-1].document_id == chunk.document_id
+                and chunk.position <= passages[-1].end + 1
+            ):
+                if chunk.position == passages[-1].end + 1:
+                    passages[-1].extend(chunk, rank)
+                continue
+            passages.append(Passage(chunk, rank))
+        passages.extend(Passage(c, rank) for rank, c in ranked if c.position is None)
+        return passages
+    
+    def deduplicate(self, passages: List[Passage]) -> List[Passage]:
+        """Drop passages that mostly repeat a better one, e.g. a repeated header or page."""
+        kept: List[Passage] = []
+        kept_shingles: List[Set[str]] = []
+        for passage in sorted(passages, key=lambda p: p.rank):
+            passage_shingles = shingles(passage.text)
+            if any(jaccard(passage_shingles, other) >= self.duplicate_threshold for other in kept_shingles):
+                continue
+            kept.append(passage)
+            kept_shingles.append(passage_shingles)
+        return kept
+    
+    def build(self, chunks: List[RetrievedChunk], max_tokens: Optional[int] = None) -> List[str]:
+        """Select, merge and pack candidate chunks into context texts, within max_tokens if given."""
+        if not chunks:
+            return []
+        max_tokens = max_tokens or self.max_tokens
+        
+        distances = [chunk.distance for chunk in chunks if chunk.distance is not None]
+        best = min(distances) if distances else 0.0
+        # Lexical-only hits have no distance and are kept
+        relevant = [
+            chunk for chunk in chunks
+            if chunk.distance is None or chunk.distance <= best + self.distance_margin
+        ]
+        passages = self.deduplicate(self.merge(relevant))
+        
+        packed: List[Passage] = []
+        used = 0
+        for passage in passages:
+            tokens = self.tokenizer.encode(passage.text)
+            if used + len(tokens) > max_tokens:
+                if packed:
+                    # Smaller passages further down may still fit
+                    continue
+                passage.text = self.tokenizer.decode(tokens[:max_tokens])
+                tokens = tokens[:max_tokens]
+            packed.append(passage)
+            used += len(tokens)
+        
+        logger.info(
+            f"Packed {len(packed)} passages from {len(chunks)} candidates "
+            f"({len(relevant)} relevant) into {used} tokens"
+        )
+        packed.sort(key=lambda p: (p.document_id or "", p.start is None, p.start or 0))
+        if len({passage.document_id for passage in packed}) > 1:
+            # Let the answer say which document each part comes from
+            return [f"[{passage.source}]\n{passage.text}" for passage in packed]
+        return [passage.text for passage in packed]
@@ -1,89 +1,407 @@
-import fitz  # PyMuPDF
-from markdownify import markdownify
+import io
 import os
-from typing import List
-import tiktoken
+import re
+import tempfile
+from collections import Counter, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple, Union
+import multiprocessing
 from config.config import Config
-import docx2txt
 import logging
 import mimetypes
-from tqdm import tqdm  # For progress tracking
+from .metrics import span, timed
+from .tokenizer import get_tokenizer
 
 logger = logging.getLogger(__name__)
 
+# A file's path, or its contents already in memory
+DocumentSource = Union[str, bytes]
+
+BULLET_RE = re.compile(r"^\s*[•◦▪▫●○■□‣⁃∙·\-–*]\s+")
+NUMBERED_RE = re.compile(r"^\s*(\d{1,3}|[a-zA-Z])[.)]\s+")
+BOLD_FLAG = 2 ** 4
+# A heading line, sentence, list item or paragraph, with its trailing whitespace
+SEGMENT_RE = re.compile(
+    r"(?:#[^\n]*|\S.*?(?:[.!?](?=\s)|\n(?=[ \t]*\n)|\n(?=[ \t]*(?:#|[-*] |\d+[.)] ))|$))\s*",
+    re.S
+)
+
+def estimate_body_size(doc, sample_pages: int = 20) -> float:
+    """Most common font size (weighted by characters) over a sample of pages."""
+    if len(doc) == 0:
+        return 11.0
+    step = max(1, len(doc) // sample_pages)
+    sizes = Counter()
+    for i in range(0, len(doc), step):
+        for block in doc[i].get_text("dict")["blocks"]:
+            for line in block.get("lines", []):
+                for text_span in line["spans"]:
+                    sizes[round(text_span["size"], 1)] += len(text_span["text"].strip())
+    return sizes.most_common(1)[0][0] if sizes else 11.0
+
+def heading_level(size: float, body_size: float) -> int:
+    """Map a font size to a markdown heading level, 0 for body text."""
+    ratio = size / body_size if body_size else 1.0
+    if ratio >= 1.6:
+        return 1
+    if ratio >= 1.3:
+        return 2
+    if ratio >= 1.15:
+        return 3
+    return 0
+
+def table_to_markdown(rows: List[List[Optional[str]]]) -> str:
+    """Render extracted table rows as a markdown table."""
+    rows = [
+        [(cell or "").replace("\n", " ").replace("|", "\\|").strip() for cell in row]
+        for row in rows if row
+    ]
+    if not rows:
+        return ""
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    lines = ["| " + " | ".join(rows[0]) + " |", "| " + " | ".join(["---"] * width) + " |"]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows[1:])
+    return "\n".join(lines)
+
+def block_to_markdown(block: dict, body_size: float) -> str:
+    """Render one PyMuPDF text block as a heading, list or paragraph."""
+    lines = []
+    for line in block.get("lines", []):
+        text = "".join(text_span["text"] for text_span in line["spans"]).strip()
+        if not text:
+            continue
+        size = max(text_span["size"] for text_span in line["spans"])
+        bold = all(text_span["flags"] & BOLD_FLAG for text_span in line["spans"] if text_span["text"].strip())
+        lines.append((text, size, bold))
+    if not lines:
+        return ""
+    
+    block_text = " ".join(text for text, _, _ in lines)
+    level = heading_level(max(size for _, size, _ in lines), body_size)
+    if level and len(block_text) <= 200:
+        return f"{'#' * level} {block_text}"
+    if len(lines) == 1 and lines[0][2] and len(block_text) <= 80:
+        return f"#### {block_text}"
+    
+    parts: List[str] = []
+    paragraph = ""
+    for text, _, _ in lines:
+        if BULLET_RE.match(text) or NUMBERED_RE.match(text):
+            if paragraph:
+                parts.append(paragraph)
+            match = NUMBERED_RE.match(text)
+            paragraph = text if match else "- " + BULLET_RE.sub("", text, count=1)
+        elif paragraph.endswith("-") and not paragraph.endswith(" -"):
+            # Re-join words hyphenated across a line break
+            paragraph = paragraph[:-1] + text
+        else:
+            paragraph = f"{paragraph} {text}" if paragraph else text
+    if paragraph:
+        parts.append(paragraph)
+    return "\n".join(parts)
+
+def page_to_markdown(page, body_size: float) -> str:
+    """Convert a page to markdown from its block structure, with tables inlined."""
+    import fitz  # PyMuPDF
+    
+    tables = []
+    try:
+        # Table detection is by far the most expensive step and needs ruling
+        # lines to work from, so skip it on pages without vector drawings
+        if page.get_cdrawings():
+            tables = page.find_tables().tables
+    except Exception as e:
+        logger.debug(f"Table detection failed on page {page.number}: {str(e)}")
+    table_rects = [fitz.Rect(table.bbox) for table in tables]
+    
+    items = []
+    for block in page.get_text("dict")["blocks"]:
+        if block["type"] != 0:
+            continue
+        rect = fitz.Rect(block["bbox"])
+        center = fitz.Point((rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2)
+        if any(center in table_rect for table_rect in table_rects):
+            continue
+        markdown = block_to_markdown(block, body_size)
+        if markdown:
+            items.append((rect.y0, markdown))
+    
+    # Keep PyMuPDF's reading order and slot each table in before the first block below it
+    for table in sorted(tables, key=lambda t: t.bbox[1]):
+        markdown = table_to_markdown(table.extract())
+        if not markdown:
+            continue
+        position = next((i for i, (y0, _) in enumerate(items) if y0 >= table.bbox[1]), len(items))
+        items.insert(position, (table.bbox[1], markdown))
+    
+    return "\n\n".join(markdown for _, markdown in items)
+
+def open_pdf(source: DocumentSource):
+    """Open a PDF from its path or from its bytes, without writing them to disk."""
+    import fitz
+    
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+def spool(data: bytes, suffix: str = "") -> str:
+    """Write bytes to a temporary file in SPOOL_DIR (memory-backed where available); the caller removes it."""
+    os.makedirs(Config.SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=Config.SPOOL_DIR)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+def extract_pdf_pages(
+    source: DocumentSource,
+    start: int = 0,
+    end: Optional[int] = None,
+    body_size: Optional[float] = None
+) -> List[str]:
+    """Process pool entry point: convert pages [start, end) to markdown, all pages by default.
+    
+    The body text size is estimated from the document unless given.
+    """
+    with open_pdf(source) as doc:
+        if body_size is None:
+            body_size = estimate_body_size(doc)
+        end = len(doc) if end is None else end
+        return [page_to_markdown(doc[i], body_size) for i in range(start, end)]
+
+def pdf_body_size(pdf_path: str) -> float:
+    """Process pool entry point: the body text size of a PDF about to be split across tasks."""
+    with open_pdf(pdf_path) as doc:
+        return estimate_body_size(doc)
+
+def docx_to_text(source: DocumentSource) -> str:
+    """Process pool entry point: extract raw text from a DOC/DOCX file or its bytes."""
+    import docx2txt
+    
+    # DOCX files are zip archives, which zipfile reads from memory as well
+    return docx2txt.process(source if isinstance(source, str) else io.BytesIO(source))
+
+def docx_to_markdown(source: DocumentSource) -> str:
+    """Process pool entry point: extract a DOC/DOCX file's text and convert it to markdown."""
+    from markdownify import markdownify
+    
+    return markdownify(docx_to_text(source), heading_style="ATX")
+
 class DocumentProcessor:
-    def __init__(self):
-        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+    # Parsers and the tokenizer are imported on first use, keeping them off the bot's startup path
+    
+    @property
+    def tokenizer(self):
+        return get_tokenizer()
+    
+    def warm_up(self):
+        """Import the parsers and load the tokenizer ahead of the first upload."""
+        import docx2txt, fitz, markdownify, tqdm  # noqa: F401
+        get_tokenizer()
     
     def get_file_type(self, file_path: str) -> str:
         """Get MIME type from file path."""
         return mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
     
-    def pdf_to_markdown(self, pdf_path: str) -> str:
-        """Convert PDF to markdown format."""
-        doc = fitz.open(pdf_path)
-        text = ""
+    def iter_pdf_pages(self, source: DocumentSource, executor: Optional[Executor] = None) -> Iterator[str]:
+        """Yield each PDF page as markdown, in order, splitting large documents across processes.
+        
+        Headings come from font sizes relative to the body text, and lists and
+        tables are rendered from PyMuPDF's block structure. Given an executor,
+        all parsing happens in it: documents under PDF_PARALLEL_MIN_PAGES as
+        one task, larger ones in page ranges of which at most a few are in
+        flight at once, so memory stays bounded on huge files. A PDF in memory
+        is sent as is, unless it is large enough to split: worker processes
+        then open it from a spooled copy in SPOOL_DIR.
+        """
+        from tqdm import tqdm  # For progress tracking
+        
+        with open_pdf(source) as doc:
+            page_count = len(doc)
+            if executor is None and (page_count < Config.PDF_PARALLEL_MIN_PAGES or Config.PDF_WORKERS <= 1):
+                # No pool to hand the pages to: parse them here
+                body_size = estimate_body_size(doc)
+                for page in tqdm(doc, desc="Processing PDF pages"):
+                    yield page_to_markdown(page, body_size)
+                return
+        
+        if page_count < Config.PDF_PARALLEL_MIN_PAGES:
+            yield from executor.submit(extract_pdf_pages, source).result()
+            return
         
-        # Add progress bar for large documents
-        for page in tqdm(doc, desc="Processing PDF pages"):
-            text += page.get_text()
+        step = Config.PDF_PAGES_PER_TASK
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        logger.info(f"Extracting {page_count} PDF pages in {len(ranges)} parallel tasks")
         
-        # Convert to markdown
-        markdown_text = markdownify(text, heading_style="ATX")
-        return markdown_text
+        # Sending the whole file with every task would copy it once per page range
+        pdf_path = source if isinstance(source, str) else spool(source, ".pdf")
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(
+                max_workers=min(Config.PDF_WORKERS, len(ranges)),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        in_flight = deque()
+        try:
+            body_size = executor.submit(pdf_body_size, pdf_path).result()
+            for start, end in ranges:
+                in_flight.append(executor.submit(extract_pdf_pages, pdf_path, start, end, body_size))
+                if len(in_flight) >= 2 * Config.PDF_WORKERS:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
+            if pdf_path is not source:
+                # Tasks still running keep the file open until they finish
+                os.remove(pdf_path)
+    
+    def pdf_to_markdown(self, source: DocumentSource, executor: Optional[Executor] = None) -> str:
+        """Convert PDF to markdown format."""
+        # Join once at the end instead of growing a string page by page
+        with span("extract"):
+            return "\n\n".join(page for page in self.iter_pdf_pages(source, executor) if page)
     
-    def doc_to_markdown(self, doc_path: str) -> str:
+    def doc_to_markdown(self, source: DocumentSource, executor: Optional[Executor] = None) -> str:
         """Convert DOC/DOCX to markdown format."""
         try:
-            # Extract text from the document
-            text = docx2txt.process(doc_path)
-            
-            # Convert to markdown
-            markdown_text = markdownify(text, heading_style="ATX")
-            return markdown_text
+            # Extraction and conversion both run in the executor, if given
+            if executor is not None:
+                return executor.submit(docx_to_markdown, source).result()
+            return docx_to_markdown(source)
         except Exception as e:
             logger.error(f"Error converting doc to markdown: {str(e)}")
             raise
     
-    def file_to_markdown(self, file_path: str) -> str:
-        """Convert any supported file to markdown format."""
-        mime_type = self.get_file_type(file_path)
+    def iter_document_text(
+        self,
+        source: DocumentSource,
+        executor: Optional[Executor] = None,
+        file_name: Optional[str] = None
+    ) -> Iterator[str]:
+        """Yield a supported file's markdown incrementally (page by page for PDFs).
+        
+        source is a path, or the file's bytes with file_name giving its type.
+        """
+        mime_type = self.get_file_type(file_name or source)
         
         if mime_type == 'application/pdf':
-            return self.pdf_to_markdown(file_path)
+            yield from self.iter_pdf_pages(source, executor)
         elif mime_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-            return self.doc_to_markdown(file_path)
+            yield self.doc_to_markdown(source, executor)
         else:
             raise ValueError(f"Unsupported MIME type: {mime_type}")
     
-    def chunk_text(self, text: str) -> List[str]:
-        """Split text into chunks of specified token size with overlap."""
-        tokens = self.tokenizer.encode(text)
-        chunks = []
+    def file_to_markdown(
+        self,
+        source: DocumentSource,
+        executor: Optional[Executor] = None,
+        file_name: Optional[str] = None
+    ) -> str:
+        """Convert any supported file to markdown format."""
+        return "\n\n".join(text for text in self.iter_document_text(source, executor, file_name) if text)
+    
+    def _split_long_segment(self, tokens: List[int]) -> Iterator[List[int]]:
+        """Hard-split a segment that is longer than a chunk on its own."""
+        step = Config.CHUNK_SIZE - Config.CHUNK_OVERLAP
+        for i in range(0, len(tokens), step):
+            yield tokens[i:i + Config.CHUNK_SIZE]
+            if i + Config.CHUNK_SIZE >= len(tokens):
+                break
+    
+    def iter_chunks(self, pieces: Iterable[str], respect_headings: bool = True) -> Iterator[str]:
+        """Chunk text arriving piece by piece (pages, sections) into overlapping windows.
+        
+        Text is split into sentences, paragraphs and headings, and chunks are
+        built from whole segments up to CHUNK_SIZE tokens, carrying roughly
+        CHUNK_OVERLAP tokens of trailing segments into the next chunk. With
+        respect_headings, a heading starts a new chunk once the current one is
+        at least half full. Only the current window is ever held in memory.
+        """
+        window: Deque[Tuple[str, int]] = deque()
+        window_tokens = 0
+        # Whether the window holds anything beyond overlap carried from the last chunk
+        fresh = False
         
-        i = 0
-        while i < len(tokens):
-            # Get chunk of tokens
-            chunk_end = min(i + Config.CHUNK_SIZE, len(tokens))
-            chunk = tokens[i:chunk_end]
-            
-            # Convert chunk back to text
-            chunk_text = self.tokenizer.decode(chunk)
-            chunks.append(chunk_text)
-            
-            # Move to next chunk, considering overlap
-            i += (Config.CHUNK_SIZE - Config.CHUNK_OVERLAP)
+        for piece in pieces:
+            if not piece:
+                continue
+            for match in SEGMENT_RE.finditer(piece + "\n\n"):
+                segment = match.group(0)
+                if not segment.strip():
+                    continue
+                tokens = self.tokenizer.encode(segment)
+                
+                if len(tokens) > Config.CHUNK_SIZE:
+                    if fresh:
+                        yield "".join(text for text, _ in window).strip()
+                    for part in self._split_long_segment(tokens):
+                        yield self.tokenizer.decode(part).strip()
+                    window.clear()
+                    window_tokens = 0
+                    fresh = False
+                    continue
+                
+                is_heading = segment.lstrip().startswith("#")
+                if fresh and (
+                    window_tokens + len(tokens) > Config.CHUNK_SIZE
+                    or (respect_headings and is_heading and window_tokens >= Config.CHUNK_SIZE // 2)
+                ):
+                    yield "".join(text for text, _ in window).strip()
+                    window, window_tokens = self._overlap_tail(window)
+                    fresh = False
+                if window_tokens + len(tokens) > Config.CHUNK_SIZE:
+                    window.clear()
+                    window_tokens = 0
+                window.append((segment, len(tokens)))
+                window_tokens += len(tokens)
+                fresh = True
         
-        return chunks
+        if fresh:
+            yield "".join(text for text, _ in window).strip()
+    
+    @staticmethod
+    def _overlap_tail(window: Deque[Tuple[str, int]]) -> Tuple[Deque[Tuple[str, int]], int]:
+        """Trailing whole segments of a window that fit within CHUNK_OVERLAP tokens."""
+        tail: Deque[Tuple[str, int]] = deque()
+        tail_tokens = 0
+        for text, n_tokens in reversed(window):
+            if tail_tokens + n_tokens > Config.CHUNK_OVERLAP:
+                break
+            tail.appendleft((text, n_tokens))
+            tail_tokens += n_tokens
+        return tail, tail_tokens
     
-    def process_document(self, file_path: str) -> List[str]:
-        """Process document: convert to markdown and chunk."""
+    def iter_document_chunks(
+        self,
+        source: DocumentSource,
+        executor: Optional[Executor] = None,
+        file_name: Optional[str] = None
+    ) -> Iterator[str]:
+        """Stream a document's chunks as it is parsed, timing extraction and chunking separately."""
+        pieces = timed(self.iter_document_text(source, executor, file_name), "extract")
+        return timed(self.iter_chunks(pieces), "chunk")
+    
+    def chunk_text(self, text: str) -> List[str]:
+        """Split text into chunks of specified token size with overlap."""
+        with span("chunk"):
+            return list(self.iter_chunks([text]))
+    
+    def process_document(self, file_path: str, executor: Optional[Executor] = None) -> List[str]:
+        """Process document: convert to markdown and chunk.
+        
+        When an executor is given, all parsing runs in it instead of the
+        calling process; chunking, a small share of the work that carries
+        overlap from page to page, stays in the caller.
+        """
         try:
             logger.info(f"Processing document: {file_path}")
-            markdown_text = self.file_to_markdown(file_path)
-            chunks = self.chunk_text(markdown_text)
+            chunks = list(self.iter_document_chunks(file_path, executor))
             logger.info(f"Successfully processed document into {len(chunks)} chunks")
             return chunks
         except Exception as e:
             logger.error(f"Error processing document {file_path}: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
\ No newline at end of file
@@ -0,0 +1,467 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class Document:
+    def __init__(
+        self,
+        doc_id: str,
+        name: str,
+        user_id: str,
+        upload_time: datetime,
+        content_hash: Optional[str] = None,
+        vector_document_id: Optional[str] = None,
+        chunk_count: int = 0,
+        status: str = "ready",
+        fingerprint: Optional[str] = None,
+        index_params: Optional[Dict[str, Any]] = None
+    ):
+        self.doc_id = doc_id
+        self.name = name
+        self.user_id = user_id
+        self.upload_time = upload_time
+        self.content_hash = content_hash
+        # Documents deduplicated on upload point at another document's vectors
+        self.vector_document_id = vector_document_id or doc_id
+        self.chunk_count = chunk_count
+        self.status = status
+        # Set on documents that own their vectors; see vector_store.index_fingerprint
+        self.fingerprint = fingerprint
+        # Chunking and embedding settings the vectors were built with; see vector_store.current_index_params
+        self.index_params = index_params
+    
+    @property
+    def embedding_model(self) -> str:
+        # Documents indexed before the settings were recorded used the configured model
+        return (self.index_params or {}).get("embedding_model", Config.EMBEDDING_MODEL)
+
+class ReindexCheckpoint:
+    def __init__(
+        self,
+        doc_id: str,
+        vector_document_id: str,
+        fingerprint: str,
+        embedding_model: str,
+        stored: int,
+        source: str = "upload"
+    ):
+        self.doc_id = doc_id
+        # Where the new vectors are being written, until they replace the document's
+        self.vector_document_id = vector_document_id
+        self.fingerprint = fingerprint
+        self.embedding_model = embedding_model
+        # Chunks fully stored in every index so far
+        self.stored = stored
+        # What the chunks are cut from: "upload", the original file, or "chunks", the old chunks' text
+        self.source = source
+
+class Section:
+    def __init__(self, position: int, title: str, level: int, start: int, end: int, summary: Optional[str] = None):
+        # Order in the document; sections cover chunk positions [start, end)
+        self.position = position
+        self.title = title
+        # Heading level, 0 for parts of a document without headings
+        self.level = level
+        self.start = start
+        self.end = end
+        self.summary = summary
+
+class DocumentStore:
+    """Persistent document metadata in SQLite, indexed by user and document id.
+    
+    The database is opened on first use. Recently read documents and
+    per-user listings are kept in small LRU caches that writes keep current,
+    and that are dropped when another process writes to the database.
+    
+    Re-indexing keeps its checkpoints and the vectors it replaced here too,
+    so a swap to new vectors is a single transaction. Section boundaries and
+    summaries are kept per vector_document_id, shared by deduplicated copies.
+    """
+    
+    COLUMNS = (
+        "doc_id, name, user_id, upload_time, content_hash, "
+        "vector_document_id, chunk_count, status, fingerprint, index_params"
+    )
+    
+    def __init__(self, path: Optional[str] = None, cache_size: Optional[int] = None):
+        self.path = path or Config.METADATA_DB_PATH
+        self.cache_size = cache_size or Config.METADATA_CACHE_SIZE
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._documents: "OrderedDict[str, Document]" = OrderedDict()
+        self._user_documents: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._data_version: Optional[int] = None
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self._conn = self._connect()
+        return self._conn
+    
+    def _connect(self) -> sqlite3.Connection:
+        logger.info(f"Opening document metadata store at {self.path}")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " user_id TEXT NOT NULL,"
+            " upload_time TEXT NOT NULL,"
+            " content_hash TEXT,"
+            " vector_document_id TEXT NOT NULL,"
+            " chunk_count INTEGER NOT NULL DEFAULT 0,"
+            " status TEXT NOT NULL,"
+            " fingerprint TEXT,"
+            " index_params TEXT)"
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(documents)")]
+        if "fingerprint" not in columns:
+            conn.execute("ALTER TABLE documents ADD COLUMN fingerprint TEXT")
+        if "index_params" not in columns:
+            conn.execute("ALTER TABLE documents ADD COLUMN index_params TEXT")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_documents_user ON documents (user_id, upload_time)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_documents_fingerprint ON documents (fingerprint)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_documents_vectors ON documents (vector_document_id)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS reindex_checkpoints ("
+            " doc_id TEXT PRIMARY KEY,"
+            " vector_document_id TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " embedding_model TEXT NOT NULL,"
+            " stored INTEGER NOT NULL DEFAULT 0,"
+            " source TEXT NOT NULL DEFAULT 'upload')"
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(reindex_checkpoints)")]
+        if "source" not in columns:
+            conn.execute("ALTER TABLE reindex_checkpoints ADD COLUMN source TEXT NOT NULL DEFAULT 'upload'")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS retired_vectors ("
+            " vector_document_id TEXT PRIMARY KEY,"
+            " user_id TEXT NOT NULL,"
+            " embedding_model TEXT NOT NULL,"
+            " retire_after REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sections ("
+            " vector_document_id TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " title TEXT NOT NULL,"
+            " level INTEGER NOT NULL,"
+            " start_chunk INTEGER NOT NULL,"
+            " end_chunk INTEGER NOT NULL,"
+            " summary TEXT,"
+            " PRIMARY KEY (vector_document_id, position))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS document_summaries ("
+            " vector_document_id TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " model TEXT NOT NULL)"
+        )
+        conn.commit()
+        return conn
+    
+    @staticmethod
+    def _from_row(row) -> Document:
+        (
+            doc_id, name, user_id, upload_time, content_hash,
+            vector_document_id, chunk_count, status, fingerprint, index_params
+        ) = row
+        return Document(
+            doc_id, name, user_id, datetime.fromisoformat(upload_time),
+            content_hash, vector_document_id, chunk_count, status, fingerprint,
+            json.loads(index_params) if index_params else None
+        )
+    
+    def _check_external_writes(self):
+        """Drop the caches if another process (a webhook worker, the re-indexer) committed since the last check."""
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            if self._data_version is not None:
+                self._documents.clear()
+                self._user_documents.clear()
+            self._data_version = version
+    
+    def _cache(self, document: Document):
+        self._documents[document.doc_id] = document
+        self._documents.move_to_end(document.doc_id)
+        while len(self._documents) > self.cache_size:
+            self._documents.popitem(last=False)
+    
+    def add(self, document: Document):
+        """Insert or replace a document record."""
+        with self._lock:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO documents ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    document.doc_id, document.name, document.user_id,
+                    document.upload_time.isoformat(), document.content_hash,
+                    document.vector_document_id, document.chunk_count, document.status,
+                    document.fingerprint,
+                    json.dumps(document.index_params) if document.index_params else None
+                )
+            )
+            self.conn.commit()
+            self._cache(document)
+            self._user_documents.pop(document.user_id, None)
+    
+    def update(self, doc_id: str, **fields):
+        """Update some columns of a document record."""
+        if not fields:
+            return
+        with self._lock:
+            assignments = ", ".join(f"{column} = ?" for column in fields)
+            self.conn.execute(
+                f"UPDATE documents SET {assignments} WHERE doc_id = ?",
+                [*fields.values(), doc_id]
+            )
+            self.conn.commit()
+            document = self._documents.pop(doc_id, None)
+            if document is not None:
+                self._user_documents.pop(document.user_id, None)
+            else:
+                # Unknown owner: drop every cached listing rather than risk a stale one
+                self._user_documents.clear()
+    
+    def get(self, doc_id: str) -> Optional[Document]:
+        """Get a document by id."""
+        with self._lock:
+            self._check_external_writes()
+            document = self._documents.get(doc_id)
+            if document is not None:
+                self._documents.move_to_end(doc_id)
+                return document
+            row = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM documents WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            document = self._from_row(row)
+            self._cache(document)
+            return document
+    
+    def find_by_fingerprint(self, fingerprint: str) -> Optional[Document]:
+        """Find a ready document that owns vectors with this index fingerprint."""
+        # Only owners have a fingerprint; after re-indexing their vectors have a new id
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM documents "
+                "WHERE fingerprint = ? AND status = 'ready' LIMIT 1",
+                (fingerprint,)
+            ).fetchone()
+            return self._from_row(row) if row else None
+    
+    def find_vector_owner(self, vector_document_id: str) -> Optional[Document]:
+        """The document whose upload produced the vectors stored under vector_document_id."""
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM documents "
+                "WHERE vector_document_id = ? AND (fingerprint IS NOT NULL OR doc_id = vector_document_id) LIMIT 1",
+                (vector_document_id,)
+            ).fetchone()
+            return self._from_row(row) if row else None
+    
+    def list_vector_owners(self, after: str = "", limit: int = 100) -> List[Document]:
+        """Ready documents that own vectors, by doc_id, starting after the given one."""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM documents "
+                "WHERE doc_id > ? AND status = 'ready' AND (fingerprint IS NOT NULL OR doc_id = vector_document_id) "
+                "ORDER BY doc_id LIMIT ?",
+                (after, limit)
+            ).fetchall()
+            return [self._from_row(row) for row in rows]
+    
+    def repoint_vectors(
+        self,
+        owner_id: str,
+        old_vector_id: str,
+        new_vector_id: str,
+        fingerprint: str,
+        index_params: Dict[str, Any],
+        chunk_count: int,
+        content_hash: str,
+        retire: Optional[Tuple[str, str, float]] = None
+    ):
+        """Move the owner and every deduplicated copy of a document onto new vectors, in one transaction.
+        
+        retire is (user_id, embedding_model, retire_after) of the old vectors, to be deleted later.
+        """
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE documents SET vector_document_id = ?, index_params = ?, chunk_count = ? "
+                    "WHERE vector_document_id = ?",
+                    (new_vector_id, json.dumps(index_params), chunk_count, old_vector_id)
+                )
+                self.conn.execute(
+                    "UPDATE documents SET fingerprint = ?, content_hash = ? WHERE doc_id = ?",
+                    (fingerprint, content_hash, owner_id)
+                )
+                self.conn.execute("DELETE FROM reindex_checkpoints WHERE doc_id = ?", (owner_id,))
+                if retire is not None and old_vector_id != new_vector_id:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO retired_vectors "
+                        "(vector_document_id, user_id, embedding_model, retire_after) VALUES (?, ?, ?, ?)",
+                        (old_vector_id, *retire)
+                    )
+            self._documents.clear()
+            self._user_documents.clear()
+    
+    def get_reindex_checkpoint(self, doc_id: str) -> Optional[ReindexCheckpoint]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT doc_id, vector_document_id, fingerprint, embedding_model, stored, source "
+                "FROM reindex_checkpoints WHERE doc_id = ?",
+                (doc_id,)
+            ).fetchone()
+            return ReindexCheckpoint(*row) if row else None
+    
+    def save_reindex_checkpoint(self, checkpoint: ReindexCheckpoint):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO reindex_checkpoints "
+                "(doc_id, vector_document_id, fingerprint, embedding_model, stored, source) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    checkpoint.doc_id, checkpoint.vector_document_id, checkpoint.fingerprint,
+                    checkpoint.embedding_model, checkpoint.stored, checkpoint.source
+                )
+            )
+            self.conn.commit()
+    
+    def retired_vectors(self, due_before: Optional[float] = None) -> List[Tuple[str, str, str, float]]:
+        """Replaced vectors as (vector_document_id, user_id, embedding_model, retire_after), soonest first."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT vector_document_id, user_id, embedding_model, retire_after FROM retired_vectors "
+                "WHERE retire_after <= ? ORDER BY retire_after",
+                (float("inf") if due_before is None else due_before,)
+            ).fetchall()
+    
+    def forget_retired_vectors(self, vector_document_id: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM retired_vectors WHERE vector_document_id = ?", (vector_document_id,))
+            self.conn.commit()
+    
+    def save_sections(self, vector_document_id: str, sections: List[Section]):
+        """Replace a document's sections, dropping their summaries and the document's."""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM sections WHERE vector_document_id = ?", (vector_document_id,))
+                self.conn.execute("DELETE FROM document_summaries WHERE vector_document_id = ?", (vector_document_id,))
+                self.conn.executemany(
+                    "INSERT INTO sections "
+                    "(vector_document_id, position, title, level, start_chunk, end_chunk, summary) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (vector_document_id, section.position, section.title, section.level,
+                         section.start, section.end, section.summary)
+                        for section in sections
+                    ]
+                )
+    
+    def get_sections(self, vector_document_id: str) -> List[Section]:
+        """A document's sections in order, with their summaries where written."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT position, title, level, start_chunk, end_chunk, summary FROM sections "
+                "WHERE vector_document_id = ? ORDER BY position",
+                (vector_document_id,)
+            ).fetchall()
+            return [Section(*row) for row in rows]
+    
+    def save_section_summary(self, vector_document_id: str, position: int, summary: str):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE sections SET summary = ? WHERE vector_document_id = ? AND position = ?",
+                (summary, vector_document_id, position)
+            )
+            self.conn.commit()
+    
+    def get_document_summary(self, vector_document_id: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT summary FROM document_summaries WHERE vector_document_id = ?", (vector_document_id,)
+            ).fetchone()
+            return row[0] if row else None
+    
+    def save_document_summary(self, vector_document_id: str, summary: str, model: str):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO document_summaries (vector_document_id, summary, model) VALUES (?, ?, ?)",
+                (vector_document_id, summary, model)
+            )
+            self.conn.commit()
+    
+    def delete_summaries(self, vector_document_id: str):
+        """Forget a document's sections and summaries, e.g. once its vectors are deleted."""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM sections WHERE vector_document_id = ?", (vector_document_id,))
+                self.conn.execute("DELETE FROM document_summaries WHERE vector_document_id = ?", (vector_document_id,))
+    
+    def list_unsummarized(self, after: str = "", limit: int = 100) -> List[Document]:
+        """Ready documents owning vectors that have no document summary yet, by doc_id."""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM documents "
+                "WHERE doc_id > ? AND status = 'ready' AND (fingerprint IS NOT NULL OR doc_id = vector_document_id) "
+                "AND vector_document_id NOT IN (SELECT vector_document_id FROM document_summaries) "
+                "ORDER BY doc_id LIMIT ?",
+                (after, limit)
+            ).fetchall()
+            return [self._from_row(row) for row in rows]
+    
+    def list_by_status(self, status: str, after: str = "", limit: int = 100) -> List[Document]:
+        """Documents with a status, by doc_id, starting after the given one."""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM documents WHERE doc_id > ? AND status = ? ORDER BY doc_id LIMIT ?",
+                (after, status, limit)
+            ).fetchall()
+            return [self._from_row(row) for row in rows]
+    
+    def list_by_user(self, user_id: str, status: Optional[str] = None) -> List[Document]:
+        """List a user's documents, oldest first, optionally filtered by status."""
+        with self._lock:
+            self._check_external_writes()
+            doc_ids = self._user_documents.get(user_id)
+            if doc_ids is not None and all(doc_id in self._documents for doc_id in doc_ids):
+                self._user_documents.move_to_end(user_id)
+                documents = [self._documents[doc_id] for doc_id in doc_ids]
+            else:
+                rows = self.conn.execute(
+                    f"SELECT {self.COLUMNS} FROM documents WHERE user_id = ? ORDER BY upload_time",
+                    (user_id,)
+                ).fetchall()
+                documents = [self._from_row(row) for row in rows]
+                for document in documents:
+                    self._cache(document)
+                self._user_documents[user_id] = [document.doc_id for document in documents]
+                while len(self._user_documents) > self.cache_size:
+                    self._user_documents.popitem(last=False)
+        
+        if status is not None:
+            documents = [document for document in documents if document.status == status]
+        return documents
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import List, Optional, Sequence
+from config.config import Config
+from . import openai_client
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBackend:
+    """Turns batches of text into vectors with one embedding model."""
+    
+    # Upper bound on batches embedded at once; None leaves it to the pipeline
+    max_concurrency: Optional[int] = None
+    # Longest input embedded in full, in the model's own tokens; the rest is cut off
+    max_input_tokens: Optional[int] = None
+    
+    def __init__(self, model: str):
+        self.model = model
+    
+    def check_chunk_size(self):
+        """Warn when chunks of CHUNK_SIZE tokens are longer than the model reads."""
+        if self.max_input_tokens is not None and Config.CHUNK_SIZE > self.max_input_tokens:
+            logger.warning(
+                f"CHUNK_SIZE is {Config.CHUNK_SIZE} tokens, but {self.model} embeds only the first "
+                f"{self.max_input_tokens} of its tokens, so the end of each chunk is not searchable. "
+                f"Set CHUNK_SIZE below {self.max_input_tokens}, with some margin, as the model's "
+                "tokens are usually shorter than the chunker's"
+            )
+    
+    def warm_up(self):
+        """Load whatever the first batch would otherwise wait for."""
+    
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        raise NotImplementedError
+    
+    async def aembed(self, text: str) -> List[float]:
+        """Embed one text without blocking the event loop."""
+        return (await asyncio.to_thread(self.embed_batch, [text]))[0]
+    
+    def is_retryable(self, error: Exception) -> bool:
+        return False
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """OpenAI embeddings API, e.g. text-embedding-ada-002."""
+    
+    max_input_tokens = 8191
+    
+    def warm_up(self):
+        openai_client.get_client()
+    
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        # Batches come from ingestion and yield to questions under the rate limits
+        return openai_client.embed(self.model, texts, lane=openai_client.BULK)
+    
+    async def aembed(self, text: str) -> List[float]:
+        return await openai_client.aembed(self.model, text, lane=openai_client.INTERACTIVE)
+    
+    def is_retryable(self, error: Exception) -> bool:
+        return openai_client.is_retryable(error)
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """all-MiniLM-L6-v2 on CPU through onnxruntime, using the model Chroma ships for local use.
+    
+    The model (about 80MB) is downloaded on first use unless it is already in
+    LOCAL_EMBEDDING_MODEL_DIR. onnxruntime spreads each batch over all cores,
+    so batches are run one at a time. Inputs are truncated to 256 word-pieces,
+    so chunks need a CHUNK_SIZE of about 200 to be embedded whole.
+    """
+    
+    MODELS = {"onnx/all-MiniLM-L6-v2"}
+    max_concurrency = 1
+    max_input_tokens = 256
+    
+    def __init__(self, model: str):
+        super().__init__(model)
+        if model not in self.MODELS:
+            raise ValueError(f"Unknown ONNX embedding model: {model}")
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+        self.function = ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+        if Config.LOCAL_EMBEDDING_MODEL_DIR:
+            self.function.DOWNLOAD_PATH = Path(Config.LOCAL_EMBEDDING_MODEL_DIR) / ONNXMiniLM_L6_V2.MODEL_NAME
+    
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        return [[float(value) for value in vector] for vector in self.function(list(texts))]
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Any sentence-transformers model on CPU, named as local/<model id>.
+    
+    Needs the optional sentence-transformers package.
+    """
+    
+    max_concurrency = 1
+    
+    def __init__(self, model: str):
+        super().__init__(model)
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                f"Embedding model {model} needs sentence-transformers: pip install sentence-transformers"
+            )
+        self.encoder = SentenceTransformer(
+            model[len("local/"):],
+            device="cpu",
+            cache_folder=Config.LOCAL_EMBEDDING_MODEL_DIR or None
+        )
+        self.max_input_tokens = self.encoder.max_seq_length
+    
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        vectors = self.encoder.encode(list(texts), batch_size=32, normalize_embeddings=True)
+        return vectors.tolist()
+
+def make_embedding_backend(model: Optional[str] = None) -> EmbeddingBackend:
+    """Build the backend for an embedding model name.
+    
+    onnx/all-MiniLM-L6-v2 and local/<sentence-transformers model> run on the
+    local CPU; any other name is sent to the OpenAI API.
+    """
+    model = model or Config.EMBEDDING_MODEL
+    logger.info(f"Using embedding model {model}")
+    if model.startswith("onnx/"):
+        return OnnxEmbeddingBackend(model)
+    if model.startswith("local/"):
+        return SentenceTransformerBackend(model)
+    return OpenAIEmbeddingBackend(model)
@@ -0,0 +1,210 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: in-memory LRU in front of SQLite on disk.
+    
+    Entries are keyed by (embedding model, SHA-256 of the normalized text), so the
+    same chunk uploaded by different users or in different files is embedded once.
+    """
+    
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        memory_items: Optional[int] = None,
+        max_disk_bytes: Optional[int] = None
+    ):
+        self.path = path or Config.EMBEDDING_CACHE_PATH
+        self.memory_items = Config.EMBEDDING_CACHE_MEMORY_ITEMS if memory_items is None else memory_items
+        self.max_disk_bytes = Config.EMBEDDING_CACHE_MAX_BYTES if max_disk_bytes is None else max_disk_bytes
+        
+        self._memory: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        self._disk_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+        ).fetchone()[0]
+        logger.info(f"Embedding cache at {self.path} holds {self._disk_bytes} bytes")
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Normalize unicode and whitespace so trivially different copies share a key."""
+        return " ".join(unicodedata.normalize("NFC", text).split())
+    
+    @classmethod
+    def text_hash(cls, text: str) -> str:
+        return hashlib.sha256(cls.normalize(text).encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _encode(embedding: Sequence[float]) -> bytes:
+        return array("f", embedding).tobytes()
+    
+    @staticmethod
+    def _decode(blob: bytes) -> List[float]:
+        values = array("f")
+        values.frombytes(blob)
+        return values.tolist()
+    
+    def _remember(self, key: Tuple[str, str], embedding: List[float]):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+    
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Return the cached embedding for text, or None."""
+        return self.get_many(model, [text])[0]
+    
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Look up several texts at once; misses are returned as None."""
+        keys = [(model, self.text_hash(text)) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        
+        with self._lock:
+            missing: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = embedding
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key[1], []).append(i)
+            
+            if missing:
+                hashes = list(missing)
+                now = time.time()
+                # Stay well under SQLite's bound-parameter limit
+                for start in range(0, len(hashes), 500):
+                    batch = hashes[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        f"SELECT text_hash, vector FROM embeddings "
+                        f"WHERE model = ? AND text_hash IN ({placeholders})",
+                        [model, *batch]
+                    ).fetchall()
+                    for text_hash, blob in rows:
+                        embedding = self._decode(blob)
+                        self._remember((model, text_hash), embedding)
+                        for i in missing[text_hash]:
+                            results[i] = embedding
+                            self.disk_hits += 1
+                    if rows:
+                        self._conn.executemany(
+                            "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                            [(now, model, text_hash) for text_hash, _ in rows]
+                        )
+                self._conn.commit()
+            
+            found = sum(1 for embedding in results if embedding is not None)
+            self.hits += found
+            self.misses += len(texts) - found
+        
+        return results
+    
+    def put(self, model: str, text: str, embedding: Sequence[float]):
+        """Store one embedding."""
+        self.put_many(model, [(text, embedding)])
+    
+    def put_many(self, model: str, items: Iterable[Tuple[str, Sequence[float]]]):
+        """Store several (text, embedding) pairs and evict old entries if over budget."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, embedding in items:
+                text_hash = self.text_hash(text)
+                blob = self._encode(embedding)
+                self._remember((model, text_hash), list(embedding))
+                rows.append((model, text_hash, blob, len(blob), now))
+            if not rows:
+                return
+            
+            for model_name, text_hash, _, _, _ in rows:
+                existing = self._conn.execute(
+                    "SELECT size FROM embeddings WHERE model = ? AND text_hash = ?",
+                    (model_name, text_hash)
+                ).fetchone()
+                if existing:
+                    self._disk_bytes -= existing[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._disk_bytes += sum(row[3] for row in rows)
+            self._evict()
+            self._conn.commit()
+    
+    def _evict(self):
+        """Drop least recently used rows until the disk tier is under 90% of its budget."""
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        target = int(self.max_disk_bytes * 0.9)
+        while self._disk_bytes > target:
+            rows = self._conn.execute(
+                "SELECT model, text_hash, size FROM embeddings ORDER BY last_access LIMIT 500"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            victims = []
+            for model, text_hash, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                victims.append((model, text_hash))
+                self._disk_bytes -= size
+            self._conn.executemany(
+                "DELETE FROM embeddings WHERE model = ? AND text_hash = ?", victims
+            )
+            for key in victims:
+                self._memory.pop(key, None)
+            self.evictions += len(victims)
+        logger.info(f"Embedding cache evicted down to {self._disk_bytes} bytes")
+    
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and current tier sizes."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes
+            }
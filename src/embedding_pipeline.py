@@ -0,0 +1,134 @@
+import random
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+from config.config import Config
+from .embedding_backends import EmbeddingBackend, make_embedding_backend
+from .embedding_cache import EmbeddingCache
+from .metrics import count_tokens
+from .tokenizer import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingPipeline:
+    """Embed many texts using token-budgeted batches sent concurrently to a backend."""
+    
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        max_batch_tokens: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        base_backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        cache: Optional[EmbeddingCache] = None,
+        backend: Optional[EmbeddingBackend] = None
+    ):
+        self.backend = backend or make_embedding_backend(model)
+        self.model = self.backend.model
+        self.max_batch_tokens = max_batch_tokens or Config.EMBEDDING_BATCH_TOKENS
+        self.max_batch_size = max_batch_size or Config.EMBEDDING_BATCH_SIZE
+        self.max_concurrency = min(
+            max_concurrency or Config.EMBEDDING_CONCURRENCY,
+            self.backend.max_concurrency or Config.EMBEDDING_CONCURRENCY
+        )
+        self.max_retries = Config.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.cache = cache
+    
+    @property
+    def tokenizer(self):
+        return get_tokenizer()
+    
+    def make_batches(self, texts: Sequence[str]) -> List[List[int]]:
+        """Group text indices into batches that fit the token and size budgets."""
+        batches = []
+        current: List[int] = []
+        current_tokens = 0
+        total_tokens = 0
+        
+        for i, text in enumerate(texts):
+            n_tokens = len(self.tokenizer.encode(text))
+            if current and (
+                current_tokens + n_tokens > self.max_batch_tokens
+                or len(current) >= self.max_batch_size
+            ):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += n_tokens
+            total_tokens += n_tokens
+        
+        if current:
+            batches.append(current)
+        count_tokens(self.model, "embedding", total_tokens)
+        return batches
+    
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Get embeddings for all texts, returned in input order.
+        
+        Cached texts and repeats within the call are only sent to the API once.
+        """
+        if not texts:
+            return []
+        
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        if self.cache is not None:
+            embeddings = self.cache.get_many(self.model, texts)
+        
+        pending: Dict[str, List[int]] = {}
+        for i, (text, embedding) in enumerate(zip(texts, embeddings)):
+            if embedding is None:
+                pending.setdefault(text, []).append(i)
+        
+        if pending:
+            unique_texts = list(pending)
+            fresh = self.embed_uncached(unique_texts)
+            for text, embedding in zip(unique_texts, fresh):
+                for i in pending[text]:
+                    embeddings[i] = embedding
+            if self.cache is not None:
+                self.cache.put_many(self.model, zip(unique_texts, fresh))
+        
+        logger.info(f"Embedded {len(texts)} texts, {len(pending)} sent to {self.model}")
+        return embeddings
+    
+    def embed_uncached(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed texts through the backend in concurrent token-budgeted batches."""
+        batches = self.make_batches(texts)
+        logger.info(f"Embedding {len(texts)} texts in {len(batches)} batches")
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        
+        workers = min(self.max_concurrency, len(batches))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (batch, executor.submit(self.embed_batch, [texts[i] for i in batch]))
+                for batch in batches
+            ]
+            for batch, future in futures:
+                for i, embedding in zip(batch, future.result()):
+                    embeddings[i] = embedding
+        
+        return embeddings
+    
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch, retrying errors the backend considers transient (429/5xx)."""
+        attempt = 0
+        while True:
+            try:
+                return self.backend.embed_batch(texts)
+            except Exception as e:
+                if attempt >= self.max_retries or not self.backend.is_retryable(e):
+                    logger.error(f"Error embedding batch of {len(texts)} texts: {str(e)}")
+                    raise
+                delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+                delay *= 0.5 + random.random() / 2
+                attempt += 1
+                logger.warning(
+                    f"Embedding batch failed ({str(e)}), retry {attempt}/{self.max_retries} in {delay:.1f}s"
+                )
+                time.sleep(delay)
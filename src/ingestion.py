@@ -0,0 +1,417 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config.config import Config
+from .document_processor import DocumentProcessor, DocumentSource, spool
+from .metrics import trace
+from .partitioning import owns_user
+from .summarizer import SectionIndexer
+from .upload_store import UploadStore
+from .vector_store import current_index_params
+
+logger = logging.getLogger(__name__)
+
+class IngestionBusyError(Exception):
+    """Raised when a job is rejected because the queue or the user's quota is full."""
+
+class IngestionJob:
+    def __init__(
+        self,
+        user_id: str,
+        document_id: str,
+        file_name: str,
+        data: bytes,
+        content_hash: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+        on_progress: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_complete: Optional[Callable[["IngestionJob"], Awaitable[None]]] = None,
+        on_error: Optional[Callable[["IngestionJob", Exception], Awaitable[None]]] = None
+    ):
+        self.user_id = user_id
+        self.document_id = document_id
+        self.file_name = file_name
+        # The upload's bytes, or None once spooled to spool_path or released
+        self.data: Optional[bytes] = data
+        self.size = len(data)
+        self.spool_path: Optional[str] = None
+        self.content_hash = content_hash
+        self.fingerprint = fingerprint
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.status = "queued"
+        self.chunk_count = 0
+    
+    @property
+    def source(self) -> DocumentSource:
+        return self.data if self.data is not None else self.spool_path
+    
+    def spill(self):
+        """Move the upload's bytes out of memory into a file in SPOOL_DIR."""
+        if self.data is not None:
+            self.spool_path = spool(self.data, os.path.splitext(self.file_name)[1])
+            self.data = None
+    
+    def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        with open(self.spool_path, "rb") as f:
+            return f.read()
+    
+    def release(self):
+        """Drop the upload's bytes and remove its spooled file, once the job is over."""
+        self.data = None
+        if self.spool_path is not None:
+            try:
+                os.remove(self.spool_path)
+            except FileNotFoundError:
+                pass
+            self.spool_path = None
+    
+    async def report(self, message: str):
+        """Send a progress update, never letting a failed edit break the job."""
+        if self.on_progress is None:
+            return
+        try:
+            await self.on_progress(message)
+        except Exception as e:
+            logger.debug(f"Could not report progress for document {self.document_id}: {str(e)}")
+    
+    async def complete(self):
+        """Report that the document is indexed, never letting a failed callback fail the job."""
+        if self.on_complete is None:
+            return
+        try:
+            await self.on_complete(self)
+        except Exception as e:
+            logger.error(f"Error reporting completion of document {self.document_id}: {str(e)}")
+
+class JobStore:
+    """Ingestion jobs not finished yet, with their uploads, in SQLite.
+    
+    A job is saved before its upload is acknowledged and forgotten once it
+    is done or has failed, so jobs queued or running when a process stops
+    are left for the next start to resume.
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or Config.INGESTION_JOBS_PATH
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS jobs ("
+                        " document_id TEXT PRIMARY KEY,"
+                        " user_id TEXT NOT NULL,"
+                        " file_name TEXT NOT NULL,"
+                        " content_hash TEXT,"
+                        " fingerprint TEXT,"
+                        " data BLOB NOT NULL,"
+                        " queued_at REAL NOT NULL)"
+                    )
+                    conn.commit()
+                    self._conn = conn
+        return self._conn
+    
+    def add(self, job: IngestionJob):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO jobs (document_id, user_id, file_name, content_hash, fingerprint, data, queued_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.document_id, job.user_id, job.file_name, job.content_hash, job.fingerprint, job.read(), time.time())
+            )
+            self.conn.commit()
+    
+    def remove(self, document_id: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM jobs WHERE document_id = ?", (document_id,))
+            self.conn.commit()
+    
+    def pending(self) -> List[Tuple[str, str, str, Optional[str], Optional[str]]]:
+        """(document_id, user_id, file_name, content_hash, fingerprint) of every saved job, oldest first."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT document_id, user_id, file_name, content_hash, fingerprint FROM jobs ORDER BY queued_at"
+            ).fetchall()
+    
+    def data(self, document_id: str) -> Optional[bytes]:
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM jobs WHERE document_id = ?", (document_id,)).fetchone()
+        return row[0] if row else None
+
+class IngestionQueue:
+    """Bounded job queue that keeps document ingestion off the event loop.
+    
+    Page extraction runs in a process pool shared by all jobs; chunking,
+    embedding and storage are streamed through a thread, noting section
+    headings on the way. A fixed number of worker tasks bounds global concurrency, and
+    submissions are rejected when the queue or the user's quota is full.
+    Uploads are parsed from memory; past buffer_bytes of waiting uploads,
+    further ones are spooled to SPOOL_DIR. Once indexed, the original is
+    handed to the upload store, which keeps it if its retention policy allows.
+    Jobs are saved in a JobStore until done, and those a previous run left
+    unfinished are resumed on start.
+    """
+    
+    def __init__(
+        self,
+        vector_store,
+        document_processor: DocumentProcessor,
+        max_queue_size: Optional[int] = None,
+        max_concurrent_jobs: Optional[int] = None,
+        max_jobs_per_user: Optional[int] = None,
+        process_workers: Optional[int] = None,
+        uploads: Optional[UploadStore] = None,
+        buffer_bytes: Optional[float] = None,
+        jobs: Optional[JobStore] = None
+    ):
+        self.vector_store = vector_store
+        self.document_processor = document_processor
+        self.uploads = uploads or UploadStore()
+        self.jobs = jobs or JobStore()
+        self.buffer_bytes = Config.INGESTION_BUFFER_MB * 1024 * 1024 if buffer_bytes is None else buffer_bytes
+        self.max_queue_size = max_queue_size or Config.INGESTION_QUEUE_SIZE
+        self.max_concurrent_jobs = max_concurrent_jobs or Config.INGESTION_CONCURRENCY
+        self.max_jobs_per_user = max_jobs_per_user or Config.INGESTION_PER_USER_LIMIT
+        self.process_workers = process_workers or Config.INGESTION_PROCESS_WORKERS
+        
+        # Unbounded, so resumed jobs always fit; submit() enforces max_queue_size
+        self.queue: "asyncio.Queue[IngestionJob]" = asyncio.Queue()
+        self.user_jobs: Dict[str, int] = {}
+        self.active_jobs = 0
+        # Jobs being saved, not yet in the queue
+        self.saving = 0
+        # Bytes of uploads held in memory by queued and running jobs
+        self.buffered = 0
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.workers: List[asyncio.Task] = []
+        # Set by webhook workers: each resumes the jobs of its own users
+        self.partition: Optional[int] = None
+    
+    @property
+    def depth(self) -> int:
+        """Jobs waiting to start."""
+        return self.queue.qsize()
+    
+    async def start(
+        self,
+        on_complete: Optional[Callable[[IngestionJob], Awaitable[None]]] = None,
+        on_error: Optional[Callable[[IngestionJob, Exception], Awaitable[None]]] = None
+    ):
+        """Start the process pool and worker tasks, resuming jobs a previous run left unfinished.
+        
+        Resumed jobs call on_complete and on_error, as the callbacks they were
+        submitted with are gone.
+        """
+        if self.workers:
+            return
+        try:
+            interrupted = await asyncio.to_thread(self.recover)
+        except Exception as e:
+            logger.error(f"Error recovering interrupted ingestion jobs: {str(e)}")
+            interrupted = []
+        # Spawn rather than fork: the bot process holds threads and open sockets
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.process_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        self.workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.max_concurrent_jobs)
+        ]
+        for document_id, user_id, file_name, content_hash, fingerprint in interrupted:
+            data = await asyncio.to_thread(self.jobs.data, document_id)
+            if data is None:
+                continue
+            job = IngestionJob(
+                user_id, document_id, file_name, data,
+                content_hash=content_hash,
+                fingerprint=fingerprint,
+                on_complete=on_complete,
+                on_error=on_error
+            )
+            self.user_jobs[user_id] = self.user_jobs.get(user_id, 0) + 1
+            self._put(job)
+        logger.info(
+            f"Ingestion queue started with {self.max_concurrent_jobs} workers "
+            f"and {self.process_workers} parser processes"
+            + (f", resuming {len(interrupted)} jobs" if interrupted else "")
+        )
+    
+    async def stop(self):
+        """Cancel workers and shut down the process pool."""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        logger.info("Ingestion queue stopped")
+    
+    def recover(self) -> List[Tuple[str, str, str, Optional[str], Optional[str]]]:
+        """The saved jobs of this process's users that a previous run left unfinished.
+        
+        Nothing is ingesting their documents before the workers start, so
+        whatever they stored is deleted. Documents left processing without a
+        saved job, from before jobs were saved, are marked failed.
+        """
+        document_store = self.vector_store.document_store
+        interrupted = []
+        for saved in self.jobs.pending():
+            document_id, user_id = saved[:2]
+            if not owns_user(user_id, self.partition):
+                continue
+            document = document_store.get(document_id)
+            if document is not None and document.status != "processing":
+                # Done or failed just before the job was forgotten
+                self.jobs.remove(document_id)
+            else:
+                interrupted.append(saved)
+        resumed = {saved[0] for saved in interrupted}
+        failed = 0
+        after = ""
+        while True:
+            documents = document_store.list_by_status("processing", after)
+            if not documents:
+                break
+            after = documents[-1].doc_id
+            for document in documents:
+                if not owns_user(document.user_id, self.partition):
+                    continue
+                # Partial; a resumed job stores its chunks again, maybe cut differently
+                self.vector_store.delete_vectors(document.user_id, document.vector_document_id, document.embedding_model)
+                if document.doc_id not in resumed:
+                    self.vector_store.update_document(document.doc_id, status="failed", chunk_count=0)
+                    failed += 1
+        if failed:
+            logger.warning(f"Marked {failed} documents interrupted while processing, with no saved job, as failed")
+        return interrupted
+    
+    async def submit(self, job: IngestionJob):
+        """Save and enqueue a job, or raise IngestionBusyError if limits are reached."""
+        user_count = self.user_jobs.get(job.user_id, 0)
+        if user_count >= self.max_jobs_per_user:
+            raise IngestionBusyError(
+                f"You already have {user_count} documents processing. "
+                "Please wait for them to finish before uploading more."
+            )
+        if self.depth + self.saving >= self.max_queue_size:
+            raise IngestionBusyError("The bot is busy processing documents. Please try again in a few minutes.")
+        
+        self.user_jobs[job.user_id] = user_count + 1
+        self.saving += 1
+        try:
+            await asyncio.to_thread(self.jobs.add, job)
+        except Exception:
+            self._forget_user_job(job.user_id)
+            raise
+        finally:
+            self.saving -= 1
+        self._put(job)
+        logger.info(f"Queued document {job.document_id} for user {job.user_id} (queue depth {self.depth})")
+    
+    def _put(self, job: IngestionJob):
+        if self.buffered + job.size > self.buffer_bytes:
+            job.spill()
+        else:
+            self.buffered += job.size
+        self.queue.put_nowait(job)
+    
+    def _forget_user_job(self, user_id: str):
+        remaining = self.user_jobs.get(user_id, 1) - 1
+        if remaining > 0:
+            self.user_jobs[user_id] = remaining
+        else:
+            self.user_jobs.pop(user_id, None)
+    
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self.queue.get()
+            self.active_jobs += 1
+            try:
+                with trace("ingestion", user=job.user_id, document=job.document_id):
+                    await self._run(job)
+            except Exception as e:
+                job.status = "failed"
+                try:
+                    await asyncio.to_thread(self.vector_store.update_document, job.document_id, status="failed")
+                except Exception as update_error:
+                    logger.error(f"Error marking document {job.document_id} as failed: {str(update_error)}")
+                logger.error(f"Ingestion worker {worker_id} failed on document {job.document_id}: {str(e)}")
+                if job.on_error is not None:
+                    try:
+                        await job.on_error(job, e)
+                    except Exception as callback_error:
+                        logger.error(f"Error reporting ingestion failure: {str(callback_error)}")
+            finally:
+                if job.data is not None:
+                    self.buffered -= job.size
+                job.release()
+                self.active_jobs -= 1
+                self._forget_user_job(job.user_id)
+                self.queue.task_done()
+                if job.status in ("done", "failed"):
+                    # A job cut short by stopping stays saved, to be resumed
+                    try:
+                        await asyncio.to_thread(self.jobs.remove, job.document_id)
+                    except Exception as e:
+                        logger.error(f"Error forgetting the job of document {job.document_id}: {str(e)}")
+    
+    async def _run(self, job: IngestionJob):
+        loop = asyncio.get_running_loop()
+        
+        def on_progress(stored: int):
+            # Called from the ingestion thread; hand the edit back to the event loop
+            asyncio.run_coroutine_threadsafe(
+                job.report(f"📄 Processing your document...\nEmbedded {stored} chunks"), loop
+            )
+        
+        # Parsing, chunking and embedding form one stream, so memory is
+        # bounded by the embedding group size rather than the document size
+        job.status = "processing"
+        await asyncio.to_thread(
+            self.vector_store.add_document,
+            job.document_id, job.file_name, job.user_id,
+            content_hash=job.content_hash, chunk_count=0, status="processing",
+            fingerprint=job.fingerprint, index_params=current_index_params()
+        )
+        await job.report("📄 Processing your document...\nExtracting text")
+        sections = SectionIndexer()
+        chunks = sections.observe(
+            self.document_processor.iter_document_chunks(job.source, self.executor, file_name=job.file_name)
+        )
+        job.chunk_count = await asyncio.to_thread(
+            self.vector_store.add_chunk_stream,
+            chunks, job.user_id, job.document_id, job.fingerprint, on_progress
+        )
+        await asyncio.to_thread(self.vector_store.document_store.save_sections, job.document_id, sections.sections())
+        await asyncio.to_thread(
+            self.vector_store.update_document, job.document_id, status="ready", chunk_count=job.chunk_count
+        )
+        logger.info(f"Stored document {job.document_id} in vector database ({job.chunk_count} chunks)")
+        try:
+            await asyncio.to_thread(self._keep_original, job)
+        except Exception as e:
+            # Only re-indexing needs the original, and it can do without
+            logger.error(f"Error keeping the original of document {job.document_id}: {str(e)}")
+        
+        job.status = "done"
+        await job.complete()
+    
+    def _keep_original(self, job: IngestionJob):
+        self.uploads.save(job.user_id, job.document_id, job.file_name, job.read())
@@ -0,0 +1,146 @@
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Words with inner dots, dashes or apostrophes stay whole: "3.2.1", "x-ray", "o'brien"
+TOKEN_RE = re.compile(r"\w+(?:[.'\-]\w+)*")
+QUOTED_RE = re.compile(r"[\"“«]([^\"”»]+)[\"”»]")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me of on or "
+    "please tell that the this to was what when where which who why with you".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+def exact_terms(query: str) -> Set[str]:
+    """Terms a question names literally: quoted words and anything containing a digit.
+    
+    Embeddings barely separate "chapter 3" from "chapter 4", so these are
+    the questions lexical matching answers better than vector search.
+    """
+    terms = {term for term in tokenize(query) if any(c.isdigit() for c in term)}
+    for phrase in QUOTED_RE.findall(query):
+        terms.update(term for term in tokenize(phrase) if term not in STOPWORDS)
+    return terms
+
+class LexicalHit:
+    def __init__(self, position: int, score: float, terms: Set[str]):
+        self.position = position
+        self.score = score
+        self.terms = terms
+
+class LexicalIndex:
+    """Per-document BM25 index over chunk text, stored in SQLite next to the vectors.
+    
+    Postings and chunk lengths are keyed by the same document id as the
+    chunk vectors, and term statistics are computed within one document.
+    """
+    
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path or Config.LEXICAL_INDEX_PATH
+        self.k1 = k1
+        self.b = b
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self._conn = self._connect()
+        return self._conn
+    
+    def _connect(self) -> sqlite3.Connection:
+        logger.info(f"Opening lexical index at {self.path}")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lexical_postings ("
+            " document_id TEXT NOT NULL,"
+            " term TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " tf INTEGER NOT NULL,"
+            " PRIMARY KEY (document_id, term, position)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lexical_chunks ("
+            " document_id TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " PRIMARY KEY (document_id, position)) WITHOUT ROWID"
+        )
+        conn.commit()
+        return conn
+    
+    def add_chunks(self, document_id: str, offset: int, chunks: Iterable[str]):
+        """Index chunks stored at positions offset, offset + 1, ... of a document."""
+        postings = []
+        lengths = []
+        for i, chunk in enumerate(chunks):
+            terms = tokenize(chunk)
+            lengths.append((document_id, offset + i, len(terms)))
+            postings.extend(
+                (document_id, term, offset + i, tf) for term, tf in Counter(terms).items()
+            )
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO lexical_chunks (document_id, position, length) VALUES (?, ?, ?)",
+                lengths
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO lexical_postings (document_id, term, position, tf) VALUES (?, ?, ?, ?)",
+                postings
+            )
+            self.conn.commit()
+    
+    def delete_document(self, document_id: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM lexical_postings WHERE document_id = ?", (document_id,))
+            self.conn.execute("DELETE FROM lexical_chunks WHERE document_id = ?", (document_id,))
+            self.conn.commit()
+    
+    def search(self, document_id: str, query: str, limit: int = 10) -> List[LexicalHit]:
+        """Rank a document's chunks against query with BM25, best first."""
+        terms = sorted({term for term in tokenize(query) if term not in STOPWORDS})
+        if not terms:
+            return []
+        
+        with self._lock:
+            n_chunks, avg_length = self.conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM lexical_chunks WHERE document_id = ?",
+                (document_id,)
+            ).fetchone()
+            if not n_chunks:
+                return []
+            placeholders = ", ".join("?" for _ in terms)
+            rows = self.conn.execute(
+                "SELECT p.term, p.position, p.tf, c.length FROM lexical_postings p "
+                "JOIN lexical_chunks c ON c.document_id = p.document_id AND c.position = p.position "
+                f"WHERE p.document_id = ? AND p.term IN ({placeholders})",
+                (document_id, *terms)
+            ).fetchall()
+        
+        document_frequency = Counter(term for term, _, _, _ in rows)
+        scores: Dict[int, float] = {}
+        matched: Dict[int, Set[str]] = {}
+        for term, position, tf, length in rows:
+            df = document_frequency[term]
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * length / (avg_length or 1))
+            scores[position] = scores.get(position, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            matched.setdefault(position, set()).add(term)
+        
+        ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [LexicalHit(position, scores[position], matched[position]) for position in ranked]
@@ -0,0 +1,84 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class DocumentMatrix:
+    """A document's chunk embeddings as one normalized matrix, with texts by row."""
+    
+    def __init__(self, positions: Sequence[int], embeddings: Sequence[Sequence[float]], texts: Sequence[str]):
+        self.positions = np.asarray(positions, dtype=np.int64)
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+        self.texts = list(texts)
+    
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + sum(len(text) for text in self.texts)
+    
+    def search(self, embedding: Sequence[float], n_results: int) -> List[Tuple[int, str, float]]:
+        """Closest chunks as (position, text, cosine distance), best first."""
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not len(self.texts) or not norm:
+            return []
+        scores = self.matrix @ (query / norm)
+        n_results = min(n_results, len(scores))
+        best = np.argpartition(-scores, n_results - 1)[:n_results]
+        best = best[np.argsort(-scores[best])]
+        return [(int(self.positions[i]), self.texts[i], float(1 - scores[i])) for i in best]
+
+class DocumentMatrixCache:
+    """LRU of document matrices for exact brute-force search on selected documents.
+    
+    Only documents up to max_chunks are kept; beyond that an HNSW query is
+    the better trade.
+    """
+    
+    def __init__(self, max_documents: Optional[int] = None, max_chunks: Optional[int] = None):
+        self.max_documents = max_documents or Config.MATRIX_CACHE_DOCUMENTS
+        self.max_chunks = max_chunks or Config.MATRIX_CACHE_MAX_CHUNKS
+        self._matrices: "OrderedDict[str, DocumentMatrix]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def __contains__(self, document_id: str) -> bool:
+        with self._lock:
+            return document_id in self._matrices
+    
+    def get(self, document_id: str) -> Optional[DocumentMatrix]:
+        with self._lock:
+            matrix = self._matrices.get(document_id)
+            if matrix is None:
+                self.misses += 1
+                return None
+            self._matrices.move_to_end(document_id)
+            self.hits += 1
+            return matrix
+    
+    def put(self, document_id: str, matrix: DocumentMatrix):
+        with self._lock:
+            self._matrices[document_id] = matrix
+            self._matrices.move_to_end(document_id)
+            while len(self._matrices) > self.max_documents:
+                self._matrices.popitem(last=False)
+    
+    def invalidate(self, document_id: str):
+        with self._lock:
+            self._matrices.pop(document_id, None)
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "documents": len(self._matrices),
+                "bytes": sum(matrix.nbytes for matrix in self._matrices.values()),
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,252 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label set: counts per bucket (non-cumulative), sum, count
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+class CallbackMetric:
+    """A gauge or counter read from existing state (cache stats, queue depth) at scrape time."""
+    
+    def __init__(self, name: str, help: str, kind: str, labels: Sequence[str], read: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.read = read
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.read()
+        except Exception as e:
+            logger.warning(f"Could not read metric {self.name}: {str(e)}")
+            return lines
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+    
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_seconds", "Time spent in each stage of handling a request, excluding nested stages.", ["stage"]
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "rag_request_seconds", "End-to-end time of traced requests.", ["kind"]
+))
+REQUESTS = REGISTRY.register(Counter(
+    "rag_requests_total", "Traced requests by outcome.", ["kind", "outcome"]
+))
+MODEL_TOKENS = REGISTRY.register(Counter(
+    "rag_model_tokens_total", "Tokens sent to and received from models.", ["model", "kind"]
+))
+
+def register_callback(name: str, help: str, read: Callable[[], Dict[Tuple[str, ...], float]], kind: str = "gauge", labels: Sequence[str] = ()):
+    REGISTRY.register(CallbackMetric(name, help, kind, labels, read))
+
+class Trace:
+    """Timings of one request (a question, an upload), summed per stage."""
+    
+    def __init__(self, kind: str, fields: Dict[str, object]):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.outcome = "ok"
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+    
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+    
+    def to_dict(self) -> Dict[str, object]:
+        with self._lock:
+            stages = {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+        return {
+            "trace": self.id,
+            "kind": self.kind,
+            **self.fields,
+            "outcome": self.outcome,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages_ms": stages
+        }
+
+class _Span:
+    def __init__(self, stage: str, parent: Optional["_Span"]):
+        self.stage = stage
+        self.parent = parent
+        self.nested = 0.0
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[_Span]] = contextvars.ContextVar("current_span", default=None)
+
+def record(stage: str, seconds: float):
+    """Record time spent in a stage, for the histograms and the current trace."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    current = _current_trace.get()
+    if current is not None:
+        current.add(stage, seconds)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a block as a stage. Time spent in spans nested inside it is counted only once, by the inner span."""
+    parent = _current_span.get()
+    current = _Span(stage, parent)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_span.reset(token)
+        if parent is not None:
+            parent.nested += elapsed
+        record(stage, max(0.0, elapsed - current.nested))
+
+def timed(items: Iterable[T], stage: str) -> Iterator[T]:
+    """Iterate, counting only the time spent producing each item as stage."""
+    iterator = iter(items)
+    while True:
+        with span(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+@contextmanager
+def trace(kind: str, **fields) -> Iterator[Trace]:
+    """Trace one request: spans inside it, including in threads started with asyncio.to_thread, add to it."""
+    current = Trace(kind, fields)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    except BaseException:
+        current.outcome = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        REQUEST_SECONDS.observe(time.perf_counter() - current.started, kind=kind)
+        REQUESTS.inc(kind=kind, outcome=current.outcome)
+        if Config.TRACE_LOG:
+            logger.info(f"Trace {json.dumps(current.to_dict())}")
+
+def set_outcome(outcome: str):
+    """Set the current trace's outcome, e.g. for errors a handler reports to the user instead of raising."""
+    current = _current_trace.get()
+    if current is not None:
+        current.outcome = outcome
+
+def count_tokens(model: str, kind: str, tokens: int):
+    MODEL_TOKENS.inc(tokens, model=model, kind=kind)
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve REGISTRY on /metrics from a background thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+        
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+    
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
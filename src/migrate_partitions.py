@@ -0,0 +1,96 @@
+"""Copy vectors from the legacy single `documents` collection into partitioned collections.
+
+Run from the project root, pointing CHROMA_DIR at the store to migrate:
+
+    python -m src.migrate_partitions --strategy user
+    python -m src.migrate_partitions --strategy shard --shards 32 --delete-source
+
+The copy uses upserts with the original ids, so an interrupted run can simply
+be started again. Switch CHROMA_PARTITIONING to the same strategy afterwards.
+"""
+import argparse
+import logging
+from collections import Counter
+from typing import Dict
+import chromadb
+from config.config import Config, configure_logging
+from .partitioning import PartitionStrategy, make_partition_strategy
+
+logger = logging.getLogger(__name__)
+
+def migrate(
+    client,
+    strategy: PartitionStrategy,
+    source_name: str = "documents",
+    batch_size: int = 500,
+    delete_source: bool = False
+) -> Dict[str, int]:
+    """Copy every vector in source_name to its collection under strategy.
+    
+    Returns the number of vectors written per target collection.
+    """
+    source = client.get_collection(source_name)
+    total = source.count()
+    logger.info(f"Migrating {total} vectors from '{source_name}' using '{strategy.name}' partitioning")
+    
+    collections = {}
+    written: Counter = Counter()
+    offset = 0
+    while offset < total:
+        batch = source.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=batch_size,
+            offset=offset
+        )
+        if not batch["ids"]:
+            break
+        
+        groups: Dict[str, Dict[str, list]] = {}
+        for item_id, embedding, text, metadata in zip(
+            batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"]
+        ):
+            name = strategy.collection_name(metadata["user_id"], metadata["document_id"])
+            group = groups.setdefault(name, {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+            group["ids"].append(item_id)
+            group["embeddings"].append(embedding)
+            group["documents"].append(text)
+            group["metadatas"].append(metadata)
+        
+        for name, group in groups.items():
+            if name == source_name:
+                continue
+            if name not in collections:
+                collections[name] = client.get_or_create_collection(
+                    name=name,
+                    metadata={"hnsw:space": "cosine"}
+                )
+            collections[name].upsert(**group)
+            written[name] += len(group["ids"])
+        
+        offset += len(batch["ids"])
+        logger.info(f"Migrated {offset}/{total} vectors")
+    
+    if delete_source and sum(written.values()) == total:
+        client.delete_collection(source_name)
+        logger.info(f"Deleted source collection '{source_name}'")
+    
+    return dict(written)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--strategy", required=True, choices=["user", "document", "shard"])
+    parser.add_argument("--shards", type=int, default=Config.CHROMA_SHARDS)
+    parser.add_argument("--chroma-dir", default=Config.CHROMA_DIR)
+    parser.add_argument("--source", default="documents", help="Collection to migrate from")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--delete-source", action="store_true", help="Drop the source collection when done")
+    args = parser.parse_args()
+    
+    configure_logging()
+    client = chromadb.PersistentClient(path=args.chroma_dir)
+    strategy = make_partition_strategy(args.strategy, args.shards)
+    written = migrate(client, strategy, args.source, args.batch_size, args.delete_source)
+    logger.info(f"Migration finished: {sum(written.values())} vectors into {len(written)} collections")
+
+if __name__ == "__main__":
+    main()
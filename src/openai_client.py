@@ -0,0 +1,314 @@
+"""Shared access to the OpenAI API: clients, client-side rate limits and request coalescing.
+
+Every OpenAI call goes through here. Requests and tokens per minute are
+limited per kind of call (embedding, chat) with token buckets, so bursts
+are smoothed out before they turn into 429s. Calls come in two lanes:
+interactive ones (a user's question) may use the whole budget, while bulk
+ones (ingestion embeddings, conversation summaries) leave
+OPENAI_INTERACTIVE_SHARE of it free, so questions never queue behind a
+large upload. Identical embedding requests in flight at the same time are
+sent once.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from config.config import Config
+from .metrics import span
+from .tokenizer import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# Buckets hold this many seconds of budget, so short bursts go out at once
+BURST_SECONDS = 10.0
+# Longest a bulk call sleeps before checking the buckets again
+MAX_POLL_SECONDS = 0.5
+
+class TokenBucket:
+    """A budget refilled continuously at per_minute / 60 units a second, up to capacity."""
+    
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+    
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float, floor: float = 0.0) -> float:
+        """Seconds until taking amount would leave at least floor."""
+        amount = min(amount, self.capacity - floor)
+        missing = amount + floor - self.level
+        return missing / self.rate if missing > 0 else 0.0
+    
+    def take(self, amount: float):
+        # The level may go negative: the debt delays whoever comes next
+        self.level -= min(amount, self.capacity)
+
+class RateLimiter:
+    """Request and token buckets for one kind of OpenAI call, with interactive and bulk lanes.
+    
+    Interactive calls take their share straight away and wait out any debt,
+    in arrival order. Bulk calls only go when the buckets would keep
+    interactive_share of their capacity, so they yield to interactive ones.
+    """
+    
+    def __init__(self, name: str, rpm: int, tpm: int, interactive_share: float):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.interactive_share = interactive_share
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _try_acquire(self, tokens: int, lane: str) -> Tuple[bool, float]:
+        """Take the budget for a call if its lane may; returns (taken, seconds to wait)."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return False, self.paused_until - now
+            costs = [(bucket, amount) for bucket, amount in ((self.requests, 1), (self.tokens, tokens)) if bucket]
+            for bucket, _ in costs:
+                bucket.refill(now)
+            if lane == BULK:
+                wait = max(
+                    (bucket.wait_time(amount, bucket.capacity * self.interactive_share) for bucket, amount in costs),
+                    default=0.0
+                )
+                if wait > 0:
+                    return False, wait
+            for bucket, amount in costs:
+                bucket.take(amount)
+            return True, max((bucket.wait_time(0) for bucket, _ in costs), default=0.0)
+    
+    def acquire(self, tokens: int, lane: str = BULK):
+        """Block until a call costing tokens may be sent."""
+        with span("rate_limit"):
+            while True:
+                taken, wait = self._try_acquire(tokens, lane)
+                if taken:
+                    if wait > 0:
+                        time.sleep(wait)
+                    return
+                # Interactive calls may take the budget meanwhile, so check again
+                time.sleep(min(wait, MAX_POLL_SECONDS))
+    
+    async def aacquire(self, tokens: int, lane: str = INTERACTIVE):
+        """Wait, without blocking the event loop, until a call costing tokens may be sent."""
+        with span("rate_limit"):
+            while True:
+                taken, wait = self._try_acquire(tokens, lane)
+                if taken:
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    return
+                await asyncio.sleep(min(wait, MAX_POLL_SECONDS))
+    
+    def pause(self, seconds: float):
+        """Hold every call after the API answered 429 anyway, e.g. because another client shares the key."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        logger.warning(f"OpenAI {self.name} rate limit hit, pausing calls for {seconds:.1f}s")
+
+class SingleFlight:
+    """Merges concurrent calls with the same key into one: later callers wait for the first's result."""
+    
+    def __init__(self):
+        self.merged = 0
+        self._calls: Dict[Any, Future] = {}
+        self._tasks: Dict[Tuple[int, Any], asyncio.Task] = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key: Any, call: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.merged += 1
+        if not leader:
+            return future.result()
+        try:
+            result = call()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+    
+    async def ado(self, key: Any, call: Callable[[], Awaitable[Any]]) -> Any:
+        # Tasks belong to one event loop; webhook workers and benchmarks may run several in turn
+        task_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            if task is None:
+                task = self._tasks[task_key] = asyncio.ensure_future(call())
+                task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+            else:
+                self.merged += 1
+        # A caller that gives up must not cancel the call for the others
+        return await asyncio.shield(task)
+
+_client = None
+# Async clients pool their connections per event loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+_limiters: Dict[str, RateLimiter] = {}
+_lock = threading.Lock()
+embedding_flights = SingleFlight()
+
+def get_client():
+    """The shared synchronous client, created on first use: openai is slow to import."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import openai
+                # No SDK retries: they would bypass the limiter and its 429 pause, and
+                # multiply with EmbeddingPipeline's; chat() and aembed() retry themselves
+                _client = openai.OpenAI(api_key=Config.OPENAI_API_KEY, max_retries=0)
+    return _client
+
+def get_async_client():
+    """The async client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import openai
+        # No SDK retries, as for the synchronous client
+        client = _async_clients[loop] = openai.AsyncOpenAI(api_key=Config.OPENAI_API_KEY, max_retries=0)
+    return client
+
+def get_limiter(kind: str) -> RateLimiter:
+    """The process-wide limiter for "embedding" or "chat" calls."""
+    limiter = _limiters.get(kind)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(kind)
+            if limiter is None:
+                if kind == "embedding":
+                    rpm, tpm = Config.OPENAI_EMBEDDING_RPM, Config.OPENAI_EMBEDDING_TPM
+                else:
+                    rpm, tpm = Config.OPENAI_CHAT_RPM, Config.OPENAI_CHAT_TPM
+                limiter = _limiters[kind] = RateLimiter(kind, rpm, tpm, Config.OPENAI_INTERACTIVE_SHARE)
+    return limiter
+
+def reset_limiters():
+    """Drop the limiters, so they are rebuilt from the current Config values."""
+    with _lock:
+        _limiters.clear()
+
+def _on_error(limiter: RateLimiter, error: Exception):
+    import openai
+    
+    if isinstance(error, openai.RateLimitError):
+        try:
+            retry_after = float(error.response.headers.get("retry-after", 1))
+        except (AttributeError, TypeError, ValueError):
+            retry_after = 1.0
+        limiter.pause(retry_after)
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors and connection problems are worth retrying."""
+    import openai
+    
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+def _backoff(attempt: int) -> float:
+    # A 429 also pauses the limiter for its retry-after, which acquire waits out
+    return min(8.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+
+def count_text_tokens(texts: Sequence[str]) -> int:
+    tokenizer = get_tokenizer()
+    return sum(len(tokenizer.encode(text)) for text in texts)
+
+def _chat_tokens(limiter: RateLimiter, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> int:
+    if limiter.tokens is None:
+        return 0
+    # OpenAI counts max_tokens against the token limit when a request arrives
+    return count_text_tokens([message["content"] for message in messages]) + (max_tokens or 0)
+
+def embed(model: str, texts: Sequence[str], lane: str = BULK) -> List[List[float]]:
+    """Embed texts in one request, in input order."""
+    texts = list(texts)
+    
+    def call() -> List[List[float]]:
+        limiter = get_limiter("embedding")
+        limiter.acquire(count_text_tokens(texts) if limiter.tokens else 0, lane)
+        try:
+            response = get_client().embeddings.create(model=model, input=texts)
+        except Exception as e:
+            _on_error(limiter, e)
+            raise
+        # The API tags each item with its input index; don't rely on order
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    
+    return embedding_flights.do((model, tuple(texts)), call)
+
+async def aembed(model: str, text: str, lane: str = INTERACTIVE) -> List[float]:
+    """Embed one text without blocking the event loop."""
+    async def call() -> List[float]:
+        limiter = get_limiter("embedding")
+        tokens = count_text_tokens([text]) if limiter.tokens else 0
+        attempt = 0
+        while True:
+            await limiter.aacquire(tokens, lane)
+            try:
+                response = await get_async_client().embeddings.create(model=model, input=text)
+                return response.data[0].embedding
+            except Exception as e:
+                _on_error(limiter, e)
+                if attempt >= Config.OPENAI_MAX_RETRIES or not is_retryable(e):
+                    raise
+            attempt += 1
+            await asyncio.sleep(_backoff(attempt))
+    
+    return await embedding_flights.ado((model, text), call)
+
+def chat(messages: List[Dict[str, str]], lane: str = INTERACTIVE, **kwargs):
+    """Create a chat completion; kwargs are passed to the API."""
+    limiter = get_limiter("chat")
+    tokens = _chat_tokens(limiter, messages, kwargs.get("max_tokens"))
+    attempt = 0
+    while True:
+        limiter.acquire(tokens, lane)
+        try:
+            return get_client().chat.completions.create(messages=messages, **kwargs)
+        except Exception as e:
+            _on_error(limiter, e)
+            if attempt >= Config.OPENAI_MAX_RETRIES or not is_retryable(e):
+                raise
+        attempt += 1
+        time.sleep(_backoff(attempt))
+
+async def achat(messages: List[Dict[str, str]], lane: str = INTERACTIVE, **kwargs):
+    """Create a chat completion (or a stream, with stream=True) without blocking the event loop."""
+    limiter = get_limiter("chat")
+    tokens = _chat_tokens(limiter, messages, kwargs.get("max_tokens"))
+    attempt = 0
+    while True:
+        await limiter.aacquire(tokens, lane)
+        try:
+            return await get_async_client().chat.completions.create(messages=messages, **kwargs)
+        except Exception as e:
+            _on_error(limiter, e)
+            if attempt >= Config.OPENAI_MAX_RETRIES or not is_retryable(e):
+                raise
+        attempt += 1
+        await asyncio.sleep(_backoff(attempt))
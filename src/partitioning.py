@@ -0,0 +1,102 @@
+import hashlib
+import re
+import zlib
+from typing import Dict, Optional
+from config.config import Config
+
+# Collections created before embedding models were selectable hold ada-002 vectors
+LEGACY_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+class PartitionStrategy:
+    """Decides which Chroma collection holds a document's vectors."""
+    
+    name = "global"
+    # Whether queries must still filter on document_id inside the collection
+    filters_by_document = True
+    
+    def collection_name(self, user_id: str, document_id: str) -> str:
+        raise NotImplementedError
+    
+    def where(self, document_id: str) -> Optional[Dict]:
+        """Metadata filter that restricts a query to one document, if needed."""
+        if not self.filters_by_document:
+            return None
+        return {"document_id": {"$eq": document_id}}
+    
+    @staticmethod
+    def _safe_name(prefix: str, key: str) -> str:
+        # Chroma names allow 3-63 chars of [A-Za-z0-9._-] starting and ending alphanumeric
+        cleaned = re.sub(r"[^A-Za-z0-9_-]", "-", key)
+        name = f"{prefix}-{cleaned}"
+        if len(name) > 63 or not name[-1].isalnum():
+            name = f"{prefix}-{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+        return name
+
+class GlobalPartition(PartitionStrategy):
+    """Every vector in the single legacy `documents` collection."""
+    
+    name = "global"
+    
+    def collection_name(self, user_id: str, document_id: str) -> str:
+        return "documents"
+
+class UserPartition(PartitionStrategy):
+    """One collection per user; queries still filter on the document."""
+    
+    name = "user"
+    
+    def collection_name(self, user_id: str, document_id: str) -> str:
+        return self._safe_name("user", user_id)
+
+class DocumentPartition(PartitionStrategy):
+    """One collection per document; queries need no metadata filter."""
+    
+    name = "document"
+    filters_by_document = False
+    
+    def collection_name(self, user_id: str, document_id: str) -> str:
+        return self._safe_name("doc", document_id)
+
+class ShardedPartition(PartitionStrategy):
+    """Documents hashed into a fixed number of shard collections."""
+    
+    name = "shard"
+    
+    def __init__(self, shards: int):
+        if shards < 1:
+            raise ValueError("Number of shards must be at least 1")
+        self.shards = shards
+    
+    def collection_name(self, user_id: str, document_id: str) -> str:
+        digest = hashlib.sha1(document_id.encode("utf-8")).digest()
+        return f"shard-{int.from_bytes(digest[:8], 'big') % self.shards:04d}"
+
+def model_collection_name(name: str, model: str) -> str:
+    """Scope a collection name to an embedding model so vectors of different sizes never mix."""
+    if model == LEGACY_EMBEDDING_MODEL:
+        return name
+    suffix = hashlib.sha1(model.encode("utf-8")).hexdigest()[:8]
+    return f"{name[:63 - len(suffix) - 1]}-{suffix}"
+
+def make_partition_strategy(name: str, shards: int = 16) -> PartitionStrategy:
+    """Build a strategy from its config name: global, user, document or shard."""
+    if name == "global":
+        return GlobalPartition()
+    if name == "user":
+        return UserPartition()
+    if name == "document":
+        return DocumentPartition()
+    if name == "shard":
+        return ShardedPartition(shards)
+    raise ValueError(f"Unknown Chroma partitioning strategy: {name}")
+
+def partition_for(user_id: str, partitions: int) -> int:
+    """The partition, out of partitions, whose bot worker handles a user's updates and documents."""
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(user_id.encode("utf-8")) % partitions
+
+def owns_user(user_id: str, partition: Optional[int]) -> bool:
+    """Whether the bot worker for partition handles a user's work; with no partition (polling mode), every user's."""
+    if partition is None:
+        return True
+    return partition_for(user_id, Config.BOT_WORKERS) == partition
@@ -1,37 +1,308 @@
-import openai
-from typing import List
+import logging
+import re
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from config.config import Config
+from .context_builder import ContextBuilder
+from .document_store import Section
+from .metrics import count_tokens, record, span
+from .openai_client import BULK, achat, chat, get_client
+from .session_store import UserSession
+from .tokenizer import get_tokenizer
+from .vector_store import RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+# Words asking for a summary
+SUMMARY_TERMS = (
+    r"summar(y|ies|ise|ize)|overview|outline|tl;?dr|gist|recap"
+    r"|(main|key) (points?|ideas?|topics?|themes?|takeaways?|arguments?|findings?)"
+)
+SUMMARY_TERMS_RE = re.compile(rf"\b({SUMMARY_TERMS})", re.I)
+# Questions about a whole document or section rather than a detail of it
+BROAD_RE = re.compile(rf"\b({SUMMARY_TERMS}|what('s| is| are)\b.*\babout\s*\??\s*$)", re.I)
+# The documents themselves as the subject of a question: "this paper", "all my files"
+DOCUMENT_RE = re.compile(
+    r"\b(this|these|the|my|each|every|all( of)?( the| my)?)\s+((whole|entire)\s+)?"
+    r"(documents?|files?|pdfs?|papers?|books?|texts?|articles?|reports?|notes|uploads?)\b",
+    re.I
+)
+# How a summary should be written, which names no subject: "in 3 bullet points"
+FORMAT_RE = re.compile(
+    r"\b(in|as|with)\s+(\d+|one|two|three|four|five|a few|a couple of|a|an)?\s*"
+    r"(short |brief )?(bullet points?|bullets|sentences?|paragraphs?|lines?|words|list)\b",
+    re.I
+)
+# Words left in a broad question that don't name a subject of their own
+FILLER_WORDS = frozenset(
+    "a an the and of on for to in me us i we you it its it's this that these those they them their "
+    "please can could would will should give write provide make show tell want need do does "
+    "what what's whats is are was about short brief quick detailed high level"
+    .split()
+)
+# "chapter 2", "section 3.1"
+SECTION_REF_RE = re.compile(r"\b(?:chapter|section|part|unit|lecture|lesson)\s+(\d+(?:\.\d+)*)\b", re.I)
+# The number a section's title starts with: "Chapter 2.1 ...", "2. Methods"
+TITLE_NUMBER_RE = re.compile(r"^(?:(?:chapter|section|part|unit|lecture|lesson)\s+)?(\d+(?:\.\d+)*)\b", re.I)
 
 class QueryEngine:
     def __init__(self):
-        openai.api_key = Config.OPENAI_API_KEY
+        self.context_builder = ContextBuilder()
     
-    def generate_response(self, query: str, context_chunks: List[str]) -> str:
-        """Generate a response using GPT-4 with context."""
+    def warm_up(self):
+        """Create the OpenAI client and load the tokenizer ahead of the first question."""
+        get_client()
+        get_tokenizer()
+    
+    @property
+    def tokenizer(self):
+        return get_tokenizer()
+    
+    def build_context(self, candidates: List[RetrievedChunk], max_tokens: Optional[int] = None) -> List[str]:
+        """Merge, deduplicate and pack retrieved chunks into the prompt's token budget, or max_tokens."""
+        with span("context"):
+            return self.context_builder.build(candidates, max_tokens)
+    
+    @staticmethod
+    def is_broad(query: str) -> bool:
+        """Whether a question asks for a summary of a document or section, answered from its summaries."""
+        return bool(BROAD_RE.search(query))
+    
+    @staticmethod
+    def targets_documents(query: str) -> bool:
+        """Whether a broad question is about the documents as a whole rather than a subject in them.
+        
+        It is when it names them ("this paper", "all my files") or names nothing
+        besides the summary it asks for ("Summarize", "What is it about?");
+        "an overview of gradient descent" or "the summary statistic in table 4"
+        name a subject, which retrieval finds better than the summaries.
+        """
+        if DOCUMENT_RE.search(query):
+            return True
+        rest = FORMAT_RE.sub(" ", SUMMARY_TERMS_RE.sub(" ", query))
+        return all(word in FILLER_WORDS for word in re.findall(r"[\w']+", rest.lower()))
+    
+    def find_sections(self, query: str, sections: List[Section]) -> Optional[List[Section]]:
+        """The sections a question refers to by number or title; [] for none, None for a reference that matches nothing."""
+        match = SECTION_REF_RE.search(query)
+        if match:
+            number = match.group(1)
+            numbered = [(TITLE_NUMBER_RE.match(section.title), section) for section in sections]
+            found = [
+                section for title_number, section in numbered
+                if title_number and (title_number.group(1) == number or title_number.group(1).startswith(number + "."))
+            ]
+            if not found and not any(title_number for title_number, _ in numbered) and number.isdigit():
+                # Untitled numbering: "chapter 2" is the second section
+                index = int(number) - 1
+                found = sections[index:index + 1] if index >= 0 else []
+            return found or None
+        
+        lowered = query.lower()
+        return [section for section in sections if len(section.title) >= 4 and section.title.lower() in lowered]
+    
+    def summary_context(
+        self,
+        query: str,
+        sections: List[Section],
+        document_summary: Optional[str]
+    ) -> Optional[List[str]]:
+        """Context for a broad question from a document's precomputed summaries, or None to retrieve chunks instead.
+        
+        A question about particular sections gets their summaries; one about the
+        whole document gets its summary and as many section summaries as fit
+        CONTEXT_MAX_TOKENS. Questions about some other subject, and those whose
+        summaries aren't written yet, fall back to retrieval.
+        """
+        if not self.is_broad(query) or not sections:
+            return None
+        found = self.find_sections(query, sections)
+        if found is None:
+            return None
+        if found:
+            if any(section.summary is None for section in found):
+                return None
+            return [f"Summary of {section.title}:\n{section.summary}" for section in found]
+        
+        if document_summary is None or not self.targets_documents(query):
+            return None
+        context = [f"Summary of the document:\n{document_summary}"]
+        used = len(self.tokenizer.encode(context[0]))
+        for section in sections:
+            if section.summary is None:
+                continue
+            text = f"Summary of {section.title}:\n{section.summary}"
+            tokens = len(self.tokenizer.encode(text))
+            if used + tokens > Config.CONTEXT_MAX_TOKENS:
+                break
+            context.append(text)
+            used += tokens
+        return context
+    
+    def library_summary_context(self, query: str, summaries: List[Tuple[str, Optional[str]]]) -> Optional[List[str]]:
+        """Context for a broad question about several documents as a whole from their (name, summary) pairs, or None."""
+        if not self.is_broad(query) or SECTION_REF_RE.search(query) or not self.targets_documents(query):
+            return None
+        if not summaries or any(summary is None for _, summary in summaries):
+            return None
+        return [f"[{name}]\n{summary}" for name, summary in summaries]
+    
+    def build_messages(
+        self,
+        query: str,
+        context_chunks: List[str],
+        history: Optional[List[Dict[str, str]]] = None
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for a question, its context and earlier conversation."""
         # Combine context chunks
         context = "\n\n".join(context_chunks)
         
-        # Create the system and user messages
-        messages = [
+        # Create the system and user messages, with earlier turns in between
+        return [
             {
                 "role": "system",
                 "content": "You are a helpful assistant that answers questions based on the provided context. "
                           "Always format your responses in Markdown. "
                           "If you cannot answer the question based on the context, say so and use general knowledge to answer the question. "
+                          "If passages are labelled with [document names], mention which documents your answer draws on. "
             },
+            *(history or []),
             {
                 "role": "user",
                 "content": f"Context:\n{context}\n\nQuestion: {query}\n\n"
                           "Please answer the question based on the context provided."
             }
         ]
+    
+    def generate_response(
+        self,
+        query: str,
+        context_chunks: List[str],
+        history: Optional[List[Dict[str, str]]] = None
+    ) -> str:
+        """Generate a response using GPT-4 with context."""
+        messages = self.build_messages(query, context_chunks, history)
         
         # Get response from GPT-4
-        response = openai.chat.completions.create(
-            model=Config.GPT_MODEL,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        return response.choices[0].message.content 
\ No newline at end of file
+        with span("generate"):
+            response = chat(
+                messages,
+                model=Config.GPT_MODEL,
+                temperature=0.7,
+                max_tokens=Config.ANSWER_MAX_TOKENS
+            )
+        self.count_usage(response.usage)
+        
+        return response.choices[0].message.content
+    
+    async def stream_response(
+        self,
+        query: str,
+        context_chunks: List[str],
+        history: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[str]:
+        """Stream a response as it is generated, yielding text deltas."""
+        messages = self.build_messages(query, context_chunks, history)
+        
+        # Only time spent waiting on the model counts as generation, not the
+        # caller's work between deltas
+        started = time.perf_counter()
+        waited = 0.0
+        answer = []
+        try:
+            stream = await achat(
+                messages,
+                model=Config.GPT_MODEL,
+                temperature=0.7,
+                max_tokens=Config.ANSWER_MAX_TOKENS,
+                stream=True
+            )
+            
+            async for chunk in stream:
+                waited += time.perf_counter() - started
+                if chunk.choices and chunk.choices[0].delta.content:
+                    answer.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+                started = time.perf_counter()
+            waited += time.perf_counter() - started
+        finally:
+            record("generate", waited)
+            # Streamed responses carry no usage, so count with the local tokenizer
+            count_tokens(Config.GPT_MODEL, "prompt", self.count_tokens(messages))
+            count_tokens(Config.GPT_MODEL, "completion", len(self.tokenizer.encode("".join(answer))))
+    
+    def history_messages(self, session: UserSession) -> List[Dict[str, str]]:
+        """The session's conversation as chat messages: its summary, then recent turns."""
+        messages = []
+        if session.summary:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{session.summary}"
+            })
+        messages.extend(session.history)
+        return messages
+    
+    def count_tokens(self, turns: List[Dict[str, str]]) -> int:
+        return sum(len(self.tokenizer.encode(turn["content"])) for turn in turns)
+    
+    async def remember(self, session: UserSession, query: str, answer: str):
+        """Add a question and its answer to the session, keeping history within HISTORY_MAX_TOKENS.
+        
+        The oldest turns are evicted first and folded into the session's
+        running summary, so the prompt stays the same size however long the
+        conversation runs.
+        """
+        session.history.extend([
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": answer}
+        ])
+        
+        evicted = []
+        while len(session.history) > 2 and self.count_tokens(session.history) > Config.HISTORY_MAX_TOKENS:
+            evicted.extend(session.history[:2])
+            del session.history[:2]
+        
+        # A single turn over the budget keeps the question and the start of its answer
+        overflow = self.count_tokens(session.history) - Config.HISTORY_MAX_TOKENS
+        if overflow > 0:
+            tokens = self.tokenizer.encode(session.history[-1]["content"])
+            session.history[-1]["content"] = self.tokenizer.decode(tokens[:max(0, len(tokens) - overflow)])
+        
+        if evicted and Config.HISTORY_SUMMARY_TOKENS > 0:
+            try:
+                session.summary = await self.summarize(session.summary, evicted)
+            except Exception as e:
+                # Losing old turns is better than failing the answer already sent
+                logger.warning(f"Could not summarize conversation for user {session.user_id}: {str(e)}")
+    
+    async def summarize(self, summary: str, turns: List[Dict[str, str]]) -> str:
+        """Fold turns into a conversation summary of at most HISTORY_SUMMARY_TOKENS."""
+        transcript = "\n\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        with span("summarize"):
+            # Summaries are written after the answer is sent, so they can wait behind questions
+            response = await achat(
+                lane=BULK,
+                model=Config.GPT_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You maintain a short summary of a conversation about a document. "
+                                  "Keep the facts, names and numbers the user may refer back to. "
+                                  "Reply with the updated summary only."
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Current summary:\n{summary or '(empty)'}\n\nNew turns:\n{transcript}"
+                    }
+                ],
+                temperature=0,
+                max_tokens=Config.HISTORY_SUMMARY_TOKENS
+            )
+        self.count_usage(response.usage)
+        return response.choices[0].message.content.strip()
+    
+    @staticmethod
+    def count_usage(usage):
+        if usage is not None:
+            count_tokens(Config.GPT_MODEL, "prompt", usage.prompt_tokens)
+            count_tokens(Config.GPT_MODEL, "completion", usage.completion_tokens)
@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from typing import Iterable, Iterator, List, Optional
+from config.config import Config
+from .context_builder import merge_overlapping
+from .document_processor import DocumentProcessor
+from .document_store import Document, ReindexCheckpoint
+from .metrics import trace
+from .openai_client import TokenBucket
+from .partitioning import owns_user
+from .summarizer import SectionIndexer
+from .vector_store import VectorStore, current_index_params, index_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Longest stop() waits for a write in progress to reach its next checkpoint
+STOP_TIMEOUT = 30.0
+# Stored chunks read at a time when rebuilding a document without its original
+READ_BATCH = 64
+
+class ReindexStopped(Exception):
+    """Raised inside a re-indexing write when the re-indexer is stopped; the checkpoint is kept."""
+
+class Reindexer:
+    """Rebuilds the vectors of documents indexed with other chunking or embedding settings.
+    
+    A document is stale when its fingerprint no longer matches its content
+    under the current CHUNK_SIZE, CHUNK_OVERLAP and EMBEDDING_MODEL; the
+    others are left alone. Stale documents are re-chunked from their original
+    uploads, or from the text of their stored chunks where the upload store
+    no longer keeps the original, one at a time and at most chunks_per_minute
+    chunks a minute, into vectors under a new id. Until the swap to them,
+    queries keep using the old vectors (with the old embedding model if it
+    changed), and the old vectors are deleted retire_seconds after it.
+    Progress is checkpointed per embedding group, so a restart resumes where
+    it stopped. Rebuilt documents get new sections, which the summarizer, if
+    given, summarizes again.
+    """
+    
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        document_processor: DocumentProcessor,
+        ingestion,
+        chunks_per_minute: Optional[int] = None,
+        retire_seconds: Optional[float] = None,
+        summarizer=None
+    ):
+        self.vector_store = vector_store
+        self.document_processor = document_processor
+        # Shares the ingestion queue's parser processes
+        self.ingestion = ingestion
+        self.chunks_per_minute = Config.REINDEX_CHUNKS_PER_MINUTE if chunks_per_minute is None else chunks_per_minute
+        self.retire_seconds = Config.REINDEX_RETIRE_SECONDS if retire_seconds is None else retire_seconds
+        self.summarizer = summarizer
+        # Set by webhook workers: each re-indexes the documents of its own users
+        self.partition: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.counts = {"reindexed": 0, "failed": 0, "skipped": 0}
+        self._stopping = threading.Event()
+        # Whether a thread is writing chunks, which cancelling the task would not stop
+        self._writing = False
+    
+    @property
+    def document_store(self):
+        return self.vector_store.document_store
+    
+    async def start(self):
+        """Re-index stale documents in a background task."""
+        if self.task is None:
+            self._stopping.clear()
+            self.task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        if self.task is None:
+            return
+        self._stopping.set()
+        if self._writing:
+            # Let the thread store its group and checkpoint, so a restart doesn't race it
+            await asyncio.wait({self.task}, timeout=STOP_TIMEOUT)
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+    
+    def stale_documents(self, after: str = "", limit: int = 100) -> List[Document]:
+        """The next page of this process's documents whose vectors need rebuilding, by doc_id."""
+        stale = []
+        while not stale:
+            owners = self.document_store.list_vector_owners(after, limit)
+            if not owners:
+                break
+            after = owners[-1].doc_id
+            for document in owners:
+                if not owns_user(document.user_id, self.partition):
+                    continue
+                if document.fingerprint is None:
+                    # Indexed before settings were recorded: nothing says they differ
+                    self._record_settings(document)
+                elif document.fingerprint != index_fingerprint(document.content_hash):
+                    stale.append(document)
+                elif document.index_params is None:
+                    self._record_settings(document)
+        return stale
+    
+    def _record_settings(self, document: Document):
+        """Record the current settings on a document indexed before they were recorded."""
+        content_hash = document.content_hash
+        if content_hash is None:
+            data = self.ingestion.uploads.load(document.user_id, document.doc_id, document.name)
+            if data is None:
+                return
+            content_hash = hashlib.sha256(data).hexdigest()
+        self.document_store.repoint_vectors(
+            document.doc_id, document.vector_document_id, document.vector_document_id,
+            index_fingerprint(content_hash), current_index_params(), document.chunk_count, content_hash
+        )
+    
+    def stored_text(self, document: Document) -> Iterator[str]:
+        """A document's text rebuilt from its stored chunks, each piece without the overlap it repeats."""
+        previous = ""
+        for batch in range(0, document.chunk_count, READ_BATCH):
+            for chunk in self.vector_store.chunk_texts(document, batch, min(batch + READ_BATCH, document.chunk_count)):
+                yield merge_overlapping(previous, chunk)[len(previous):] if previous else chunk
+                previous = chunk
+    
+    async def run(self):
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(self.vector_store.delete_retired_vectors)
+            after = ""
+            while True:
+                documents = await asyncio.to_thread(self.stale_documents, after)
+                if not documents:
+                    break
+                after = documents[-1].doc_id
+                for document in documents:
+                    await self.reindex(document)
+            if any(self.counts.values()):
+                logger.info(f"Re-indexing finished in {time.monotonic() - started:.1f}s: {self.counts}")
+            
+            # Delete the replaced vectors once no search can still be using them
+            while True:
+                retired = await asyncio.to_thread(self.document_store.retired_vectors)
+                if not retired:
+                    break
+                await asyncio.sleep(max(0.0, retired[0][3] - time.time()))
+                await asyncio.to_thread(self.vector_store.delete_retired_vectors)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Re-indexing stopped: {str(e)}")
+    
+    async def reindex(self, document: Document) -> bool:
+        """Rebuild one document's vectors with the current settings and swap them in."""
+        data = await asyncio.to_thread(self.ingestion.uploads.load, document.user_id, document.doc_id, document.name)
+        if data is None and not document.chunk_count:
+            logger.warning(f"Cannot re-index document {document.doc_id}: neither its original nor its chunks are kept")
+            self.counts["skipped"] += 1
+            return False
+        
+        with trace("reindex", user=document.user_id, document=document.doc_id):
+            try:
+                fingerprint = index_fingerprint(document.content_hash)
+                source = "upload" if data is not None else "chunks"
+                checkpoint, start = await asyncio.to_thread(self._checkpoint, document, fingerprint, source)
+                logger.info(
+                    f"Re-indexing document {document.doc_id} into {checkpoint.vector_document_id} from its {source}"
+                    + (f", resuming after {start} chunks" if start else "")
+                )
+                
+                def on_progress(stored: int):
+                    checkpoint.stored = stored
+                    self.document_store.save_reindex_checkpoint(checkpoint)
+                
+                if data is not None:
+                    source_chunks = self.document_processor.iter_document_chunks(
+                        data, self.ingestion.executor, file_name=document.name
+                    )
+                else:
+                    source_chunks = self.document_processor.iter_chunks(self.stored_text(document))
+                sections = SectionIndexer()
+                chunks = sections.observe(self._throttle(source_chunks, start))
+                self._writing = True
+                try:
+                    chunk_count = await asyncio.to_thread(
+                        self.vector_store.add_chunk_stream,
+                        chunks, document.user_id, checkpoint.vector_document_id, fingerprint, on_progress, start
+                    )
+                finally:
+                    self._writing = False
+                await asyncio.to_thread(
+                    self.document_store.save_sections, checkpoint.vector_document_id, sections.sections()
+                )
+                await asyncio.to_thread(
+                    self.vector_store.swap_vectors,
+                    document, checkpoint.vector_document_id, chunk_count, fingerprint, document.content_hash,
+                    self.retire_seconds
+                )
+                if self.summarizer is not None:
+                    self.summarizer.enqueue(checkpoint.vector_document_id)
+                self.counts["reindexed"] += 1
+                return True
+            except (asyncio.CancelledError, ReindexStopped):
+                logger.info(f"Re-indexing of document {document.doc_id} interrupted; it resumes on the next start")
+                raise asyncio.CancelledError()
+            except Exception as e:
+                # The checkpoint stays, so the next start resumes this document
+                logger.error(f"Error re-indexing document {document.doc_id}: {str(e)}")
+                self.counts["failed"] += 1
+                return False
+    
+    def _checkpoint(self, document: Document, fingerprint: str, source: str):
+        """The checkpoint to write document's new vectors under, and how many chunks it already holds."""
+        checkpoint = self.document_store.get_reindex_checkpoint(document.doc_id)
+        if checkpoint is not None and (
+            checkpoint.fingerprint != fingerprint or checkpoint.embedding_model != Config.EMBEDDING_MODEL
+        ):
+            # Left by a run with other settings
+            self.vector_store.delete_vectors(document.user_id, checkpoint.vector_document_id, checkpoint.embedding_model)
+            checkpoint = None
+        if checkpoint is None:
+            checkpoint = ReindexCheckpoint(
+                document.doc_id, str(uuid.uuid4()), fingerprint, Config.EMBEDDING_MODEL, 0, source
+            )
+            self.document_store.save_reindex_checkpoint(checkpoint)
+            return checkpoint, 0
+        
+        stored = self.vector_store.stored_chunks(checkpoint.vector_document_id)
+        if checkpoint.source != source or (stored is not None and stored != checkpoint.stored):
+            # Chunks cut from the other source don't line up, and the compact store can
+            # only be appended to at its end; start this document over
+            self.vector_store.delete_vectors(document.user_id, checkpoint.vector_document_id)
+            checkpoint.stored = 0
+            checkpoint.source = source
+            self.document_store.save_reindex_checkpoint(checkpoint)
+        return checkpoint, checkpoint.stored
+    
+    def _throttle(self, chunks: Iterable[str], skip: int = 0) -> Iterator[str]:
+        """Pass chunks on at most chunks_per_minute a minute, stopping when the re-indexer stops.
+        
+        The first skip chunks, already stored by an interrupted run, pass unthrottled.
+        """
+        bucket = TokenBucket(self.chunks_per_minute) if self.chunks_per_minute else None
+        for i, chunk in enumerate(chunks):
+            while bucket is not None and i >= skip:
+                bucket.refill(time.monotonic())
+                wait = bucket.wait_time(1)
+                if wait <= 0:
+                    bucket.take(1)
+                    break
+                self._stopping.wait(wait)
+                if self._stopping.is_set():
+                    break
+            if self._stopping.is_set():
+                raise ReindexStopped("Re-indexing stopped")
+            yield chunk
@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class UserSession:
+    def __init__(
+        self,
+        user_id: str,
+        active_document_id: Optional[str] = None,
+        in_chat: bool = False,
+        history: Optional[List[Dict[str, str]]] = None,
+        summary: str = "",
+        document_ids: Optional[List[str]] = None,
+        all_documents: bool = False,
+        selection: Optional[List[str]] = None
+    ):
+        self.user_id = user_id
+        self.active_document_id = active_document_id
+        self.in_chat = in_chat
+        # Recent turns as chat messages; older turns are folded into summary
+        self.history: List[Dict[str, str]] = history or []
+        self.summary = summary
+        # Chatting with several documents: the chosen ones, or all the user's documents
+        self.document_ids: List[str] = document_ids or []
+        self.all_documents = all_documents
+        # Documents ticked so far while choosing several
+        self.selection: List[str] = selection or []
+    
+    @property
+    def in_library_chat(self) -> bool:
+        return self.in_chat and (self.all_documents or bool(self.document_ids))
+    
+    def start_chat(self, document_id: Optional[str]):
+        """Switch to a document (or none) with an empty conversation."""
+        self.active_document_id = document_id
+        self.in_chat = document_id is not None
+        self.history = []
+        self.summary = ""
+        self.document_ids = []
+        self.all_documents = False
+        self.selection = []
+    
+    def start_library_chat(self, document_ids: Optional[List[str]] = None):
+        """Switch to several documents, or all of them when document_ids is None, with an empty conversation."""
+        self.start_chat(None)
+        self.in_chat = True
+        self.document_ids = list(document_ids or [])
+        self.all_documents = document_ids is None
+    
+    def to_json(self) -> str:
+        return json.dumps({
+            "active_document_id": self.active_document_id,
+            "in_chat": self.in_chat,
+            "history": self.history,
+            "summary": self.summary,
+            "document_ids": self.document_ids,
+            "all_documents": self.all_documents,
+            "selection": self.selection
+        })
+    
+    @classmethod
+    def from_json(cls, user_id: str, data: str) -> "UserSession":
+        return cls(user_id, **json.loads(data))
+
+class SessionBackend:
+    """Minimal Redis-style key-value interface: get, set with expiry, delete."""
+    
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+    
+    def set(self, key: str, value: str, ex: Optional[int] = None):
+        raise NotImplementedError
+    
+    def delete(self, key: str):
+        raise NotImplementedError
+
+class MemorySessionBackend(SessionBackend):
+    """In-process stand-in for Redis, for a single bot process or tests."""
+    
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._values[key]
+                return None
+            return value
+    
+    def set(self, key: str, value: str, ex: Optional[int] = None):
+        with self._lock:
+            self._values[key] = (value, time.time() + ex if ex else None)
+    
+    def delete(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions in a local SQLite file, shared by bot processes on the same volume."""
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or Config.SESSION_DB_PATH
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    logger.info(f"Opening session store at {self.path}")
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    conn = sqlite3.connect(self.path, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS sessions ("
+                        " key TEXT PRIMARY KEY,"
+                        " value TEXT NOT NULL,"
+                        " expires_at REAL)"
+                    )
+                    conn.commit()
+                    self._conn = conn
+        return self._conn
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM sessions WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (key, time.time())
+            ).fetchone()
+            return row[0] if row else None
+    
+    def set(self, key: str, value: str, ex: Optional[int] = None):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sessions (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ex if ex else None)
+            )
+            self.conn.commit()
+    
+    def delete(self, key: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+            self.conn.commit()
+
+class RedisSessionBackend(SessionBackend):
+    """Sessions in Redis (or anything speaking its protocol), for bots on several hosts.
+    
+    Needs the optional redis package.
+    """
+    
+    def __init__(self, url: Optional[str] = None):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("SESSION_BACKEND=redis needs the redis package: pip install redis")
+        self.client = redis.Redis.from_url(url or Config.REDIS_URL, decode_responses=True)
+    
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(key)
+    
+    def set(self, key: str, value: str, ex: Optional[int] = None):
+        self.client.set(key, value, ex=ex)
+    
+    def delete(self, key: str):
+        self.client.delete(key)
+
+def make_session_backend(name: Optional[str] = None) -> SessionBackend:
+    """Build a session backend from its config name: sqlite, redis or memory."""
+    name = name or Config.SESSION_BACKEND
+    if name == "sqlite":
+        return SQLiteSessionBackend()
+    if name == "redis":
+        return RedisSessionBackend()
+    if name == "memory":
+        return MemorySessionBackend()
+    raise ValueError(f"Unknown session backend: {name}")
+
+class SessionStore:
+    """Loads and saves user sessions through a backend, expiring idle ones after SESSION_TTL."""
+    
+    def __init__(self, backend: Optional[SessionBackend] = None, ttl: Optional[int] = None):
+        self.backend = backend or make_session_backend()
+        self.ttl = ttl or Config.SESSION_TTL
+    
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"session:{user_id}"
+    
+    def get(self, user_id: str) -> UserSession:
+        """Get a user's session, or a fresh one."""
+        try:
+            data = self.backend.get(self._key(user_id))
+        except Exception as e:
+            logger.error(f"Error loading session for user {user_id}: {str(e)}")
+            raise
+        return UserSession.from_json(user_id, data) if data else UserSession(user_id)
+    
+    def save(self, session: UserSession):
+        try:
+            self.backend.set(self._key(session.user_id), session.to_json(), ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Error saving session for user {session.user_id}: {str(e)}")
+            raise
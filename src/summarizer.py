@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from config.config import Config
+from .context_builder import merge_overlapping
+from .document_store import Document, Section
+from .metrics import count_tokens, span, trace
+from .openai_client import BULK, achat
+from .partitioning import owns_user
+from .tokenizer import get_tokenizer
+from .vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Markdown headings as rendered by DocumentProcessor, levels 1 to 3
+HEADING_RE = re.compile(r"^(#{1,3}) +(\S.*?)\s*$", re.M)
+# Chunks fetched from the vector store at a time while reading a section
+READ_BATCH = 64
+
+class SectionIndexer:
+    """Find a document's sections from the headings in its chunks as they stream past.
+    
+    Only each heading's chunk position is kept while chunks are stored;
+    sections(), once the stream is done, cuts at the shallowest heading level
+    used more than once, so a lone title heading doesn't make the whole
+    document one section. Documents without headings, such as Word files
+    read as plain text, are cut every SECTION_FALLBACK_CHUNKS chunks.
+    """
+    
+    def __init__(self):
+        # (chunk position, level, title) of each heading, in order
+        self.headings: List[Tuple[int, int, str]] = []
+        self.chunk_count = 0
+    
+    def observe(self, chunks: Iterable[str]) -> Iterator[str]:
+        """Pass chunks through, noting the headings in each."""
+        for position, chunk in enumerate(chunks):
+            for match in HEADING_RE.finditer(chunk):
+                heading = (len(match.group(1)), match.group(2)[:200])
+                # Chunks repeat the end of the previous one, headings included
+                if self.headings and self.headings[-1][0] >= position - 1 and self.headings[-1][1:] == heading:
+                    continue
+                self.headings.append((position, *heading))
+            self.chunk_count = position + 1
+            yield chunk
+    
+    def sections(self) -> List[Section]:
+        levels: Dict[int, int] = {}
+        for _, level, _ in self.headings:
+            levels[level] = levels.get(level, 0) + 1
+        level = min((level for level, count in levels.items() if count > 1), default=None)
+        if level is None:
+            step = Config.SECTION_FALLBACK_CHUNKS
+            return [
+                Section(i, f"Part {i + 1}", 0, start, min(start + step, self.chunk_count))
+                for i, start in enumerate(range(0, self.chunk_count, step))
+            ]
+        
+        starts = [(position, title) for position, heading_level, title in self.headings if heading_level <= level]
+        if starts[0][0] > 0:
+            starts.insert(0, (0, "Introduction"))
+        sections = []
+        for i, (start, title) in enumerate(starts):
+            end = starts[i + 1][0] if i + 1 < len(starts) else self.chunk_count
+            if end > start:
+                sections.append(Section(len(sections), title, level, start, end))
+            elif sections:
+                # Headings in one chunk: the chunk belongs to the first, the title to both
+                sections[-1].title = f"{sections[-1].title} / {title}"
+        return sections
+
+class Summarizer:
+    """Writes section and document summaries in the background, after ingestion or re-indexing.
+    
+    Each section is read back from the vector store and summarized in parts
+    of at most SUMMARY_INPUT_TOKENS; a section's parts and then the section
+    summaries are combined into the document's summary. Requests go in the
+    bulk lane of the OpenAI limits, behind questions. Summaries are saved as
+    they are written, so a restart picks up the sections still missing.
+    """
+    
+    def __init__(self, vector_store: VectorStore):
+        self.vector_store = vector_store
+        # Webhook worker partition whose users this process summarizes for; None for all users
+        self.partition: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self.pending = set()
+        self.counts = {"summarized": 0, "failed": 0}
+    
+    @property
+    def document_store(self):
+        return self.vector_store.document_store
+    
+    @property
+    def tokenizer(self):
+        return get_tokenizer()
+    
+    async def start(self):
+        """Summarize documents still missing summaries, then those enqueued, in a background task."""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+    
+    def enqueue(self, vector_document_id: str):
+        """Summarize a document's vectors once the ones ahead of it are done."""
+        if vector_document_id not in self.pending:
+            self.pending.add(vector_document_id)
+            self.queue.put_nowait(vector_document_id)
+    
+    async def run(self):
+        after = ""
+        while True:
+            documents = await asyncio.to_thread(self.document_store.list_unsummarized, after)
+            if not documents:
+                break
+            after = documents[-1].doc_id
+            for document in documents:
+                if owns_user(document.user_id, self.partition):
+                    self.enqueue(document.vector_document_id)
+        
+        while True:
+            vector_document_id = await self.queue.get()
+            try:
+                await self.summarize(vector_document_id)
+            finally:
+                self.pending.discard(vector_document_id)
+    
+    async def summarize(self, vector_document_id: str) -> bool:
+        """Write the missing summaries of a document's vectors, then the document's summary."""
+        document = await asyncio.to_thread(self.document_store.find_vector_owner, vector_document_id)
+        if document is None or document.vector_document_id != vector_document_id:
+            # Deleted, or replaced by re-indexing since it was enqueued
+            return False
+        
+        with trace("summarize", user=document.user_id, document=document.doc_id):
+            try:
+                sections = await asyncio.to_thread(self.document_store.get_sections, vector_document_id)
+                if not sections:
+                    # Indexed before sections were recorded: find them from the stored chunks
+                    sections = await asyncio.to_thread(self.index_sections, document)
+                if not sections:
+                    logger.warning(f"Document {document.doc_id} has no chunks to summarize")
+                    return False
+                
+                semaphore = asyncio.Semaphore(Config.SUMMARY_CONCURRENCY)
+                
+                async def summarize_section(section: Section):
+                    async with semaphore:
+                        section.summary = await self.summarize_section(document, section)
+                    await asyncio.to_thread(
+                        self.document_store.save_section_summary, vector_document_id, section.position, section.summary
+                    )
+                
+                results = await asyncio.gather(
+                    *(summarize_section(section) for section in sections if section.summary is None),
+                    return_exceptions=True
+                )
+                errors = [result for result in results if isinstance(result, Exception)]
+                if errors:
+                    raise errors[0]
+                if len(sections) == 1:
+                    summary = sections[0].summary
+                else:
+                    summary = await self.combine(
+                        [f"## {section.title}\n{section.summary}" for section in sections],
+                        "sections of a document", Config.DOCUMENT_SUMMARY_TOKENS
+                    )
+                await asyncio.to_thread(
+                    self.document_store.save_document_summary, vector_document_id, summary, Config.SUMMARY_MODEL
+                )
+                logger.info(f"Summarized document {document.doc_id} in {len(sections)} sections")
+                self.counts["summarized"] += 1
+                return True
+            except Exception as e:
+                # Sections summarized so far are kept for the next start
+                logger.error(f"Error summarizing document {document.doc_id}: {str(e)}")
+                self.counts["failed"] += 1
+                return False
+    
+    def index_sections(self, document: Document) -> List[Section]:
+        indexer = SectionIndexer()
+        for _ in indexer.observe(self.iter_chunks(document, 0, document.chunk_count)):
+            pass
+        sections = indexer.sections()
+        self.document_store.save_sections(document.vector_document_id, sections)
+        return sections
+    
+    def iter_chunks(self, document: Document, start: int, end: int) -> Iterator[str]:
+        for batch in range(start, end, READ_BATCH):
+            yield from self.vector_store.chunk_texts(document, batch, min(batch + READ_BATCH, end))
+    
+    def read_section(self, document: Document, section: Section) -> List[str]:
+        """A section's text, without the overlap between its chunks, in parts of at most SUMMARY_INPUT_TOKENS."""
+        parts: List[str] = []
+        text = ""
+        # Counting whole chunks counts their overlap twice, erring on the small side
+        used = 0
+        for chunk in self.iter_chunks(document, section.start, section.end):
+            tokens = len(self.tokenizer.encode(chunk))
+            if text and used + tokens > Config.SUMMARY_INPUT_TOKENS:
+                parts.append(text)
+                text = ""
+                used = 0
+            text = merge_overlapping(text, chunk) if text else chunk
+            used += tokens
+        if text:
+            parts.append(text)
+        return parts
+    
+    async def summarize_section(self, document: Document, section: Section) -> str:
+        parts = await asyncio.to_thread(self.read_section, document, section)
+        summaries = [
+            await self.complete(
+                f"Summarize this part of the section \"{section.title}\" of a document.",
+                part, Config.SECTION_SUMMARY_TOKENS
+            )
+            for part in parts
+        ]
+        if len(summaries) == 1:
+            return summaries[0]
+        return await self.combine(summaries, f"parts of the section \"{section.title}\"", Config.SECTION_SUMMARY_TOKENS)
+    
+    async def combine(self, summaries: List[str], what: str, max_tokens: int) -> str:
+        """Combine summaries into one, in rounds when they don't fit one request together."""
+        while True:
+            groups: List[List[str]] = [[]]
+            used = 0
+            for summary in summaries:
+                tokens = len(self.tokenizer.encode(summary))
+                # At least two to a group, so every round shortens the list
+                if len(groups[-1]) > 1 and used + tokens > Config.SUMMARY_INPUT_TOKENS:
+                    groups.append([])
+                    used = 0
+                groups[-1].append(summary)
+                used += tokens
+            summaries = [
+                await self.complete(f"Combine these summaries of {what} into one summary.", "\n\n".join(group), max_tokens)
+                for group in groups
+            ]
+            if len(summaries) == 1:
+                return summaries[0]
+    
+    async def complete(self, instruction: str, text: str, max_tokens: int) -> str:
+        with span("summarize"):
+            response = await achat(
+                lane=BULK,
+                model=Config.SUMMARY_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": f"{instruction} Keep the main points, definitions, names and numbers. "
+                                  f"Use at most {max_tokens} tokens and reply with the summary only."
+                    },
+                    {"role": "user", "content": text}
+                ],
+                temperature=0,
+                max_tokens=max_tokens
+            )
+        if response.usage is not None:
+            count_tokens(Config.SUMMARY_MODEL, "prompt", response.usage.prompt_tokens)
+            count_tokens(Config.SUMMARY_MODEL, "completion", response.usage.completion_tokens)
+        return response.choices[0].message.content.strip()
@@ -0,0 +1,18 @@
+import threading
+
+_tokenizer = None
+_lock = threading.Lock()
+
+def get_tokenizer():
+    """The cl100k_base tokenizer, shared and loaded on first use.
+    
+    tiktoken reads its vocabulary from disk (or downloads it) when the
+    encoding is created, so this stays off the import path.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _lock:
+            if _tokenizer is None:
+                import tiktoken
+                _tokenizer = tiktoken.get_encoding("cl100k_base")
+    return _tokenizer
@@ -0,0 +1,144 @@
+import gzip
+import logging
+import os
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_SUFFIX = ".gz"
+# Only files named like saved uploads are counted or evicted: UPLOAD_DIR may be the
+# volume's root, holding the databases too
+UPLOAD_FILE_RE = re.compile(r"^[0-9a-f-]{36}\.(pdf|docx?)(\.gz)?$", re.I)
+
+class UploadStore:
+    """Original uploads kept for re-indexing, gzip-compressed, within a total size budget.
+    
+    Files live at UPLOAD_DIR/<user_id>/<doc_id><extension>.gz (uncompressed
+    files from before are read and evicted too). Files over max_file_bytes
+    are not kept, and once the directory holds more than max_bytes the least
+    recently used files are deleted; reading a file counts as using it. The
+    total is tracked in memory and rescanned from disk before evicting, as
+    other bot processes may share the volume.
+    """
+    
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_bytes: Optional[float] = None,
+        max_file_bytes: Optional[float] = None,
+        compression_level: Optional[int] = None
+    ):
+        self.directory = directory or Config.UPLOAD_DIR
+        self.max_bytes = Config.UPLOAD_RETENTION_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.max_file_bytes = Config.UPLOAD_RETENTION_MAX_FILE_MB * 1024 * 1024 if max_file_bytes is None else max_file_bytes
+        self.compression_level = Config.UPLOAD_COMPRESSION_LEVEL if compression_level is None else compression_level
+        self._lock = threading.Lock()
+        # Bytes on disk, scanned on first use
+        self._total: Optional[int] = None
+        self.stats = {"saved": 0, "skipped": 0, "evicted": 0, "original_bytes": 0, "stored_bytes": 0}
+    
+    def path_for(self, user_id: str, doc_id: str, file_name: str) -> str:
+        extension = os.path.splitext(file_name)[1]
+        return os.path.join(self.directory, user_id, f"{doc_id}{extension}{COMPRESSED_SUFFIX}")
+    
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """(last use, size, path) of every kept file, least recently used first."""
+        files = []
+        if not os.path.isdir(self.directory):
+            return files
+        for user_dir in os.scandir(self.directory):
+            if not user_dir.is_dir():
+                continue
+            for entry in os.scandir(user_dir.path):
+                if entry.is_file() and UPLOAD_FILE_RE.match(entry.name):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        return files
+    
+    def total_bytes(self) -> int:
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._scan())
+            return self._total
+    
+    def save(self, user_id: str, doc_id: str, file_name: str, data: bytes) -> bool:
+        """Keep a compressed copy of an upload if the policy allows; returns whether it was kept."""
+        if self.max_bytes <= 0 or len(data) > self.max_file_bytes:
+            self.stats["skipped"] += 1
+            logger.info(f"Not keeping the original of document {doc_id} ({len(data)} bytes)")
+            return False
+        
+        compressed = gzip.compress(data, compresslevel=self.compression_level, mtime=0)
+        if len(compressed) > self.max_bytes:
+            self.stats["skipped"] += 1
+            return False
+        path = self.path_for(user_id, doc_id, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a hidden name and renamed, so readers never see half a file
+        partial = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.partial")
+        with open(partial, "wb") as f:
+            f.write(compressed)
+        os.replace(partial, path)
+        
+        self.total_bytes()
+        with self._lock:
+            self._total += len(compressed)
+            self.stats["saved"] += 1
+            self.stats["original_bytes"] += len(data)
+            self.stats["stored_bytes"] += len(compressed)
+        logger.info(f"Kept the original of document {doc_id}: {len(data)} bytes compressed to {len(compressed)}")
+        self.evict()
+        return True
+    
+    def evict(self):
+        """Delete the least recently used files while the directory is over its budget."""
+        with self._lock:
+            if self._total is not None and self._total <= self.max_bytes:
+                return
+            files = self._scan()
+            total = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Evicted by another process meanwhile
+                    pass
+                total -= size
+                self.stats["evicted"] += 1
+                logger.info(f"Evicted kept upload {path} ({size} bytes)")
+            self._total = total
+    
+    def load(self, user_id: str, doc_id: str, file_name: str) -> Optional[bytes]:
+        """The original upload's bytes, or None if it wasn't kept or was evicted."""
+        path = self.path_for(user_id, doc_id, file_name)
+        # Kept uncompressed before there was a retention policy
+        legacy_path = path[:-len(COMPRESSED_SUFFIX)]
+        for candidate, compressed in ((path, True), (legacy_path, False)):
+            try:
+                with open(candidate, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            now = time.time()
+            os.utime(candidate, (now, now))
+            return gzip.decompress(data) if compressed else data
+        return None
+    
+    def delete(self, user_id: str, doc_id: str, file_name: str):
+        path = self.path_for(user_id, doc_id, file_name)
+        for candidate in (path, path[:-len(COMPRESSED_SUFFIX)]):
+            try:
+                size = os.path.getsize(candidate)
+                os.remove(candidate)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                if self._total is not None:
+                    self._total -= size
@@ -1,106 +1,646 @@
-import chromadb
-import openai
-from typing import List, Dict, Optional
+import asyncio
+import hashlib
+import heapq
+import threading
+import time
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime
 from config.config import Config
+from .answer_cache import AnswerCache
+from .compact_store import CompactVectorStore
+from .document_store import Document, DocumentStore
+from .embedding_backends import EmbeddingBackend, make_embedding_backend
+from .embedding_cache import EmbeddingCache
+from .embedding_pipeline import EmbeddingPipeline
+from .matrix_cache import DocumentMatrix, DocumentMatrixCache
+from .lexical_index import LexicalHit, LexicalIndex, exact_terms
+from .metrics import span
+from .partitioning import make_partition_strategy, model_collection_name
 import logging
 
 logger = logging.getLogger(__name__)
 
-class Document:
-    def __init__(self, doc_id: str, name: str, user_id: str, upload_time: datetime):
-        self.doc_id = doc_id
-        self.name = name
-        self.user_id = user_id
-        self.upload_time = upload_time
+def index_fingerprint(content_hash: str) -> str:
+    """Identify a file's vectors by its bytes plus every setting that shapes them."""
+    key = f"{content_hash}:{Config.CHUNK_SIZE}:{Config.CHUNK_OVERLAP}:{Config.EMBEDDING_MODEL}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def current_index_params() -> Dict[str, Any]:
+    """The settings index_fingerprint covers, recorded on documents and chunks built with them."""
+    return {
+        "chunk_size": Config.CHUNK_SIZE,
+        "chunk_overlap": Config.CHUNK_OVERLAP,
+        "embedding_model": Config.EMBEDDING_MODEL
+    }
+
+def chunk_position(chunk_id: str) -> Optional[int]:
+    """Position of a chunk within its document, from ids of the form `{document_id}_{n}`."""
+    try:
+        return int(chunk_id.rsplit("_", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+class RetrievedChunk:
+    # distance is None for chunks found only by the lexical index
+    def __init__(
+        self,
+        text: str,
+        position: Optional[int],
+        distance: Optional[float],
+        document_id: Optional[str] = None,
+        source: Optional[str] = None
+    ):
+        self.text = text
+        self.position = position
+        self.distance = distance
+        # Set when chunks of several documents are searched together; source is the document's name
+        self.document_id = document_id
+        self.source = source
+
+def merge_rankings(rankings: List[List[RetrievedChunk]], n_results: int) -> List[RetrievedChunk]:
+    """Merge per-document rankings, each best first, into the n_results best overall.
+    
+    Distances compare across documents searched with the same embedding
+    model. Within a document the fused order is kept: each chunk is keyed by
+    the largest distance at or above its rank, and lexical-only hits (no
+    distance) rank with the vector hit above them, so every ranking is
+    sorted by key and a heap merge takes the best heads first.
+    """
+    def keyed(chunks: List[RetrievedChunk]) -> Iterator[Tuple[float, RetrievedChunk]]:
+        distances = [chunk.distance for chunk in chunks if chunk.distance is not None]
+        # Exact-term answers come from the lexical index alone, and are strong matches
+        key = min(distances) if distances else 0.0
+        for chunk in chunks:
+            if chunk.distance is not None:
+                key = max(key, chunk.distance)
+            yield key, chunk
+    
+    merged = heapq.merge(*(keyed(chunks) for chunks in rankings), key=lambda item: item[0])
+    return [chunk for _, chunk in islice(merged, n_results)]
 
 class VectorStore:
     def __init__(self):
         logger.info("Initializing VectorStore")
         try:
-            self.client = chromadb.PersistentClient(path="./chroma_db")
-            self.collection = self.client.get_or_create_collection(
-                name="documents",
-                metadata={"hnsw:space": "cosine"}
-            )
-            openai.api_key = Config.OPENAI_API_KEY
+            # Chroma client, created on first use: importing chromadb alone takes most of a second
+            self._client = None
+            self._client_lock = threading.Lock()
+            self.partitioning = make_partition_strategy(Config.CHROMA_PARTITIONING, Config.CHROMA_SHARDS)
+            self._collections: Dict[str, Any] = {}
+            self.embedding_backend = make_embedding_backend(Config.EMBEDDING_MODEL)
+            self.embedding_backend.check_chunk_size()
+            # Backends for the models of documents not yet re-indexed with EMBEDDING_MODEL
+            self._backends: Dict[str, EmbeddingBackend] = {Config.EMBEDDING_MODEL: self.embedding_backend}
+            self.embedding_cache = EmbeddingCache()
+            self.embedding_pipeline = EmbeddingPipeline(cache=self.embedding_cache, backend=self.embedding_backend)
+            self.answer_cache = AnswerCache()
+            self.lexical_index = LexicalIndex()
+            # Quantized per-document files instead of Chroma collections, if configured
+            self.compact_store = CompactVectorStore() if Config.VECTOR_STORE == "compact" else None
+            # Embedding matrices of recently selected documents, searched by brute force
+            self.matrix_cache = DocumentMatrixCache()
             
-            # In-memory document metadata storage
-            self.documents: Dict[str, Document] = {}
+            # Persistent document metadata, opened on first use
+            self.document_store = DocumentStore()
             
             logger.info("VectorStore initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing VectorStore: {str(e)}")
             raise
     
-    def add_document(self, doc_id: str, name: str, user_id: str) -> Document:
-        """Add document metadata."""
-        doc = Document(doc_id, name, user_id, datetime.now())
-        self.documents[doc_id] = doc
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import chromadb
+                    if Config.CHROMA_HOST:
+                        self._client = chromadb.HttpClient(host=Config.CHROMA_HOST, port=Config.CHROMA_PORT)
+                    else:
+                        self._client = chromadb.PersistentClient(path=Config.CHROMA_DIR)
+        return self._client
+    
+    def warm_up(self):
+        """Open the vector database, metadata stores and embedding client ahead of the first request."""
+        if self.compact_store is None:
+            self.client.heartbeat()
+        self.document_store.conn
+        self.lexical_index.conn
+        self.embedding_backend.warm_up()
+    
+    def add_document(
+        self,
+        doc_id: str,
+        name: str,
+        user_id: str,
+        content_hash: Optional[str] = None,
+        vector_document_id: Optional[str] = None,
+        chunk_count: Optional[int] = None,
+        status: str = "ready",
+        fingerprint: Optional[str] = None,
+        index_params: Optional[Dict[str, Any]] = None
+    ) -> Document:
+        """Add document metadata. Copies of an indexed document take its chunk count and index parameters."""
+        if vector_document_id and (chunk_count is None or index_params is None):
+            source = self.document_store.find_vector_owner(vector_document_id)
+            if chunk_count is None:
+                chunk_count = source.chunk_count if source else 0
+            if index_params is None and source is not None:
+                index_params = source.index_params
+        doc = Document(
+            doc_id, name, user_id, datetime.now(),
+            content_hash, vector_document_id, chunk_count or 0, status, fingerprint, index_params
+        )
+        self.document_store.add(doc)
         return doc
     
+    def update_document(self, doc_id: str, **fields):
+        """Update document metadata such as status or chunk_count."""
+        self.document_store.update(doc_id, **fields)
+    
     def get_user_documents(self, user_id: str) -> List[Document]:
-        """Get all documents for a user."""
-        return [doc for doc in self.documents.values() if doc.user_id == user_id]
+        """Get all of a user's documents that are ready to chat with."""
+        return self.document_store.list_by_user(user_id, status="ready")
     
     def get_document(self, doc_id: str) -> Optional[Document]:
         """Get document by ID."""
-        return self.documents.get(doc_id)
+        return self.document_store.get(doc_id)
+    
+    def get_collection(self, name: str, model: Optional[str] = None):
+        """Get or create a Chroma collection, cached by name."""
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self.client.get_or_create_collection(
+                name=name,
+                metadata={"hnsw:space": "cosine", "embedding_model": model or Config.EMBEDDING_MODEL}
+            )
+            self._collections[name] = collection
+        return collection
+    
+    def collection_for(self, user_id: str, vector_document_id: str, model: Optional[str] = None):
+        """The collection holding a document's vectors under the partitioning strategy and embedding model."""
+        model = model or Config.EMBEDDING_MODEL
+        name = self.partitioning.collection_name(user_id, vector_document_id)
+        return self.get_collection(model_collection_name(name, model), model)
+    
+    def _document_collection(self, document: Document):
+        return self.collection_for(self._vector_owner(document), document.vector_document_id, document.embedding_model)
+    
+    def _vector_owner(self, document: Document) -> str:
+        """User whose upload produced the vectors backing document."""
+        if document.fingerprint is not None or document.vector_document_id == document.doc_id:
+            return document.user_id
+        source = self.document_store.find_vector_owner(document.vector_document_id)
+        return source.user_id if source else document.user_id
+    
+    def backend_for(self, model: Optional[str] = None) -> EmbeddingBackend:
+        """The embedding backend for model, by default EMBEDDING_MODEL."""
+        model = model or Config.EMBEDDING_MODEL
+        backend = self._backends.get(model)
+        if backend is None:
+            backend = self._backends[model] = make_embedding_backend(model)
+        return backend
+    
+    def find_indexed_document(self, fingerprint: str) -> Optional[str]:
+        """Return the id of a document whose vectors match fingerprint, if any."""
+        try:
+            document = self.document_store.find_by_fingerprint(fingerprint)
+            return document.doc_id if document else None
+        except Exception as e:
+            logger.error(f"Error looking up fingerprint {fingerprint}: {str(e)}")
+            raise
     
-    def add_chunks(self, chunks: List[str], user_id: str, document_id: str):
+    def add_chunks(self, chunks: List[str], user_id: str, document_id: str, fingerprint: Optional[str] = None):
         """Add document chunks to vector store."""
+        logger.info(f"Adding {len(chunks)} chunks for user {user_id}, document {document_id}")
+        self.add_chunk_stream(chunks, user_id, document_id, fingerprint)
+    
+    def add_chunk_stream(
+        self,
+        chunks: Iterable[str],
+        user_id: str,
+        document_id: str,
+        fingerprint: Optional[str] = None,
+        on_progress: Optional[Callable[[int], None]] = None,
+        start: Optional[int] = None
+    ) -> int:
+        """Embed and store chunks as they arrive, one group of batches at a time.
+        
+        Memory is bounded by the group size rather than the document size.
+        Returns the number of chunks stored. With start set, an interrupted
+        write resumes: the first start chunks are skipped as already stored,
+        and a failure leaves what was stored for the next attempt.
+        """
+        group_size = Config.EMBEDDING_BATCH_SIZE * Config.EMBEDDING_CONCURRENCY
+        stored = start or 0
+        if start is None:
+            # Answers and postings from earlier vectors of this document are stale now
+            self.answer_cache.invalidate(document_id)
+            self.matrix_cache.invalidate(document_id)
+            self.lexical_index.delete_document(document_id)
+            if self.compact_store is not None:
+                self.compact_store.delete(document_id)
         try:
-            logger.info(f"Adding {len(chunks)} chunks for user {user_id}, document {document_id}")
-            embeddings = [self.get_embedding(chunk) for chunk in chunks]
+            group: List[str] = []
+            for i, chunk in enumerate(chunks):
+                if i < stored and start is not None:
+                    continue
+                group.append(chunk)
+                if len(group) >= group_size:
+                    stored += self._store_group(group, stored, user_id, document_id, fingerprint)
+                    group = []
+                    if on_progress is not None:
+                        on_progress(stored)
+            if group:
+                stored += self._store_group(group, stored, user_id, document_id, fingerprint)
+                if on_progress is not None:
+                    on_progress(stored)
             
-            # Add to ChromaDB with document ID in metadata
-            self.collection.add(
-                embeddings=embeddings,
-                documents=chunks,
-                ids=[f"{document_id}_{i}" for i in range(len(chunks))],
-                metadatas=[{"user_id": user_id, "document_id": document_id} for _ in chunks]
-            )
-            logger.info("Successfully added chunks to vector store")
+            logger.info(f"Successfully added {stored} chunks to vector store")
+            logger.info(f"Embedding cache stats: {self.embedding_cache.stats()}")
+            return stored
         except Exception as e:
             logger.error(f"Error adding chunks to vector store: {str(e)}")
+            if stored and start is None:
+                # Don't leave a partial document behind for dedup lookups to find
+                if self.compact_store is not None:
+                    self.compact_store.delete(document_id)
+                else:
+                    self.collection_for(user_id, document_id).delete(
+                        where={"document_id": {"$eq": document_id}}
+                    )
+                self.lexical_index.delete_document(document_id)
             raise
     
-    def query(self, query: str, user_id: str, document_id: str, n_results: int = 3) -> List[str]:
-        """Query vector store for relevant chunks from a specific document."""
+    def _store_group(
+        self,
+        chunks: List[str],
+        offset: int,
+        user_id: str,
+        document_id: str,
+        fingerprint: Optional[str]
+    ) -> int:
+        with span("embed"):
+            embeddings = self.embedding_pipeline.embed(chunks)
+        
+        with span("store"):
+            if self.compact_store is not None:
+                self.compact_store.add(document_id, offset, embeddings, chunks)
+            else:
+                # Add to ChromaDB with document ID in metadata; upsert, as a resumed write may repeat a group
+                self.collection_for(user_id, document_id).upsert(
+                    embeddings=embeddings,
+                    documents=chunks,
+                    ids=[f"{document_id}_{offset + i}" for i in range(len(chunks))],
+                    metadatas=[self._chunk_metadata(user_id, document_id, fingerprint) for _ in chunks]
+                )
+        with span("lexical_index"):
+            self.lexical_index.add_chunks(document_id, offset, chunks)
+        return len(chunks)
+    
+    @staticmethod
+    def _chunk_metadata(user_id: str, document_id: str, fingerprint: Optional[str]) -> Dict[str, Any]:
+        metadata = {"user_id": user_id, "document_id": document_id, **current_index_params()}
+        if fingerprint:
+            metadata["fingerprint"] = fingerprint
+        return metadata
+    
+    def stored_chunks(self, document_id: str) -> Optional[int]:
+        """Chunks of document_id in the compact store, which can only be appended to; None for Chroma."""
+        if self.compact_store is None:
+            return None
+        return self.compact_store.count(document_id)
+    
+    def delete_vectors(self, user_id: str, vector_document_id: str, model: Optional[str] = None):
+        """Delete the vectors, postings and summaries stored under vector_document_id."""
+        self.document_store.delete_summaries(vector_document_id)
+        self.answer_cache.invalidate(vector_document_id)
+        self.matrix_cache.invalidate(vector_document_id)
+        self.lexical_index.delete_document(vector_document_id)
+        if self.compact_store is not None:
+            self.compact_store.delete(vector_document_id)
+        else:
+            self.collection_for(user_id, vector_document_id, model).delete(
+                where={"document_id": {"$eq": vector_document_id}}
+            )
+    
+    def swap_vectors(
+        self,
+        owner: Document,
+        vector_document_id: str,
+        chunk_count: int,
+        fingerprint: str,
+        content_hash: str,
+        retire_seconds: float
+    ):
+        """Point a document and its deduplicated copies at newly built vectors.
+        
+        Queries move over in one metadata transaction; the old vectors are
+        kept retire_seconds longer for searches that already looked them up.
+        """
+        old_vector_id = owner.vector_document_id
+        self.document_store.repoint_vectors(
+            owner.doc_id, old_vector_id, vector_document_id, fingerprint,
+            current_index_params(), chunk_count, content_hash,
+            retire=(owner.user_id, owner.embedding_model, time.time() + retire_seconds)
+        )
+        self.answer_cache.invalidate(old_vector_id)
+        self.matrix_cache.invalidate(old_vector_id)
+        logger.info(f"Document {owner.doc_id} now uses vectors {vector_document_id} ({chunk_count} chunks)")
+    
+    def delete_retired_vectors(self, now: Optional[float] = None) -> int:
+        """Delete replaced vectors whose grace period is over; returns how many documents' vectors went."""
+        retired = self.document_store.retired_vectors(due_before=now or time.time())
+        for vector_document_id, user_id, model, _ in retired:
+            self.delete_vectors(user_id, vector_document_id, model)
+            self.document_store.forget_retired_vectors(vector_document_id)
+            logger.info(f"Deleted replaced vectors {vector_document_id}")
+        return len(retired)
+    
+    def _get_authorized_document(self, user_id: str, document_id: str) -> Document:
+        # Access is checked on the user's own document record, since the
+        # vectors may have been indexed from someone else's identical upload
+        document = self.get_document(document_id)
+        if document is None or document.user_id != user_id:
+            raise PermissionError(f"Document {document_id} is not available to user {user_id}")
+        return document
+    
+    def _query_collection(
+        self,
+        query_embedding: List[float],
+        document: Document,
+        n_results: int
+    ) -> List[RetrievedChunk]:
+        matrix = self.matrix_cache.get(document.vector_document_id)
+        if matrix is not None:
+            hits = matrix.search(query_embedding, n_results)
+            logger.info(f"Found {len(hits)} relevant chunks in the document matrix")
+            return [RetrievedChunk(text, position, distance) for position, text, distance in hits]
+        if self.compact_store is not None:
+            hits = self.compact_store.query(document.vector_document_id, query_embedding, n_results)
+            logger.info(f"Found {len(hits)} relevant chunks")
+            return [RetrievedChunk(text, position, distance) for position, text, distance in hits]
+        
+        collection = self._document_collection(document)
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=self.partitioning.where(document.vector_document_id),
+            include=["documents", "distances"]
+        )
+        logger.info(f"Found {len(results['documents'][0])} relevant chunks")
+        return [
+            RetrievedChunk(text, chunk_position(chunk_id), distance)
+            for chunk_id, text, distance in zip(
+                results["ids"][0], results["documents"][0], results["distances"][0]
+            )
+        ]
+    
+    def load_document_matrix(self, user_id: str, document_id: str) -> bool:
+        """Load a small document's embeddings into the matrix cache ahead of its queries.
+        
+        Returns whether the document's matrix is cached. Documents over
+        MATRIX_CACHE_MAX_CHUNKS, and the compact store (already a brute-force
+        search over mapped files), are left to their usual search.
+        """
         try:
-            logger.info(f"Querying vector store for user {user_id}, document {document_id}")
-            query_embedding = self.get_embedding(query)
-            
-            # Fix the where clause format
-            where_clause = {
-                "$and": [
-                    {"user_id": {"$eq": user_id}},
-                    {"document_id": {"$eq": document_id}}
-                ]
-            }
+            document = self._get_authorized_document(user_id, document_id)
+            vector_document_id = document.vector_document_id
+            if vector_document_id in self.matrix_cache:
+                return True
+            if self.compact_store is not None or document.chunk_count > self.matrix_cache.max_chunks:
+                return False
             
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
-                where=where_clause
+            collection = self._document_collection(document)
+            results = collection.get(
+                where={"document_id": {"$eq": vector_document_id}},
+                include=["embeddings", "documents"],
+                limit=self.matrix_cache.max_chunks + 1
             )
-            
-            logger.info(f"Found {len(results['documents'][0])} relevant chunks")
-            return results["documents"][0]
+            if not results["ids"] or len(results["ids"]) > self.matrix_cache.max_chunks:
+                return False
+            positions = [chunk_position(chunk_id) for chunk_id in results["ids"]]
+            if None in positions:
+                return False
+            matrix = DocumentMatrix(positions, results["embeddings"], results["documents"])
+            self.matrix_cache.put(vector_document_id, matrix)
+            logger.info(
+                f"Loaded {len(positions)} vectors of document {vector_document_id} into memory: "
+                f"{self.matrix_cache.stats()}"
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error loading document matrix for {document_id}: {str(e)}")
+            raise
+    
+    def _fetch_chunks(self, document: Document, positions: List[int]) -> Dict[int, str]:
+        """Chunk texts of a document by position."""
+        if not positions:
+            return {}
+        if self.compact_store is not None:
+            return self.compact_store.get(document.vector_document_id, positions)
+        collection = self._document_collection(document)
+        results = collection.get(
+            ids=[f"{document.vector_document_id}_{position}" for position in positions],
+            include=["documents"]
+        )
+        return {
+            chunk_position(chunk_id): text
+            for chunk_id, text in zip(results["ids"], results["documents"])
+        }
+    
+    def chunk_texts(self, document: Document, start: int, end: int) -> List[str]:
+        """Texts of a document's chunks at positions [start, end), in order."""
+        texts = self._fetch_chunks(document, list(range(start, end)))
+        return [texts[position] for position in range(start, end) if position in texts]
+    
+    def _lexical_only(self, query: str, document: Document, lexical_hits: List[LexicalHit]) -> Optional[List[RetrievedChunk]]:
+        """Chunks for an exact-term question whose terms all occur in the best lexical hit."""
+        terms = exact_terms(query)
+        if not terms or not lexical_hits or not terms <= lexical_hits[0].terms:
+            return None
+        logger.info(f"Answering exact-term query {sorted(terms)} from the lexical index")
+        # Hits sharing only the query's ordinary words add nothing here
+        hits = [hit for hit in lexical_hits if hit.terms & terms]
+        texts = self._fetch_chunks(document, [hit.position for hit in hits])
+        return [RetrievedChunk(texts[hit.position], hit.position, None) for hit in hits if hit.position in texts]
+    
+    def _fuse(
+        self,
+        document: Document,
+        vector_hits: List[RetrievedChunk],
+        lexical_hits: List[LexicalHit],
+        n_results: int
+    ) -> List[RetrievedChunk]:
+        """Combine vector and lexical rankings with reciprocal rank fusion."""
+        k = Config.HYBRID_RRF_K
+        scores: Dict[int, float] = {}
+        chunks: Dict[int, RetrievedChunk] = {}
+        for rank, chunk in enumerate(vector_hits):
+            if chunk.position is None:
+                continue
+            scores[chunk.position] = scores.get(chunk.position, 0.0) + 1 / (k + rank + 1)
+            chunks[chunk.position] = chunk
+        for rank, hit in enumerate(lexical_hits):
+            scores[hit.position] = scores.get(hit.position, 0.0) + 1 / (k + rank + 1)
+        
+        ranked = sorted(scores, key=scores.get, reverse=True)[:n_results]
+        texts = self._fetch_chunks(document, [position for position in ranked if position not in chunks])
+        for position in ranked:
+            if position not in chunks and position in texts:
+                chunks[position] = RetrievedChunk(texts[position], position, None)
+        # Vector hits without a position (legacy ids) can't be fused; keep them at the end
+        unranked = [chunk for chunk in vector_hits if chunk.position is None]
+        return [chunks[position] for position in ranked if position in chunks] + unranked
+    
+    def search(
+        self,
+        query: str,
+        user_id: str,
+        document_id: str,
+        n_results: int = 3,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[RetrievedChunk]:
+        """Find the chunks of a specific document that best match query, best first.
+        
+        Vector and BM25 hits are fused; questions naming exact terms that the
+        lexical index matches skip the embedding call altogether.
+        """
+        try:
+            logger.info(f"Querying vector store for user {user_id}, document {document_id}")
+            document = self._get_authorized_document(user_id, document_id)
+            with span("lexical_search"):
+                lexical_hits = self.lexical_index.search(document.vector_document_id, query, n_results)
+                chunks = self._lexical_only(query, document, lexical_hits)
+            if chunks:
+                return chunks
+            if query_embedding is None or document.embedding_model != Config.EMBEDDING_MODEL:
+                # A document awaiting re-indexing is searched with the model its vectors came from
+                query_embedding = self.get_embedding(query, document.embedding_model)
+            with span("vector_search"):
+                vector_hits = self._query_collection(query_embedding, document, n_results)
+                return self._fuse(document, vector_hits, lexical_hits, n_results)
+        except Exception as e:
+            logger.error(f"Error querying vector store: {str(e)}")
+            raise
+    
+    async def asearch(
+        self,
+        query: str,
+        user_id: str,
+        document_id: str,
+        n_results: int = 3,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[RetrievedChunk]:
+        """Async version of search: embeds with the async client, searches the indexes in threads."""
+        try:
+            logger.info(f"Querying vector store for user {user_id}, document {document_id}")
+            document = await asyncio.to_thread(self._get_authorized_document, user_id, document_id)
+            with span("lexical_search"):
+                lexical_hits = await asyncio.to_thread(
+                    self.lexical_index.search, document.vector_document_id, query, n_results
+                )
+                chunks = await asyncio.to_thread(self._lexical_only, query, document, lexical_hits)
+            if chunks:
+                return chunks
+            if query_embedding is None or document.embedding_model != Config.EMBEDDING_MODEL:
+                query_embedding = await self.aget_embedding(query, document.embedding_model)
+            with span("vector_search"):
+                vector_hits = await asyncio.to_thread(self._query_collection, query_embedding, document, n_results)
+                return await asyncio.to_thread(self._fuse, document, vector_hits, lexical_hits, n_results)
         except Exception as e:
             logger.error(f"Error querying vector store: {str(e)}")
             raise
     
-    def get_embedding(self, text: str) -> List[float]:
-        """Get OpenAI embedding for text."""
+    async def asearch_documents(
+        self,
+        query: str,
+        user_id: str,
+        document_ids: List[str],
+        n_results: int = 3,
+        per_document: Optional[int] = None
+    ) -> List[RetrievedChunk]:
+        """Search several of a user's documents at once and return the n_results best chunks overall.
+        
+        Documents are searched in parallel, SEARCH_FANOUT at a time, each for
+        per_document candidates (by default n_results); copies of one upload
+        are searched once. Concurrent searches share a single query embedding
+        through the embedding cache and request coalescing.
+        """
+        per_document = per_document or n_results
+        documents: Dict[str, Document] = {}
+        for document_id in document_ids:
+            document = await asyncio.to_thread(self._get_authorized_document, user_id, document_id)
+            documents.setdefault(document.vector_document_id, document)
+        logger.info(f"Querying {len(documents)} documents for user {user_id}")
+        semaphore = asyncio.Semaphore(Config.SEARCH_FANOUT)
+        
+        async def search_one(document: Document) -> List[RetrievedChunk]:
+            async with semaphore:
+                try:
+                    chunks = await self.asearch(query, user_id, document.doc_id, per_document)
+                except Exception as e:
+                    # One unavailable document shouldn't fail the whole question
+                    logger.warning(f"Skipping document {document.doc_id} in multi-document search: {str(e)}")
+                    return []
+            for chunk in chunks:
+                chunk.document_id = document.doc_id
+                chunk.source = document.name
+            return chunks
+        
+        rankings = await asyncio.gather(*(search_one(document) for document in documents.values()))
+        return merge_rankings(list(rankings), n_results)
+    
+    def query(self, query: str, user_id: str, document_id: str, n_results: int = 3) -> List[str]:
+        """Query vector store for relevant chunks from a specific document."""
+        return [chunk.text for chunk in self.search(query, user_id, document_id, n_results)]
+    
+    async def aquery(
+        self,
+        query: str,
+        user_id: str,
+        document_id: str,
+        n_results: int = 3,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[str]:
+        """Async version of query."""
+        chunks = await self.asearch(query, user_id, document_id, n_results, query_embedding)
+        return [chunk.text for chunk in chunks]
+    
+    def get_embedding(self, text: str, model: Optional[str] = None) -> List[float]:
+        """Get an embedding for text from the backend of model, by default EMBEDDING_MODEL."""
+        model = model or Config.EMBEDDING_MODEL
         try:
+            cached = self.embedding_cache.get(model, text)
+            if cached is not None:
+                logger.debug("Embedding cache hit")
+                return cached
+            
             logger.debug(f"Getting embedding for text of length {len(text)}")
-            response = openai.embeddings.create(
-                model=Config.EMBEDDING_MODEL,
-                input=text
-            )
+            with span("embed_query"):
+                embedding = self.backend_for(model).embed_batch([text])[0]
             logger.debug("Successfully got embedding")
-            return response.data[0].embedding
+            self.embedding_cache.put(model, text, embedding)
+            return embedding
         except Exception as e:
             logger.error(f"Error getting embedding: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
+    
+    async def aget_embedding(self, text: str, model: Optional[str] = None) -> List[float]:
+        """Get an embedding for text without blocking the event loop."""
+        model = model or Config.EMBEDDING_MODEL
+        try:
+            cached = await asyncio.to_thread(self.embedding_cache.get, model, text)
+            if cached is not None:
+                logger.debug("Embedding cache hit")
+                return cached
+            
+            logger.debug(f"Getting embedding for text of length {len(text)}")
+            with span("embed_query"):
+                embedding = await self.backend_for(model).aembed(text)
+            await asyncio.to_thread(self.embedding_cache.put, model, text, embedding)
+            return embedding
+        except Exception as e:
+            logger.error(f"Error getting embedding: {str(e)}")
+            raise
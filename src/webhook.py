@@ -0,0 +1,276 @@
+"""Webhook serving: a WSGI front that queues Telegram updates, and bot worker processes.
+
+Run with BOT_MODE=webhook. gunicorn workers accept updates at WEBHOOK_PATH
+and append them to a shared SQLite queue, partitioned by user; each of
+BOT_WORKERS processes handles one partition, so a user's updates are always
+handled by the same process, in order.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Collection, Dict, List, Optional, Set, Tuple
+from config.config import Config, configure_logging
+from .partitioning import partition_for
+
+logger = logging.getLogger(__name__)
+
+def update_user_id(payload: Dict[str, Any]) -> str:
+    """The id of the user who sent an update, or "" for updates without one."""
+    for value in payload.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user") or value.get("chat")
+            if isinstance(sender, dict) and "id" in sender:
+                return str(sender["id"])
+    return ""
+
+class UpdateQueue:
+    """Telegram updates waiting to be handled, in SQLite shared by all processes.
+    
+    Claimed updates are deleted once acknowledged; updates claimed by a
+    worker that died are handed out again after UPDATE_CLAIM_TIMEOUT.
+    """
+    
+    def __init__(self, path: Optional[str] = None, partitions: Optional[int] = None):
+        self.path = path or Config.UPDATE_QUEUE_PATH
+        self.partitions = partitions or Config.BOT_WORKERS
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS updates ("
+                        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                        " partition INTEGER NOT NULL,"
+                        " user_id TEXT NOT NULL,"
+                        " payload TEXT NOT NULL,"
+                        " claimed_at REAL)"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_updates_partition ON updates (partition, id)")
+                    conn.commit()
+                    self._conn = conn
+        return self._conn
+    
+    def put(self, payload: Dict[str, Any]) -> int:
+        """Queue an update; returns its partition."""
+        user_id = update_user_id(payload)
+        partition = partition_for(user_id, self.partitions)
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO updates (partition, user_id, payload) VALUES (?, ?, ?)",
+                (partition, user_id, json.dumps(payload))
+            )
+            self.conn.commit()
+        return partition
+    
+    def claim(
+        self,
+        partition: int,
+        limit: int,
+        in_flight: Collection[int] = ()
+    ) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """Claim up to limit of a partition's oldest updates as (id, user_id, payload).
+        
+        Updates in in_flight, which the caller is still handling, are never
+        handed back to it however long ago they were claimed.
+        """
+        now = time.time()
+        excluded = f" AND id NOT IN ({', '.join('?' * len(in_flight))})" if in_flight else ""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, user_id, payload FROM updates"
+                " WHERE partition = ? AND (claimed_at IS NULL OR claimed_at < ?)" + excluded +
+                " ORDER BY id LIMIT ?",
+                (partition, now - Config.UPDATE_CLAIM_TIMEOUT, *in_flight, limit)
+            ).fetchall()
+            if rows:
+                self.conn.executemany(
+                    "UPDATE updates SET claimed_at = ? WHERE id = ?",
+                    [(now, row[0]) for row in rows]
+                )
+                self.conn.commit()
+        return [(row_id, user_id, json.loads(payload)) for row_id, user_id, payload in rows]
+    
+    def ack(self, update_id: int):
+        with self._lock:
+            self.conn.execute("DELETE FROM updates WHERE id = ?", (update_id,))
+            self.conn.commit()
+    
+    def depth(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM updates").fetchone()[0]
+
+_queue: Optional[UpdateQueue] = None
+
+def app(environ, start_response):
+    """WSGI front for gunicorn: accept Telegram's webhook posts and queue them."""
+    global _queue
+    if _queue is None:
+        _queue = UpdateQueue()
+    
+    method = environ["REQUEST_METHOD"]
+    path = environ.get("PATH_INFO", "")
+    if method == "GET" and path == "/healthz":
+        return _respond(start_response, "200 OK", {"status": "ok", "queued": _queue.depth()})
+    if method != "POST" or path != Config.WEBHOOK_PATH:
+        return _respond(start_response, "404 Not Found", {"error": "not found"})
+    if Config.WEBHOOK_SECRET and environ.get("HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN") != Config.WEBHOOK_SECRET:
+        return _respond(start_response, "403 Forbidden", {"error": "bad secret token"})
+    
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        payload = json.loads(environ["wsgi.input"].read(length))
+    except (ValueError, KeyError) as e:
+        logger.warning(f"Rejected malformed update: {str(e)}")
+        return _respond(start_response, "400 Bad Request", {"error": "malformed update"})
+    
+    try:
+        _queue.put(payload)
+    except Exception as e:
+        # A non-2xx reply makes Telegram retry the update later
+        logger.error(f"Error queueing update: {str(e)}")
+        return _respond(start_response, "503 Service Unavailable", {"error": "queue unavailable"})
+    return _respond(start_response, "200 OK", {"ok": True})
+
+def _respond(start_response, status: str, body: Dict[str, Any]):
+    data = json.dumps(body).encode("utf-8")
+    start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(data)))])
+    return [data]
+
+class UpdateWorker:
+    """Handles one partition of the update queue with a bot application.
+    
+    Up to WORKER_CONCURRENCY updates are in flight at once; a user's updates
+    wait for each other so they are handled in the order they arrived.
+    """
+    
+    def __init__(self, bot, partition: int, queue: Optional[UpdateQueue] = None):
+        self.bot = bot
+        self.partition = partition
+        self.queue = queue or UpdateQueue()
+        self.concurrency = Config.WORKER_CONCURRENCY
+        # Ids of the updates being handled, including those waiting behind their user's earlier ones
+        self._in_flight: Set[int] = set()
+        self._tasks = set()
+    
+    async def run(self):
+        from telegram import Update
+        
+        application = self.bot.build_application(updater=False)
+        await application.initialize()
+        await self.bot.post_init(application)
+        logger.info(f"Worker for partition {self.partition} is running...")
+        try:
+            while True:
+                claimed = await asyncio.to_thread(
+                    self.queue.claim, self.partition, self.concurrency - len(self._in_flight), list(self._in_flight)
+                )
+                if not claimed:
+                    await asyncio.sleep(Config.WORKER_POLL_INTERVAL)
+                    continue
+                for update_id, user_id, payload in claimed:
+                    self._in_flight.add(update_id)
+                    task = asyncio.create_task(
+                        self._handle(application, update_id, user_id, Update.de_json(payload, application.bot))
+                    )
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                while len(self._in_flight) >= self.concurrency:
+                    await asyncio.sleep(Config.WORKER_POLL_INTERVAL)
+        finally:
+            await self.bot.post_shutdown(application)
+            await application.shutdown()
+    
+    async def _handle(self, application, update_id: int, user_id: str, update):
+        try:
+            # The application's update processor holds each user's updates in order
+            await application.update_processor.process_update(update, application.process_update(update))
+        except Exception as e:
+            logger.error(f"Error handling update {update_id} for user {user_id}: {str(e)}")
+        finally:
+            await asyncio.to_thread(self.queue.ack, update_id)
+            self._in_flight.discard(update_id)
+
+def run_worker(partition: int):
+    """Entry point of a bot worker process."""
+    configure_logging()
+    from .bot import TelegramBot
+    
+    # Each worker serves its own metrics, next to the others'
+    if Config.METRICS_PORT:
+        Config.METRICS_PORT += partition
+    # Workers share the account's OpenAI limits; 0 means no limit, so a share
+    # is never rounded down to it
+    for name in ("OPENAI_EMBEDDING_RPM", "OPENAI_EMBEDDING_TPM", "OPENAI_CHAT_RPM", "OPENAI_CHAT_TPM"):
+        limit = getattr(Config, name)
+        if limit:
+            setattr(Config, name, max(1, limit // Config.BOT_WORKERS))
+    bot = TelegramBot()
+    bot.ingestion.partition = partition
+    bot.reindexer.partition = partition
+    bot.summarizer.partition = partition
+    worker = UpdateWorker(bot, partition)
+    asyncio.run(worker.run())
+
+async def set_webhook():
+    """Point Telegram at WEBHOOK_URL + WEBHOOK_PATH."""
+    from telegram import Bot
+    
+    url = Config.WEBHOOK_URL.rstrip("/") + Config.WEBHOOK_PATH
+    async with Bot(Config.TELEGRAM_TOKEN) as bot:
+        await bot.set_webhook(url=url, secret_token=Config.WEBHOOK_SECRET or None, drop_pending_updates=False)
+    logger.info(f"Webhook set to {url}")
+
+def serve():
+    """Start BOT_WORKERS worker processes and the gunicorn front; stop all if one exits."""
+    if Config.WEBHOOK_URL:
+        asyncio.run(set_webhook())
+    else:
+        logger.warning("WEBHOOK_URL is not set; Telegram will not be told where to send updates")
+    
+    # Each bot process gets its share of the CPUs for parsing, unless configured
+    os.environ.setdefault("INGESTION_PROCESS_WORKERS", str(max(1, (os.cpu_count() or 1) // Config.BOT_WORKERS)))
+    # Let the cleanup below run when the platform stops us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_worker, args=(partition,), name=f"bot-worker-{partition}")
+        for partition in range(Config.BOT_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    front = subprocess.Popen([
+        sys.executable, "-m", "gunicorn",
+        "--workers", str(Config.WEBHOOK_FRONT_WORKERS),
+        "--bind", f"0.0.0.0:{Config.PORT}",
+        "src.webhook:app"
+    ])
+    logger.info(f"Serving webhook on port {Config.PORT} with {len(workers)} bot workers")
+    
+    try:
+        while front.poll() is None and all(worker.is_alive() for worker in workers):
+            time.sleep(1)
+        logger.error("A webhook process exited; shutting down")
+    finally:
+        front.terminate()
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+        front.wait()